@@ -0,0 +1,177 @@
+"""Generating CloudFormation template."""
+
+
+"""This template creates the template-builder image used by the pipelines'
+CFN build stages: an ECR repository and a CodeBuild project that builds the
+image with the generator dependencies pinned in builder_image.py and the
+cfgen package.
+
+Build the image once after creating the stack, and again after changing
+the pinned versions or cfgen (and updating the stack):
+
+aws codebuild start-build --project-name <stack name>-build
+
+then pass the BuilderImage output to the pipeline stacks' BuilderImage
+parameter.
+"""
+
+from awacs.aws import (
+    Allow,
+    Policy,
+    Principal,
+    Statement
+)
+
+from awacs.sts import AssumeRole
+
+from troposphere import (
+    Export,
+    Join,
+    Output,
+    Parameter,
+    Ref,
+    Sub,
+    Template
+)
+
+from troposphere.codebuild import (
+    Artifacts,
+    Environment,
+    Project,
+    Source
+)
+
+from troposphere.ecr import Repository
+
+from troposphere.iam import Role
+
+from builder_image import CFGEN_ARCHIVE, DOCKERFILE, IMAGE_TAG
+
+
+buildspec = """version: 0.1
+phases:
+  pre_build:
+    commands:
+      - aws ecr get-login-password | docker login --username AWS --password-stdin "${REPOSITORY_URI%%/*}"
+      - printf '%s' "$DOCKERFILE" > Dockerfile
+      - printf '%s' "$CFGEN_ARCHIVE" | base64 -d > cfgen.tar.gz
+  build:
+    commands:
+      - docker build -t "$REPOSITORY_URI:$IMAGE_TAG" .
+  post_build:
+    commands:
+      - docker push "$REPOSITORY_URI:$IMAGE_TAG"
+"""
+
+
+def build_builder_image_template(config=None):
+    """Build the template-builder image template."""
+    t = Template()
+
+    t.set_description("Template builder image for the CFN build stages")
+
+
+    ##############
+    # Parameters #
+    ##############
+
+    t.add_parameter(Parameter(
+        "RepositoryName",
+        Type="String",
+        Default="cfn-builder",
+        Description="Name of the ECR repository for the builder image"
+    ))
+
+
+    #############
+    # Resources #
+    #############
+
+
+    ### ECR ####
+    t.add_resource(Repository(
+        "BuilderRepository",
+        RepositoryName=Ref("RepositoryName")
+    ))
+
+    repositoryUri = Join("", [
+        Ref("AWS::AccountId"),
+        ".dkr.ecr.",
+        Ref("AWS::Region"),
+        ".amazonaws.com",
+        "/",
+        Ref("RepositoryName")])
+
+
+    #### CodeBuild ####
+
+    t.add_resource(Role(
+        "ServiceRole",
+        AssumeRolePolicyDocument=Policy(
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Action=[AssumeRole],
+                    Principal=Principal("Service", ["codebuild.amazonaws.com"])
+                )
+            ]
+        ),
+        Path="/",
+        ManagedPolicyArns=[
+            'arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryPowerUser',
+            'arn:aws:iam::aws:policy/CloudWatchLogsFullAccess'
+        ]
+    ))
+
+    environment = Environment(
+        ComputeType='BUILD_GENERAL1_SMALL',
+        Image='aws/codebuild/standard:7.0',
+        Type='LINUX_CONTAINER',
+        PrivilegedMode=True,
+        EnvironmentVariables=[
+            {'Name': 'DOCKERFILE', 'Value': DOCKERFILE},
+            {'Name': 'CFGEN_ARCHIVE', 'Value': CFGEN_ARCHIVE},
+            {'Name': 'IMAGE_TAG', 'Value': IMAGE_TAG},
+            {'Name': 'REPOSITORY_URI', 'Value': repositoryUri}
+        ],
+    )
+
+    t.add_resource(Project(
+        "BuilderImageBuild",
+        Name=Sub("${AWS::StackName}-build"),
+        Environment=environment,
+        ServiceRole=Ref("ServiceRole"),
+        Source=Source(
+            Type="NO_SOURCE",
+            BuildSpec=buildspec
+        ),
+        Artifacts=Artifacts(
+            Type="NO_ARTIFACTS"
+        ),
+        DependsOn="BuilderRepository",
+    ))
+
+
+    ###########
+    # Outputs #
+    ###########
+
+    t.add_output(Output(
+        "BuilderImage",
+        Description="Template builder image, for the pipelines' BuilderImage "
+                    "parameter",
+        Value=Join(":", [repositoryUri, IMAGE_TAG]),
+        Export=Export(Sub("${AWS::StackName}-image")),
+    ))
+
+    t.add_output(Output(
+        "BuildProject",
+        Description="CodeBuild project that builds and pushes the image",
+        Value=Ref("BuilderImageBuild"),
+    ))
+
+    return t
+
+
+if __name__ == '__main__':
+    print(build_builder_image_template().to_json())
@@ -31,14 +31,13 @@ from troposphere import (
 
 from troposphere.codebuild import (
     Artifacts,
-    Environment,
     Project,
     Source
 )
 
 from troposphere.codepipeline import (
     Actions,
-    ActionTypeID,
+    ActionTypeId,
     ArtifactStore,
     InputArtifacts,
     OutputArtifacts,
@@ -68,120 +67,38 @@ from troposphere.iam import (
     Role
 )
 
+from pipeline_layout import GATE_NAMESPACE, skip_unless_changed
 
-
-
-
-
-
-t = Template()
-
-t.add_description("ALB and Route53 Pipeline")
-
-
-##############
-# Parameters #
-##############
-
-t.add_parameter(Parameter(
-    "RepoName",
-    Type="String",
-    Description="CodeCommit Repo containing ECS template"
-))
-
-t.add_parameter(Parameter(
-    "StageVpcId",
-    Type="AWS::EC2::VPC::Id",
-    Description="Staging VPC (format: vpc-263e8d41)"
-))
-
-t.add_parameter(Parameter(
-    "StagePublicSubnet",
-    Description="Staging PublicSubnet (format: subnet-2480c343,subnet-7a8a1621)",
-    Type="List<AWS::EC2::Subnet::Id>"
-))
-
-t.add_parameter(Parameter(
-    "ProdVpcId",
-    Type="AWS::EC2::VPC::Id",
-    Description="Prod VPC"
-))
-
-t.add_parameter(Parameter(
-    "ProdPublicSubnet",
-    Description="Prod PublicSubnet",
-    Type="List<AWS::EC2::Subnet::Id>"
-))
-
-t.add_parameter(Parameter(
-    "KeyPair",
-    Description="Name of an existing EC2 KeyPair to SSH",
-    Type="AWS::EC2::KeyPair::KeyName",
-    ConstraintDescription="must be the name of an existing EC2 KeyPair.",
-))
-
-#############
-# Resources #
-#############
-
-
-
-
-#### CodeBuild ####
-
-t.add_resource(Role(
-    "ServiceRole",
-    AssumeRolePolicyDocument=Policy(
-        Statement=[
-            Statement(
-                Effect=Allow,
-                Action=[AssumeRole],
-                Principal=Principal("Service", ["codebuild.amazonaws.com"])
-            )
-        ]
-    ),
-    Path="/",
-    ManagedPolicyArns=[
-        'arn:aws:iam::aws:policy/AWSCodePipelineReadOnlyAccess',
-        'arn:aws:iam::aws:policy/AWSCodeBuildDeveloperAccess',
-        'arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryPowerUser',
-        'arn:aws:iam::aws:policy/AmazonS3FullAccess',
-        'arn:aws:iam::aws:policy/CloudWatchLogsFullAccess'
-    ]
-))
-
-environment = Environment(
-    ComputeType='BUILD_GENERAL1_SMALL',
-    Image='aws/codebuild/python:3.5.2',
-    Type='LINUX_CONTAINER',
-    EnvironmentVariables=[
-        {'Name': 'StageVpcId', 'Value': Ref("StageVpcId")},
-        {'Name': 'StagePublicSubnet', 'Value': Join(',', Ref("StagePublicSubnet"))},
-        {'Name': 'ProdVpcId', 'Value': Ref("ProdVpcId")},
-        {'Name': 'ProdPublicSubnet', 'Value': Join(',', Ref("StagePublicSubnet"))},
-        {'Name': 'KeyPair', 'Value': Ref("KeyPair")}
-    ],
+from pipeline_trigger import (
+    add_branch_parameter,
+    add_source_trigger,
+    source_configuration
 )
 
+from builder_image import (
+    add_builder_image,
+    builder_environment
+)
 
 
-
-
-buildspec = """version: 0.1
+buildspec = """version: 0.2
+env:
+  exported-variables:
+    - STAG_CHANGED
+    - PROD_CHANGED
 phases:
-  pre_build:
-    commands:
-      - pip install troposphere
-      - pip install pyyaml
   build:
     commands:
       - echo "Starting python execution"
       - python ecs-cluster-cf-template.py > /tmp/ecs-cluster-cf.template
+      - cp schedulable_slots.py /tmp/schedulable_slots.py
       - printf '{"StageVpcId":"%s"}' "$StageVpcId" > /tmp/StageVpcId.json
       - printf '{"StagePublicSubnet":"%s"}' "$StagePublicSubnet" > /tmp/StagePublicSubnet.json
       - printf '{"ProdVpcId":"%s"}' "$ProdVpcId" > /tmp/ProdVpcId.json
       - printf '{"ProdPublicSubnet":"%s"}' "$ProdPublicSubnet" > /tmp/ProdPublicSubnet.json
       - printf '{"KeyPair":"%s"}' "$KeyPair" > /tmp/KeyPair.json
+      - python -m cfgen.deploy_gate /tmp/ecs-cluster-cf.template --output-dir /tmp --stack STAG stag-cluster /tmp/StageVpcId.json /tmp/StagePublicSubnet.json /tmp/KeyPair.json --stack PROD prod-cluster /tmp/ProdVpcId.json /tmp/ProdPublicSubnet.json /tmp/KeyPair.json > deploy_gate.env
+      - . ./deploy_gate.env
   post_build:
     commands:
       - echo "Completed CFN template creation."
@@ -192,257 +109,372 @@ artifacts:
 """
 
 
-t.add_resource(Project(
-    "CodeBuild",
-    Name=Join(
-            "-",
-            [Select(0, Split("-", Ref("AWS::StackName"))),
-                "codebuild"]
-        ),
-    Environment=environment,
-    ServiceRole=Ref("ServiceRole"),
-    Source=Source(
-        Type="CODEPIPELINE",
-        BuildSpec=buildspec
-    ),
-    Artifacts=Artifacts(
-        Type="CODEPIPELINE",
-        Name="output"
-    ),
-))
+def build_ecs_pipeline_template(config=None):
+    """Build the ECS cluster pipeline template."""
+    t = Template()
 
+    t.set_description("ALB and Route53 Pipeline")
 
 
+    ##############
+    # Parameters #
+    ##############
 
+    t.add_parameter(Parameter(
+        "RepoName",
+        Type="String",
+        Description="CodeCommit Repo containing ECS template"
+    ))
 
+    t.add_parameter(Parameter(
+        "StageVpcId",
+        Type="AWS::EC2::VPC::Id",
+        Description="Staging VPC (format: vpc-263e8d41)"
+    ))
 
-#### CodePipeline ####
-t.add_resource(Bucket(
-    "S3Bucket",
-    VersioningConfiguration=VersioningConfiguration(
-        Status="Enabled",
-    )
-))
-
-t.add_resource(Role(
-    "PipelineRole",
-    AssumeRolePolicyDocument=Policy(
-        Statement=[
-            Statement(
-                Effect=Allow,
-                Action=[AssumeRole],
-                Principal=Principal("Service", ["codepipeline.amazonaws.com"])
-            )
-        ]
-    ),
-    Path="/",
-    Policies=[
-        IAMPolicy(
-            PolicyName="ClusterCodePipeline",
-            PolicyDocument={
-                "Statement": [
-                    {"Effect": "Allow", "Action": "cloudformation:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "codebuild:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "codepipeline:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ecr:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ecs:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "iam:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "s3:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "codecommit:*", "Resource": "*"},
-                ],
-            }
-        ),
-    ]
-))
-
-t.add_resource(Role(
-    "CloudFormationClusterRole",
-    RoleName=Join(
-            "-",
-            [Select(0, Split("-", Ref("AWS::StackName"))),
-                "CloudFormationClusterRole"]
+    t.add_parameter(Parameter(
+        "StagePublicSubnet",
+        Description="Staging PublicSubnet (format: subnet-2480c343,subnet-7a8a1621)",
+        Type="List<AWS::EC2::Subnet::Id>"
+    ))
+
+    t.add_parameter(Parameter(
+        "ProdVpcId",
+        Type="AWS::EC2::VPC::Id",
+        Description="Prod VPC"
+    ))
+
+    t.add_parameter(Parameter(
+        "ProdPublicSubnet",
+        Description="Prod PublicSubnet",
+        Type="List<AWS::EC2::Subnet::Id>"
+    ))
+
+    t.add_parameter(Parameter(
+        "KeyPair",
+        Description="Name of an existing EC2 KeyPair to SSH",
+        Type="AWS::EC2::KeyPair::KeyName",
+        ConstraintDescription="must be the name of an existing EC2 KeyPair.",
+    ))
+
+    add_branch_parameter(t)
+
+    add_builder_image(t, required=True)
+
+    #############
+    # Resources #
+    #############
+
+
+    #### CodeBuild ####
+
+    t.add_resource(Role(
+        "ServiceRole",
+        AssumeRolePolicyDocument=Policy(
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Action=[AssumeRole],
+                    Principal=Principal("Service", ["codebuild.amazonaws.com"])
+                )
+            ]
         ),
-    Path="/",
-    AssumeRolePolicyDocument=Policy(
-        Statement=[
-            Statement(
-                Effect=Allow,
-                Action=[AssumeRole],
-                Principal=Principal(
-                    "Service", ["cloudformation.amazonaws.com"])
+        Path="/",
+        ManagedPolicyArns=[
+            'arn:aws:iam::aws:policy/AWSCodePipelineReadOnlyAccess',
+            'arn:aws:iam::aws:policy/AWSCodeBuildDeveloperAccess',
+            'arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryPowerUser',
+            'arn:aws:iam::aws:policy/AmazonS3FullAccess',
+            'arn:aws:iam::aws:policy/CloudWatchLogsFullAccess'
+        ],
+        Policies=[
+            IAMPolicy(
+                PolicyName="DeployGate",
+                PolicyDocument={
+                    "Statement": [
+                        {"Effect": "Allow", "Action": "cloudformation:DescribeStacks", "Resource": "*"},
+                    ],
+                }
             ),
         ]
-    ),
-    Policies=[
-        IAMPolicy(
-            PolicyName="CloudFormationClusterPolicy",
-            PolicyDocument={
-                "Statement": [
-                    {"Effect": "Allow", "Action": "cloudformation:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ecr:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ecs:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "iam:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ec2:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "autoscaling:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "elasticloadbalancing:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "route53:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "codecommit:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "cloudwatch:*", "Resource": "*"},
-                ],
-            }
+    ))
+
+    environment = builder_environment(
+        required=True,
+        ComputeType='BUILD_GENERAL1_SMALL',
+        Type='LINUX_CONTAINER',
+        EnvironmentVariables=[
+            {'Name': 'StageVpcId', 'Value': Ref("StageVpcId")},
+            {'Name': 'StagePublicSubnet', 'Value': Join(',', Ref("StagePublicSubnet"))},
+            {'Name': 'ProdVpcId', 'Value': Ref("ProdVpcId")},
+            {'Name': 'ProdPublicSubnet', 'Value': Join(',', Ref("StagePublicSubnet"))},
+            {'Name': 'KeyPair', 'Value': Ref("KeyPair")}
+        ],
+    )
+
+
+    t.add_resource(Project(
+        "CodeBuild",
+        Name=Join(
+                "-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                    "codebuild"]
+            ),
+        Environment=environment,
+        ServiceRole=Ref("ServiceRole"),
+        Source=Source(
+            Type="CODEPIPELINE",
+            BuildSpec=buildspec
         ),
-    ]
-))
-
-t.add_resource(Pipeline(
-    "ClusterPipeline",
-    RoleArn=GetAtt("PipelineRole", "Arn"),
-    ArtifactStore=ArtifactStore(
-        Type="S3",
-        Location=Ref("S3Bucket")
-    ),
-    Stages=[
-        Stages(
-            Name="Source",
-            Actions=[
-                Actions(
-                    Name="Source",
-                    ActionTypeId=ActionTypeID(
-                        Category="Source",
-                        Owner="AWS",
-                        Version="1",
-                        Provider="CodeCommit"
-                    ),
-                    Configuration={
-                        "BranchName": "master",
-                        "RepositoryName": Ref("RepoName")
-                    },
-                    OutputArtifacts=[
-                        OutputArtifacts(
-                            Name="App"
-                        )
-                    ],
+        Artifacts=Artifacts(
+            Type="CODEPIPELINE",
+            Name="output"
+        ),
+    ))
+
+
+    #### CodePipeline ####
+    t.add_resource(Bucket(
+        "S3Bucket",
+        VersioningConfiguration=VersioningConfiguration(
+            Status="Enabled",
+        )
+    ))
+
+    t.add_resource(Role(
+        "PipelineRole",
+        AssumeRolePolicyDocument=Policy(
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Action=[AssumeRole],
+                    Principal=Principal("Service", ["codepipeline.amazonaws.com"])
                 )
             ]
         ),
-        Stages(
-            Name="Build",
-            Actions=[
-                Actions(
-                    Name="Container",
-                    ActionTypeId=ActionTypeID(
-                        Category="Build",
-                        Owner="AWS",
-                        Version="1",
-                        Provider="CodeBuild"
-                    ),
-                    Configuration={
-                        "ProjectName":Join(
-                                "-",
-                                [Select(0, Split("-", Ref("AWS::StackName"))),
-                                    "codebuild"]
-                            ),
-                    },
-                    InputArtifacts=[
-                        InputArtifacts(
-                            Name="App"
-                        )
+        Path="/",
+        Policies=[
+            IAMPolicy(
+                PolicyName="ClusterCodePipeline",
+                PolicyDocument={
+                    "Statement": [
+                        {"Effect": "Allow", "Action": "cloudformation:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "codebuild:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "codepipeline:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ecr:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ecs:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "iam:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "s3:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "codecommit:*", "Resource": "*"},
                     ],
-                    OutputArtifacts=[
-                        OutputArtifacts(
-                            Name="BuildOutput"
-                        )
-                    ],
-                )
+                }
+            ),
+        ]
+    ))
+
+    t.add_resource(Role(
+        "CloudFormationClusterRole",
+        RoleName=Join(
+                "-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                    "CloudFormationClusterRole"]
+            ),
+        Path="/",
+        AssumeRolePolicyDocument=Policy(
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Action=[AssumeRole],
+                    Principal=Principal(
+                        "Service", ["cloudformation.amazonaws.com"])
+                ),
             ]
         ),
-        Stages(
-            Name="Staging",
-            Actions=[
-                Actions(
-                    Name="Deploy",
-                    ActionTypeId=ActionTypeID(
-                        Category="Deploy",
-                        Owner="AWS",
-                        Version="1",
-                        Provider="CloudFormation"
-                    ),
-                    Configuration={
-                        "ChangeSetName": "Deploy",
-                        "ActionMode": "CREATE_UPDATE",
-                        "StackName": "stag-cluster",
-                        "Capabilities": "CAPABILITY_NAMED_IAM",
-                        "TemplatePath": "BuildOutput::ecs-cluster-cf.template",
-                        "RoleArn": GetAtt("CloudFormationClusterRole", "Arn"),
-                        "ParameterOverrides": """{"VpcId" : { "Fn::GetParam" : [ "BuildOutput", "StageVpcId.json", "StageVpcId" ] },
-                        "PublicSubnet" : { "Fn::GetParam" : [ "BuildOutput", "StagePublicSubnet.json", "StagePublicSubnet" ] },
-                        "KeyPair" : { "Fn::GetParam" : [ "BuildOutput", "KeyPair.json", "KeyPair" ] } }"""
-                    },
-                    InputArtifacts=[
-                        InputArtifacts(
-                            Name="App",
-                        ),
-                        InputArtifacts(
-                            Name="BuildOutput"
-                        )
+        Policies=[
+            IAMPolicy(
+                PolicyName="CloudFormationClusterPolicy",
+                PolicyDocument={
+                    "Statement": [
+                        {"Effect": "Allow", "Action": "cloudformation:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ecr:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ecs:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "iam:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ec2:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "autoscaling:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "elasticloadbalancing:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "route53:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "codecommit:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "cloudwatch:*", "Resource": "*"},
+                        # SchedulableSlots runs its agent as a scheduled function
+                        {"Effect": "Allow", "Action": "events:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "lambda:*", "Resource": "*"},
+                        # Which loads its code from the pipeline's artifacts
+                        {"Effect": "Allow", "Action": "s3:GetObject", "Resource": Sub("${S3Bucket.Arn}/*")},
+                        # Overprovisioning scales its placeholder service
+                        {"Effect": "Allow", "Action": "application-autoscaling:*", "Resource": "*"},
                     ],
-                )
-            ]
+                }
+            ),
+        ]
+    ))
+
+    t.add_resource(Pipeline(
+        "ClusterPipeline",
+        PipelineType="V2",
+        RoleArn=GetAtt("PipelineRole", "Arn"),
+        ArtifactStore=ArtifactStore(
+            Type="S3",
+            Location=Ref("S3Bucket")
         ),
-        Stages(
-            Name="Deploy",
-            Actions=[
-                Actions(
-                    Name="Deploy",
-                    ActionTypeId=ActionTypeID(
-                        Category="Deploy",
-                        Owner="AWS",
-                        Version="1",
-                        Provider="CloudFormation"
-                    ),
-                    Configuration={
-                        "ChangeSetName": "Deploy",
-                        "ActionMode": "CREATE_UPDATE",
-                        "StackName": "prod-cluster",
-                        "Capabilities": "CAPABILITY_NAMED_IAM",
-                        "TemplatePath": "BuildOutput::ecs-cluster-cf.template",
-                        "RoleArn": GetAtt("CloudFormationClusterRole", "Arn"),
-                        "ParameterOverrides": """{"VpcId" : { "Fn::GetParam" : [ "BuildOutput", "ProdVpcId.json", "ProdVpcId" ] } ,
-                        "PublicSubnet" : { "Fn::GetParam" : [ "BuildOutput", "ProdPublicSubnet.json", "ProdPublicSubnet" ] },
-                        "KeyPair" : { "Fn::GetParam" : [ "BuildOutput", "KeyPair.json", "KeyPair" ] } }"""
-                    },
-                    InputArtifacts=[
-                        InputArtifacts(
-                            Name="App",
+        Stages=[
+            Stages(
+                Name="Source",
+                Actions=[
+                    Actions(
+                        Name="Source",
+                        ActionTypeId=ActionTypeId(
+                            Category="Source",
+                            Owner="AWS",
+                            Version="1",
+                            Provider="CodeCommit"
                         ),
-                        InputArtifacts(
-                            Name="BuildOutput"
-                        )
-                    ],
-                )
-            ]
-        )
-    ],
-))
-
-
+                        Configuration=source_configuration(Ref("RepoName")),
+                        OutputArtifacts=[
+                            OutputArtifacts(
+                                Name="App"
+                            )
+                        ],
+                    )
+                ]
+            ),
+            Stages(
+                Name="Build",
+                Actions=[
+                    Actions(
+                        Name="Container",
+                        Namespace=GATE_NAMESPACE,
+                        ActionTypeId=ActionTypeId(
+                            Category="Build",
+                            Owner="AWS",
+                            Version="1",
+                            Provider="CodeBuild"
+                        ),
+                        Configuration={
+                            "ProjectName":Join(
+                                    "-",
+                                    [Select(0, Split("-", Ref("AWS::StackName"))),
+                                        "codebuild"]
+                                ),
+                        },
+                        InputArtifacts=[
+                            InputArtifacts(
+                                Name="App"
+                            )
+                        ],
+                        OutputArtifacts=[
+                            OutputArtifacts(
+                                Name="BuildOutput"
+                            )
+                        ],
+                    )
+                ]
+            ),
+            Stages(
+                Name="Staging",
+                BeforeEntry=skip_unless_changed("STAG"),
+                Actions=[
+                    Actions(
+                        Name="Deploy",
+                        ActionTypeId=ActionTypeId(
+                            Category="Deploy",
+                            Owner="AWS",
+                            Version="1",
+                            Provider="CloudFormation"
+                        ),
+                        Configuration={
+                            "ChangeSetName": "Deploy",
+                            "ActionMode": "CREATE_UPDATE",
+                            "StackName": "stag-cluster",
+                            "Capabilities": "CAPABILITY_NAMED_IAM",
+                            "TemplatePath": "BuildOutput::ecs-cluster-cf.template",
+                            "TemplateConfiguration": "BuildOutput::stag-configuration.json",
+                            "RoleArn": GetAtt("CloudFormationClusterRole", "Arn"),
+                            "ParameterOverrides": """{"VpcId" : { "Fn::GetParam" : [ "BuildOutput", "StageVpcId.json", "StageVpcId" ] },
+                            "PublicSubnet" : { "Fn::GetParam" : [ "BuildOutput", "StagePublicSubnet.json", "StagePublicSubnet" ] },
+                            "KeyPair" : { "Fn::GetParam" : [ "BuildOutput", "KeyPair.json", "KeyPair" ] },
+                            "SlotsAgentBucket" : { "Fn::GetArtifactAtt" : [ "BuildOutput", "BucketName" ] },
+                            "SlotsAgentKey" : { "Fn::GetArtifactAtt" : [ "BuildOutput", "ObjectKey" ] } }"""
+                        },
+                        InputArtifacts=[
+                            InputArtifacts(
+                                Name="App",
+                            ),
+                            InputArtifacts(
+                                Name="BuildOutput"
+                            )
+                        ],
+                    )
+                ]
+            ),
+            Stages(
+                Name="Deploy",
+                BeforeEntry=skip_unless_changed("PROD"),
+                Actions=[
+                    Actions(
+                        Name="Deploy",
+                        ActionTypeId=ActionTypeId(
+                            Category="Deploy",
+                            Owner="AWS",
+                            Version="1",
+                            Provider="CloudFormation"
+                        ),
+                        Configuration={
+                            "ChangeSetName": "Deploy",
+                            "ActionMode": "CREATE_UPDATE",
+                            "StackName": "prod-cluster",
+                            "Capabilities": "CAPABILITY_NAMED_IAM",
+                            "TemplatePath": "BuildOutput::ecs-cluster-cf.template",
+                            "TemplateConfiguration": "BuildOutput::prod-configuration.json",
+                            "RoleArn": GetAtt("CloudFormationClusterRole", "Arn"),
+                            "ParameterOverrides": """{"VpcId" : { "Fn::GetParam" : [ "BuildOutput", "ProdVpcId.json", "ProdVpcId" ] } ,
+                            "PublicSubnet" : { "Fn::GetParam" : [ "BuildOutput", "ProdPublicSubnet.json", "ProdPublicSubnet" ] },
+                            "KeyPair" : { "Fn::GetParam" : [ "BuildOutput", "KeyPair.json", "KeyPair" ] },
+                            "SlotsAgentBucket" : { "Fn::GetArtifactAtt" : [ "BuildOutput", "BucketName" ] },
+                            "SlotsAgentKey" : { "Fn::GetArtifactAtt" : [ "BuildOutput", "ObjectKey" ] } }"""
+                        },
+                        InputArtifacts=[
+                            InputArtifacts(
+                                Name="App",
+                            ),
+                            InputArtifacts(
+                                Name="BuildOutput"
+                            )
+                        ],
+                    )
+                ]
+            )
+        ],
+    ))
 
+    add_source_trigger(t, "ClusterPipeline", Ref("RepoName"))
 
 
-###########
-# Outputs #
-###########
+    ###########
+    # Outputs #
+    ###########
 
-t.add_output(Output(
-    "CodebuildName",
-    Description="Codebuild Name",
-    Value=Join(
-            "-",
-            [Select(0, Split("-", Ref("AWS::StackName"))),
-                "codebuild"]
-        )
-))
+    t.add_output(Output(
+        "CodebuildName",
+        Description="Codebuild Name",
+        Value=Join(
+                "-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                    "codebuild"]
+            )
+    ))
 
+    return t
 
 
-print(t.to_json())
+if __name__ == '__main__':
+    print(build_ecs_pipeline_template().to_json())
@@ -30,14 +30,13 @@ from troposphere import (
 
 from troposphere.codebuild import (
     Artifacts,
-    Environment,
     Project,
     Source
 )
 
 from troposphere.codepipeline import (
     Actions,
-    ActionTypeID,
+    ActionTypeId,
     ArtifactStore,
     InputArtifacts,
     OutputArtifacts,
@@ -51,309 +50,317 @@ from troposphere.iam import Policy as IAMPolicy
 
 from troposphere.s3 import Bucket, VersioningConfiguration
 
-
-
-
-t = Template()
-
-t.add_description("ALB and Route53 Pipeline")
-
-
-##############
-# Parameters #
-##############
-
-
-t.add_parameter(Parameter(
-    "RepoName",
-    Type="String",
-    Default="alb-route53-cf",
-    Description="Name of the CodeCommit repository to source"
-))
-
-
-
-t.add_parameter(Parameter(
-    "Route53DomainName",
-    Type="String",
-    Default="data-muffin.com",
-    Description="Domain name registered in Route53"
-))
-
-
-#############
-# Resources #
-#############
-
-
-
-
-#### CodeBuild ####
-
-t.add_resource(Role(
-    "ServiceRole",
-    AssumeRolePolicyDocument=Policy(
-        Statement=[
-            Statement(
-                Effect=Allow,
-                Action=[AssumeRole],
-                Principal=Principal("Service", ["codebuild.amazonaws.com"])
-            )
-        ]
-    ),
-    Path="/",
-    ManagedPolicyArns=[
-        'arn:aws:iam::aws:policy/AWSCodePipelineReadOnlyAccess',
-        'arn:aws:iam::aws:policy/AWSCodeBuildDeveloperAccess',
-        'arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryPowerUser',
-        'arn:aws:iam::aws:policy/AmazonS3FullAccess',
-        'arn:aws:iam::aws:policy/CloudWatchLogsFullAccess'
-    ]
-))
-
-environment = Environment(
-    ComputeType='BUILD_GENERAL1_SMALL',
-    Image='aws/codebuild/python:3.5.2',
-    Type='LINUX_CONTAINER',
-    EnvironmentVariables=[],
+from pipeline_trigger import (
+    add_branch_parameter,
+    add_source_trigger,
+    source_configuration
 )
 
-
-
+from builder_image import (
+    INSTALL_COMMAND,
+    add_builder_image,
+    builder_environment
+)
 
 
 buildspec = """version: 0.1
 phases:
   pre_build:
     commands:
-      - pip install troposphere
-      - pip install pyyaml
+      - """ + INSTALL_COMMAND + """
   build:
     commands:
       - echo "Starting python execution"
-      - python alb-route53-cf-template.py > /tmp/alb-route53-cf.template
+      - python alb-route53-cf-template.py --output-dir /tmp/alb-route53
+      - aws cloudformation package --template-file /tmp/alb-route53/alb-route53-cf.template --s3-bucket "$ARTIFACT_BUCKET" --s3-prefix alb-route53-stacks --use-json --output-template-file /tmp/alb-route53-cf.template
   post_build:
     commands:
       - echo "Completed CFN template creation."
 artifacts:
-  files: /tmp/alb-route53-cf.template
+  files:
+    - /tmp/alb-route53-cf.template
   discard-paths: yes
 """
 
 
-t.add_resource(Project(
-    "CodeBuild",
-    Name=Join(
-            "-",
-            [Select(0, Split("-", Ref("AWS::StackName"))),
-                "codebuild"]
-        ),
-    Environment=environment,
-    ServiceRole=Ref("ServiceRole"),
-    Source=Source(
-        Type="CODEPIPELINE",
-        BuildSpec=buildspec
-    ),
-    Artifacts=Artifacts(
-        Type="CODEPIPELINE",
-        Name="output"
-    ),
-))
+def build_alb_route53_pipeline_template(config=None):
+    """Build the ALB and Route53 pipeline template."""
+    t = Template()
 
+    t.set_description("ALB and Route53 Pipeline")
 
 
+    ##############
+    # Parameters #
+    ##############
 
 
+    t.add_parameter(Parameter(
+        "RepoName",
+        Type="String",
+        Default="alb-route53-cf",
+        Description="Name of the CodeCommit repository to source"
+    ))
 
-#### CodePipeline ####
-t.add_resource(Bucket(
-    "S3Bucket",
-    VersioningConfiguration=VersioningConfiguration(
-        Status="Enabled",
-    )
-))
-
-t.add_resource(Role(
-    "PipelineRole",
-    AssumeRolePolicyDocument=Policy(
-        Statement=[
-            Statement(
-                Effect=Allow,
-                Action=[AssumeRole],
-                Principal=Principal("Service", ["codepipeline.amazonaws.com"])
-            )
-        ]
-    ),
-    Path="/",
-    Policies=[
-        IAMPolicy(
-            PolicyName="NetworkCodePipeline",
-            PolicyDocument={
-                "Statement": [
-                    {"Effect": "Allow", "Action": "cloudformation:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "codebuild:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "codepipeline:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ecr:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ecs:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "iam:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "s3:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "codecommit:*", "Resource": "*"},
-                ],
-            }
-        ),
-    ]
-))
-
-t.add_resource(Role(
-    "CloudFormationNetworkRole",
-    RoleName=Join(
-            "-",
-            [Select(0, Split("-", Ref("AWS::StackName"))),
-                "CloudFormationNetworkRole"]
+
+    t.add_parameter(Parameter(
+        "Route53DomainName",
+        Type="String",
+        Default="data-muffin.com",
+        Description="Domain name registered in Route53"
+    ))
+
+
+    add_branch_parameter(t)
+
+    add_builder_image(t)
+
+
+    #############
+    # Resources #
+    #############
+
+
+    #### CodeBuild ####
+
+    t.add_resource(Role(
+        "ServiceRole",
+        AssumeRolePolicyDocument=Policy(
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Action=[AssumeRole],
+                    Principal=Principal("Service", ["codebuild.amazonaws.com"])
+                )
+            ]
         ),
-    Path="/",
-    AssumeRolePolicyDocument=Policy(
-        Statement=[
-            Statement(
-                Effect=Allow,
-                Action=[AssumeRole],
-                Principal=Principal(
-                    "Service", ["cloudformation.amazonaws.com"])
-            ),
+        Path="/",
+        ManagedPolicyArns=[
+            'arn:aws:iam::aws:policy/AWSCodePipelineReadOnlyAccess',
+            'arn:aws:iam::aws:policy/AWSCodeBuildDeveloperAccess',
+            'arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryPowerUser',
+            'arn:aws:iam::aws:policy/AmazonS3FullAccess',
+            'arn:aws:iam::aws:policy/CloudWatchLogsFullAccess'
         ]
-    ),
-    Policies=[
-        IAMPolicy(
-            PolicyName="CloudFormationNetworkPolicy",
-            PolicyDocument={
-                "Statement": [
-                    {"Effect": "Allow", "Action": "cloudformation:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ecr:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ecs:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "iam:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ec2:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "elasticloadbalancing:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "route53:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "codecommit:*", "Resource": "*"},
-                ],
-            }
+    ))
+
+    environment = builder_environment(
+        ComputeType='BUILD_GENERAL1_SMALL',
+        Type='LINUX_CONTAINER',
+        EnvironmentVariables=[
+            {'Name': 'ARTIFACT_BUCKET', 'Value': Ref("S3Bucket")}
+        ],
+    )
+
+
+    t.add_resource(Project(
+        "CodeBuild",
+        Name=Join(
+                "-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                    "codebuild"]
+            ),
+        Environment=environment,
+        ServiceRole=Ref("ServiceRole"),
+        Source=Source(
+            Type="CODEPIPELINE",
+            BuildSpec=buildspec
         ),
-    ]
-))
-
-t.add_resource(Pipeline(
-    "NetworkPipeline",
-    RoleArn=GetAtt("PipelineRole", "Arn"),
-    ArtifactStore=ArtifactStore(
-        Type="S3",
-        Location=Ref("S3Bucket")
-    ),
-    Stages=[
-        Stages(
-            Name="Source",
-            Actions=[
-                Actions(
-                    Name="Source",
-                    ActionTypeId=ActionTypeID(
-                        Category="Source",
-                        Owner="AWS",
-                        Version="1",
-                        Provider="CodeCommit"
-                    ),
-                    Configuration={
-                        "BranchName": "master",
-                        "RepositoryName": Ref("RepoName")
-                    },
-                    OutputArtifacts=[
-                        OutputArtifacts(
-                            Name="App"
-                        )
-                    ],
+        Artifacts=Artifacts(
+            Type="CODEPIPELINE",
+            Name="output"
+        ),
+    ))
+
+
+    #### CodePipeline ####
+    t.add_resource(Bucket(
+        "S3Bucket",
+        VersioningConfiguration=VersioningConfiguration(
+            Status="Enabled",
+        )
+    ))
+
+    t.add_resource(Role(
+        "PipelineRole",
+        AssumeRolePolicyDocument=Policy(
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Action=[AssumeRole],
+                    Principal=Principal("Service", ["codepipeline.amazonaws.com"])
                 )
             ]
         ),
-        Stages(
-            Name="Build",
-            Actions=[
-                Actions(
-                    Name="Container",
-                    ActionTypeId=ActionTypeID(
-                        Category="Build",
-                        Owner="AWS",
-                        Version="1",
-                        Provider="CodeBuild"
-                    ),
-                    Configuration={
-                        "ProjectName":Join(
-                                "-",
-                                [Select(0, Split("-", Ref("AWS::StackName"))),
-                                    "codebuild"]
-                            ),
-                    },
-                    InputArtifacts=[
-                        InputArtifacts(
-                            Name="App"
-                        )
-                    ],
-                    OutputArtifacts=[
-                        OutputArtifacts(
-                            Name="BuildOutput"
-                        )
+        Path="/",
+        Policies=[
+            IAMPolicy(
+                PolicyName="NetworkCodePipeline",
+                PolicyDocument={
+                    "Statement": [
+                        {"Effect": "Allow", "Action": "cloudformation:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "codebuild:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "codepipeline:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ecr:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ecs:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "iam:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "s3:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "codecommit:*", "Resource": "*"},
                     ],
-                )
+                }
+            ),
+        ]
+    ))
+
+    t.add_resource(Role(
+        "CloudFormationNetworkRole",
+        RoleName=Join(
+                "-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                    "CloudFormationNetworkRole"]
+            ),
+        Path="/",
+        AssumeRolePolicyDocument=Policy(
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Action=[AssumeRole],
+                    Principal=Principal(
+                        "Service", ["cloudformation.amazonaws.com"])
+                ),
             ]
         ),
-        Stages(
-            Name="Deploy",
-            Actions=[
-                Actions(
-                    Name="Deploy",
-                    ActionTypeId=ActionTypeID(
-                        Category="Deploy",
-                        Owner="AWS",
-                        Version="1",
-                        Provider="CloudFormation"
-                    ),
-                    Configuration={
-                        "ChangeSetName": "Deploy",
-                        "ActionMode": "CREATE_UPDATE",
-                        "StackName": "alb-route53-resources",
-                        "Capabilities": "CAPABILITY_NAMED_IAM",
-                        "TemplatePath": "BuildOutput::alb-route53-cf.template",
-                        "RoleArn": GetAtt("CloudFormationNetworkRole", "Arn")
-                    },
-                    InputArtifacts=[
-                        InputArtifacts(
-                            Name="App",
-                        ),
-                        InputArtifacts(
-                            Name="BuildOutput"
-                        )
+        Policies=[
+            IAMPolicy(
+                PolicyName="CloudFormationNetworkPolicy",
+                PolicyDocument={
+                    "Statement": [
+                        {"Effect": "Allow", "Action": "cloudformation:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ecr:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ecs:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "iam:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ec2:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "elasticloadbalancing:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "route53:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "codecommit:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "s3:GetObject", "Resource": "*"},
                     ],
-                )
-            ]
-        )
-    ],
-))
-
-
+                }
+            ),
+        ]
+    ))
+
+    t.add_resource(Pipeline(
+        "NetworkPipeline",
+        RoleArn=GetAtt("PipelineRole", "Arn"),
+        ArtifactStore=ArtifactStore(
+            Type="S3",
+            Location=Ref("S3Bucket")
+        ),
+        Stages=[
+            Stages(
+                Name="Source",
+                Actions=[
+                    Actions(
+                        Name="Source",
+                        ActionTypeId=ActionTypeId(
+                            Category="Source",
+                            Owner="AWS",
+                            Version="1",
+                            Provider="CodeCommit"
+                        ),
+                        Configuration=source_configuration(Ref("RepoName")),
+                        OutputArtifacts=[
+                            OutputArtifacts(
+                                Name="App"
+                            )
+                        ],
+                    )
+                ]
+            ),
+            Stages(
+                Name="Build",
+                Actions=[
+                    Actions(
+                        Name="Container",
+                        ActionTypeId=ActionTypeId(
+                            Category="Build",
+                            Owner="AWS",
+                            Version="1",
+                            Provider="CodeBuild"
+                        ),
+                        Configuration={
+                            "ProjectName":Join(
+                                    "-",
+                                    [Select(0, Split("-", Ref("AWS::StackName"))),
+                                        "codebuild"]
+                                ),
+                        },
+                        InputArtifacts=[
+                            InputArtifacts(
+                                Name="App"
+                            )
+                        ],
+                        OutputArtifacts=[
+                            OutputArtifacts(
+                                Name="BuildOutput"
+                            )
+                        ],
+                    )
+                ]
+            ),
+            Stages(
+                Name="Deploy",
+                Actions=[
+                    Actions(
+                        Name="Deploy",
+                        ActionTypeId=ActionTypeId(
+                            Category="Deploy",
+                            Owner="AWS",
+                            Version="1",
+                            Provider="CloudFormation"
+                        ),
+                        Configuration={
+                            "ChangeSetName": "Deploy",
+                            "ActionMode": "CREATE_UPDATE",
+                            "StackName": "alb-route53-resources",
+                            "Capabilities": "CAPABILITY_NAMED_IAM",
+                            "TemplatePath": "BuildOutput::alb-route53-cf.template",
+                            "RoleArn": GetAtt("CloudFormationNetworkRole", "Arn")
+                        },
+                        InputArtifacts=[
+                            InputArtifacts(
+                                Name="App",
+                            ),
+                            InputArtifacts(
+                                Name="BuildOutput"
+                            )
+                        ],
+                    )
+                ]
+            )
+        ],
+    ))
 
+    add_source_trigger(t, "NetworkPipeline", Ref("RepoName"))
 
 
-###########
-# Outputs #
-###########
+    ###########
+    # Outputs #
+    ###########
 
-t.add_output(Output(
-    "CodebuildName",
-    Description="Codebuild Name",
-    Value=Join(
-            "-",
-            [Select(0, Split("-", Ref("AWS::StackName"))),
-                "codebuild"]
-        )
-))
+    t.add_output(Output(
+        "CodebuildName",
+        Description="Codebuild Name",
+        Value=Join(
+                "-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                    "codebuild"]
+            )
+    ))
 
+    return t
 
 
-print(t.to_json())
+if __name__ == '__main__':
+    print(build_alb_route53_pipeline_template().to_json())
@@ -12,6 +12,7 @@ from troposphere.ecr import Repository
 from awacs.sts import AssumeRole
 
 from troposphere import (
+    Equals,
     Join,
     Ref,
     Template,
@@ -27,12 +28,13 @@ from troposphere.codebuild import (
     Artifacts,
     Environment,
     Project,
+    ProjectCache,
     Source
 )
 
 from troposphere.codepipeline import (
     Actions,
-    ActionTypeID,
+    ActionTypeId,
     ArtifactStore,
     InputArtifacts,
     OutputArtifacts,
@@ -44,7 +46,29 @@ from troposphere.iam import Role
 
 from troposphere.iam import Policy as IAMPolicy
 
-from troposphere.s3 import Bucket, VersioningConfiguration
+from troposphere.s3 import (
+    Bucket,
+    LifecycleConfiguration,
+    LifecycleRule,
+    VersioningConfiguration
+)
+
+from pipeline_layout import (
+    GATE_NAMESPACE,
+    layout_stages,
+    skip_unless_changed
+)
+
+from pipeline_trigger import (
+    add_branch_parameter,
+    add_source_trigger,
+    source_configuration
+)
+
+from builder_image import (
+    add_builder_image,
+    builder_environment
+)
 
 
 """
@@ -61,155 +85,46 @@ For good naming practice, the stack name should be of format:
 appname-codepipeline
 """
 
-t = Template()
-
-t.add_description("New Service CICD Pipeline")
-
-
-##############
-# Parameters #
-##############
-
-t.add_parameter(Parameter(
-    "RepoName",
-    Type="String",
-    Description="Name of the CodeCommit repository to source"
-))
 
-
-#############
-# Resources #
-#############
-
-
-### ECR ####
-# Create the resource
-t.add_resource(Repository(
-    "Repository",
-    RepositoryName=Select(0, Split("-", Ref("AWS::StackName")))
-))
-
-# Define the stack output
-t.add_output(Output(
-    "Repository",
-    Description="ECR repository",
-    Value=Select(0, Split("-", Ref("AWS::StackName"))),
-    Export=Export(Join("-", [Ref("RepoName"), "repo"])),
-))
-
-
-
-#### CodeBuild ####
-
-t.add_resource(Role(
-    "ServiceRole",
-    AssumeRolePolicyDocument=Policy(
-        Statement=[
-            Statement(
-                Effect=Allow,
-                Action=[AssumeRole],
-                Principal=Principal("Service", ["codebuild.amazonaws.com"])
-            )
-        ]
-    ),
-    Path="/",
-    ManagedPolicyArns=[
-        'arn:aws:iam::aws:policy/AWSCodePipelineReadOnlyAccess',
-        'arn:aws:iam::aws:policy/AWSCodeBuildDeveloperAccess',
-        'arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryPowerUser',
-        'arn:aws:iam::aws:policy/AmazonS3FullAccess',
-        'arn:aws:iam::aws:policy/CloudWatchLogsFullAccess'
-    ]
-))
-
-
-
-
-
-
-# Cloudformation Codebuild Definition
-environment_cfn = Environment(
-    ComputeType='BUILD_GENERAL1_SMALL',
-    Image='aws/codebuild/docker:1.12.1',
-    Type='LINUX_CONTAINER',
-    EnvironmentVariables=[],
-)
-
-
-
-buildspec_cfn = """version: 0.1
+buildspec_cfn = """version: 0.2
+env:
+  exported-variables:
+    - STAG_CHANGED
+    - PROD_CHANGED
 phases:
-  pre_build:
-    commands:
-      - pip install troposphere
-      - pip install pyyaml
-      - pip install awacs
   build:
     commands:
       - echo "Starting python execution"
-      - python ecs-service-cf-template.py > /tmp/ecs-service-cf.template
+      - python -m cfgen ecs-service --source-dir . --output-dir /tmp --cache "s3://$RENDER_CACHE_BUCKET/$RENDER_CACHE_PREFIX"
+      - printf '{"Tag":"%s"}' "$CODEBUILD_RESOLVED_SOURCE_VERSION" > /tmp/parameters.json
+      - python -m cfgen.deploy_gate /tmp/ecs-service-cf.template --output-dir /tmp --stack STAG "$STAG_STACK" /tmp/parameters.json --stack PROD "$PROD_STACK" /tmp/parameters.json > deploy_gate.env
+      - . ./deploy_gate.env
   post_build:
     commands:
       - echo "Completed CFN template creation."
 artifacts:
-  files: /tmp/ecs-service-cf.template
+  files:
+    - /tmp/ecs-service-cf.template
+    - /tmp/stag-configuration.json
+    - /tmp/prod-configuration.json
   discard-paths: yes
 """
 
-t.add_resource(Project(
-    "CodeBuildCFN",
-    Name=Join(
-            "-",
-            [Select(0, Split("-", Ref("AWS::StackName"))),
-            "cfn",
-            "codebuild"]
-        ),
-    Environment=environment_cfn,
-    ServiceRole=Ref("ServiceRole"),
-    Source=Source(
-        Type="CODEPIPELINE",
-        BuildSpec=buildspec_cfn
-    ),
-    Artifacts=Artifacts(
-        Type="CODEPIPELINE",
-        Name="output"
-    ),
-))
-
-
-
-# Docker Codebuild Definition
-environment_docker = Environment(
-    ComputeType='BUILD_GENERAL1_SMALL',
-    Image='aws/codebuild/docker:1.12.1',
-    Type='LINUX_CONTAINER',
-    EnvironmentVariables=[
-        {'Name': 'REPOSITORY_NAME', 'Value': Select(0, Split("-", Ref("AWS::StackName")))},
-        {'Name': 'REPOSITORY_URI',
-            'Value': Join("", [
-                Ref("AWS::AccountId"),
-                ".dkr.ecr.",
-                Ref("AWS::Region"),
-                ".amazonaws.com",
-                "/",
-                Select(0, Split("-", Ref("AWS::StackName")))])}
-    ],
-)
-
-
-
+# The image build reuses layers from the CodeBuild local cache and, on a
+# cold host, from the last pushed image (BuildKit inline cache).
 buildspec_docker = """version: 0.1
 phases:
   pre_build:
     commands:
-      - aws codepipeline get-pipeline-state --name "${CODEBUILD_INITIATOR##*/}" --query stageStates[?actionStates[0].latestExecution.externalExecutionId==\`$CODEBUILD_BUILD_ID\`].latestExecution.pipelineExecutionId --output=text > /tmp/execution_id.txt
+      - aws codepipeline get-pipeline-state --name "${CODEBUILD_INITIATOR##*/}" --query stageStates[?actionStates[?latestExecution.externalExecutionId==\`$CODEBUILD_BUILD_ID\`]].latestExecution.pipelineExecutionId --output=text > /tmp/execution_id.txt
       - aws codepipeline get-pipeline-execution --pipeline-name "${CODEBUILD_INITIATOR##*/}" --pipeline-execution-id $(cat /tmp/execution_id.txt) --query 'pipelineExecution.artifactRevisions[0].revisionId' --output=text > /tmp/tag.txt
       - printf "%s:%s" "$REPOSITORY_URI" "$(cat /tmp/tag.txt)" > /tmp/build_tag.txt
       - printf '{"tag":"%s"}' "$(cat /tmp/tag.txt)" > /tmp/build.json
-      - $(aws ecr get-login --no-include-email)
+      - aws ecr get-login-password | docker login --username AWS --password-stdin "${REPOSITORY_URI%%/*}"
+      - docker pull "$REPOSITORY_URI:latest" || true
   build:
     commands:
-      - docker build -t "$(cat /tmp/build_tag.txt)" .
+      - docker build --cache-from "$REPOSITORY_URI:latest" --build-arg BUILDKIT_INLINE_CACHE=1 -t "$(cat /tmp/build_tag.txt)" .
   post_build:
     commands:
       - echo "$(cat /tmp/execution_id.txt)"
@@ -224,140 +139,471 @@ artifacts:
   discard-paths: yes
 """
 
-t.add_resource(Project(
-    "CodeBuildDocker",
-    Name=Join(
-            "-",
-            [Select(0, Split("-", Ref("AWS::StackName"))),
-            "docker",
-            "codebuild"]
-        ),
-    Environment=environment_docker,
-    ServiceRole=Ref("ServiceRole"),
-    Source=Source(
-        Type="CODEPIPELINE",
-        BuildSpec=buildspec_docker
-    ),
-    Artifacts=Artifacts(
-        Type="CODEPIPELINE",
-        Name="output"
-    ),
-))
-
-
-
-#### CodePipeline ####
-t.add_resource(Bucket(
-    "S3Bucket",
-    VersioningConfiguration=VersioningConfiguration(
-        Status="Enabled",
+# Load test against staging, compared with the baseline of the last build
+# promoted to production (perf_gate.py next to the service template).
+buildspec_perf = """version: 0.2
+phases:
+  install:
+    commands:
+      - pip install locust==2.20.0
+  pre_build:
+    commands:
+      - mkdir -p /tmp/perf
+      - aws s3 cp "$BASELINE_URI" /tmp/baseline.json || echo "No baseline yet"
+  build:
+    commands:
+      - locust -f locustfile.py --headless --users "$USERS" --spawn-rate "$SPAWN_RATE" --run-time "$DURATION" --host "$TARGET_URL" --csv /tmp/perf/locust --only-summary --exit-code-on-error 0
+      - python perf_gate.py /tmp/perf/locust_stats.csv --baseline /tmp/baseline.json --tolerance "$LATENCY_TOLERANCE" --output /tmp/perf/results.json
+artifacts:
+  files: /tmp/perf/*
+  discard-paths: yes
+"""
+
+buildspec_baseline = """version: 0.2
+phases:
+  build:
+    commands:
+      - aws s3 cp results.json "$BASELINE_URI"
+"""
+
+
+def build_deploy_service_template(config=None):
+    """Build the service CICD pipeline template."""
+    t = Template()
+
+    t.set_description("New Service CICD Pipeline")
+
+
+    ##############
+    # Parameters #
+    ##############
+
+    t.add_parameter(Parameter(
+        "RepoName",
+        Type="String",
+        Description="Name of the CodeCommit repository to source"
+    ))
+
+    add_branch_parameter(t)
+
+    t.add_parameter(Parameter(
+        "PerformanceGate",
+        Type="String",
+        Default="Disabled",
+        AllowedValues=["Enabled", "Disabled"],
+        Description="Load test staging before the production approval"
+    ))
+
+    t.add_parameter(Parameter(
+        "Route53DomainName",
+        Type="String",
+        Default="data-muffin.com",
+        Description="Domain the ALBs route services under, for the load test"
+    ))
+
+    t.add_parameter(Parameter(
+        "LoadTestUsers",
+        Type="Number",
+        Default="20",
+        Description="Concurrent Locust users"
+    ))
+
+    t.add_parameter(Parameter(
+        "LoadTestSpawnRate",
+        Type="Number",
+        Default="5",
+        Description="Locust users started per second"
+    ))
+
+    t.add_parameter(Parameter(
+        "LoadTestDuration",
+        Type="String",
+        Default="2m",
+        Description="Locust run time (e.g. 90s, 2m)"
+    ))
+
+    t.add_parameter(Parameter(
+        "LatencyTolerance",
+        Type="Number",
+        Default="20",
+        Description="Allowed p50/p95/p99 latency increase over the baseline, "
+                    "in percent"
+    ))
+
+    t.add_condition(
+        "UsePerformanceGate",
+        Equals(Ref("PerformanceGate"), "Enabled")
     )
-))
-
-t.add_resource(Role(
-    "PipelineRole",
-    AssumeRolePolicyDocument=Policy(
-        Statement=[
-            Statement(
-                Effect=Allow,
-                Action=[AssumeRole],
-                Principal=Principal("Service", ["codepipeline.amazonaws.com"])
-            )
+
+    t.add_parameter(Parameter(
+        "RenderCachePrefix",
+        Type="String",
+        Default="render-cache",
+        Description="Prefix in the pipeline bucket for the rendered template "
+                    "cache"
+    ))
+
+    add_builder_image(t, required=True)
+
+
+    #############
+    # Resources #
+    #############
+
+
+    ### ECR ####
+    # Create the resource
+    t.add_resource(Repository(
+        "Repository",
+        RepositoryName=Select(0, Split("-", Ref("AWS::StackName")))
+    ))
+
+    # Define the stack output
+    t.add_output(Output(
+        "Repository",
+        Description="ECR repository",
+        Value=Select(0, Split("-", Ref("AWS::StackName"))),
+        Export=Export(Join("-", [Ref("RepoName"), "repo"])),
+    ))
+
+
+    #### CodeBuild ####
+
+    t.add_resource(Role(
+        "ServiceRole",
+        AssumeRolePolicyDocument=Policy(
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Action=[AssumeRole],
+                    Principal=Principal("Service", ["codebuild.amazonaws.com"])
+                )
+            ]
+        ),
+        Path="/",
+        ManagedPolicyArns=[
+            'arn:aws:iam::aws:policy/AWSCodePipelineReadOnlyAccess',
+            'arn:aws:iam::aws:policy/AWSCodeBuildDeveloperAccess',
+            'arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryPowerUser',
+            'arn:aws:iam::aws:policy/AmazonS3FullAccess',
+            'arn:aws:iam::aws:policy/CloudWatchLogsFullAccess'
+        ],
+        Policies=[
+            IAMPolicy(
+                PolicyName="DeployGate",
+                PolicyDocument={
+                    "Statement": [
+                        {"Effect": "Allow", "Action": "cloudformation:DescribeStacks", "Resource": "*"},
+                    ],
+                }
+            ),
+            IAMPolicy(
+                PolicyName="RenderCache",
+                PolicyDocument={
+                    "Statement": [
+                        {"Effect": "Allow", "Action": [
+                            "s3:GetObject",
+                            "s3:PutObject",
+                            "s3:DeleteObject",
+                            "s3:GetObjectTagging",
+                            "s3:PutObjectTagging",
+                        ], "Resource": Join("", [
+                            "arn:aws:s3:::", Ref("S3Bucket"), "/",
+                            Ref("RenderCachePrefix"), "/*"])},
+                        {"Effect": "Allow", "Action": "s3:ListBucket",
+                         "Resource": Join("", ["arn:aws:s3:::", Ref("S3Bucket")]),
+                         "Condition": {"StringLike": {"s3:prefix": Join("", [
+                             Ref("RenderCachePrefix"), "/*"])}}},
+                    ],
+                }
+            ),
         ]
-    ),
-    Path="/",
-    Policies=[
-        IAMPolicy(
-            PolicyName="ECSCodePipeline",
-            PolicyDocument={
-                "Statement": [
-                    {"Effect": "Allow", "Action": "cloudformation:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "codebuild:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "codepipeline:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ecr:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ecs:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "iam:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "s3:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "codecommit:*", "Resource": "*"},
-                ],
-            }
+    ))
+
+
+    # Cloudformation Codebuild Definition
+    environment_cfn = builder_environment(
+        required=True,
+        ComputeType='BUILD_GENERAL1_SMALL',
+        Type='LINUX_CONTAINER',
+        EnvironmentVariables=[
+            {'Name': 'RENDER_CACHE_BUCKET', 'Value': Ref("S3Bucket")},
+            {'Name': 'RENDER_CACHE_PREFIX', 'Value': Ref("RenderCachePrefix")},
+            {'Name': 'STAG_STACK',
+                'Value': Join("-", ["stag", Select(0, Split("-", Ref("AWS::StackName"))), "service"])},
+            {'Name': 'PROD_STACK',
+                'Value': Join("-", ["prod", Select(0, Split("-", Ref("AWS::StackName"))), "service"])}
+        ],
+    )
+
+
+    t.add_resource(Project(
+        "CodeBuildCFN",
+        Name=Join(
+                "-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                "cfn",
+                "codebuild"]
+            ),
+        Environment=environment_cfn,
+        ServiceRole=Ref("ServiceRole"),
+        Source=Source(
+            Type="CODEPIPELINE",
+            BuildSpec=buildspec_cfn
         ),
-    ]
-))
-
-t.add_resource(Role(
-    "CloudFormationECSRole",
-    RoleName=Join(
-            "-",
-            [Select(0, Split("-", Ref("AWS::StackName"))),
-                "CloudFormationECSRole"]
+        Artifacts=Artifacts(
+            Type="CODEPIPELINE",
+            Name="output"
         ),
-    Path="/",
-    AssumeRolePolicyDocument=Policy(
-        Statement=[
-            Statement(
-                Effect=Allow,
-                Action=[AssumeRole],
-                Principal=Principal(
-                    "Service", ["cloudformation.amazonaws.com"])
+    ))
+
+
+    # Docker Codebuild Definition
+    environment_docker = Environment(
+        ComputeType='BUILD_GENERAL1_SMALL',
+        Image='aws/codebuild/standard:7.0',
+        Type='LINUX_CONTAINER',
+        PrivilegedMode=True,
+        EnvironmentVariables=[
+            {'Name': 'DOCKER_BUILDKIT', 'Value': '1'},
+            {'Name': 'REPOSITORY_NAME', 'Value': Select(0, Split("-", Ref("AWS::StackName")))},
+            {'Name': 'REPOSITORY_URI',
+                'Value': Join("", [
+                    Ref("AWS::AccountId"),
+                    ".dkr.ecr.",
+                    Ref("AWS::Region"),
+                    ".amazonaws.com",
+                    "/",
+                    Select(0, Split("-", Ref("AWS::StackName")))])}
+        ],
+    )
+
+
+    t.add_resource(Project(
+        "CodeBuildDocker",
+        Name=Join(
+                "-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                "docker",
+                "codebuild"]
+            ),
+        Environment=environment_docker,
+        ServiceRole=Ref("ServiceRole"),
+        Source=Source(
+            Type="CODEPIPELINE",
+            BuildSpec=buildspec_docker
+        ),
+        Cache=ProjectCache(
+            Type="LOCAL",
+            Modes=["LOCAL_DOCKER_LAYER_CACHE", "LOCAL_SOURCE_CACHE"]
+        ),
+        Artifacts=Artifacts(
+            Type="CODEPIPELINE",
+            Name="output"
+        ),
+    ))
+
+
+    # Load test Codebuild Definitions
+    baselineUri = Join("", [
+        "s3://", Ref("S3Bucket"), "/perf-baseline/baseline.json"])
+
+    environment_perf = Environment(
+        ComputeType='BUILD_GENERAL1_SMALL',
+        Image='aws/codebuild/standard:7.0',
+        Type='LINUX_CONTAINER',
+        EnvironmentVariables=[
+            {'Name': 'BASELINE_URI', 'Value': baselineUri},
+            {'Name': 'TARGET_URL',
+                'Value': Join("", [
+                    "http://",
+                    Select(0, Split("-", Ref("AWS::StackName"))),
+                    ".stag.",
+                    Ref("Route53DomainName")])},
+            {'Name': 'USERS', 'Value': Ref("LoadTestUsers")},
+            {'Name': 'SPAWN_RATE', 'Value': Ref("LoadTestSpawnRate")},
+            {'Name': 'DURATION', 'Value': Ref("LoadTestDuration")},
+            {'Name': 'LATENCY_TOLERANCE', 'Value': Ref("LatencyTolerance")}
+        ],
+    )
+
+    t.add_resource(Project(
+        "CodeBuildPerf",
+        Condition="UsePerformanceGate",
+        Name=Join(
+                "-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                "perf",
+                "codebuild"]
+            ),
+        Environment=environment_perf,
+        ServiceRole=Ref("ServiceRole"),
+        Source=Source(
+            Type="CODEPIPELINE",
+            BuildSpec=buildspec_perf
+        ),
+        Artifacts=Artifacts(
+            Type="CODEPIPELINE",
+            Name="output"
+        ),
+    ))
+
+    t.add_resource(Project(
+        "CodeBuildPerfBaseline",
+        Condition="UsePerformanceGate",
+        Name=Join(
+                "-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                "perf",
+                "baseline"]
+            ),
+        Environment=Environment(
+            ComputeType='BUILD_GENERAL1_SMALL',
+            Image='aws/codebuild/standard:7.0',
+            Type='LINUX_CONTAINER',
+            EnvironmentVariables=[
+                {'Name': 'BASELINE_URI', 'Value': baselineUri}
+            ],
+        ),
+        ServiceRole=Ref("ServiceRole"),
+        Source=Source(
+            Type="CODEPIPELINE",
+            BuildSpec=buildspec_baseline
+        ),
+        Artifacts=Artifacts(
+            Type="CODEPIPELINE"
+        ),
+    ))
+
+
+    #### CodePipeline ####
+    t.add_resource(Bucket(
+        "S3Bucket",
+        VersioningConfiguration=VersioningConfiguration(
+            Status="Enabled",
+        ),
+        # Templates evicted from the render cache are gone for good
+        LifecycleConfiguration=LifecycleConfiguration(
+            Rules=[
+                LifecycleRule(
+                    Id="RenderCache",
+                    Prefix=Join("", [Ref("RenderCachePrefix"), "/"]),
+                    Status="Enabled",
+                    NoncurrentVersionExpirationInDays=1
+                )
+            ]
+        )
+    ))
+
+    t.add_resource(Role(
+        "PipelineRole",
+        AssumeRolePolicyDocument=Policy(
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Action=[AssumeRole],
+                    Principal=Principal("Service", ["codepipeline.amazonaws.com"])
+                )
+            ]
+        ),
+        Path="/",
+        Policies=[
+            IAMPolicy(
+                PolicyName="ECSCodePipeline",
+                PolicyDocument={
+                    "Statement": [
+                        {"Effect": "Allow", "Action": "cloudformation:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "codebuild:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "codepipeline:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ecr:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ecs:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "iam:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "s3:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "codecommit:*", "Resource": "*"},
+                    ],
+                }
+            ),
+        ]
+    ))
+
+    t.add_resource(Role(
+        "CloudFormationECSRole",
+        RoleName=Join(
+                "-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                    "CloudFormationECSRole"]
+            ),
+        Path="/",
+        AssumeRolePolicyDocument=Policy(
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Action=[AssumeRole],
+                    Principal=Principal(
+                        "Service", ["cloudformation.amazonaws.com"])
+                ),
+            ]
+        ),
+        Policies=[
+            IAMPolicy(
+                PolicyName="CloudFormationECSPolicy",
+                PolicyDocument={
+                    "Statement": [
+                        {"Effect": "Allow", "Action": "cloudformation:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ecr:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ecs:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "iam:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "codecommit:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "application-autoscaling:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "cloudwatch:*", "Resource": "*"},
+                        # Fargate services get a task security group
+                        {"Effect": "Allow", "Action": [
+                            "ec2:CreateSecurityGroup",
+                            "ec2:DeleteSecurityGroup",
+                            "ec2:AuthorizeSecurityGroupIngress",
+                            "ec2:AuthorizeSecurityGroupEgress",
+                            "ec2:RevokeSecurityGroupIngress",
+                            "ec2:RevokeSecurityGroupEgress",
+                            "ec2:CreateTags",
+                            "ec2:Describe*",
+                        ], "Resource": "*"},
+                    ],
+                }
             ),
         ]
-    ),
-    Policies=[
-        IAMPolicy(
-            PolicyName="CloudFormationECSPolicy",
-            PolicyDocument={
-                "Statement": [
-                    {"Effect": "Allow", "Action": "cloudformation:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ecr:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ecs:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "iam:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "codecommit:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "application-autoscaling:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "cloudwatch:*", "Resource": "*"},
-                ],
-            }
+    ))
+
+    t.add_resource(Pipeline(
+        "ECSCICDPipeline",
+        PipelineType="V2",
+        RoleArn=GetAtt("PipelineRole", "Arn"),
+        ArtifactStore=ArtifactStore(
+            Type="S3",
+            Location=Ref("S3Bucket")
         ),
-    ]
-))
-
-t.add_resource(Pipeline(
-    "ECSCICDPipeline",
-    RoleArn=GetAtt("PipelineRole", "Arn"),
-    ArtifactStore=ArtifactStore(
-        Type="S3",
-        Location=Ref("S3Bucket")
-    ),
-    Stages=[
-        Stages(
-            Name="Source",
-            Actions=[
+        Stages=layout_stages([
+            ("Source", [
                 Actions(
                     Name="Source",
-                    ActionTypeId=ActionTypeID(
+                    ActionTypeId=ActionTypeId(
                         Category="Source",
                         Owner="AWS",
                         Version="1",
                         Provider="CodeCommit"
                     ),
-                    Configuration={
-                        "BranchName": "master",
-                        "RepositoryName": Ref("RepoName")
-                    },
+                    Configuration=source_configuration(Ref("RepoName")),
                     OutputArtifacts=[
                         OutputArtifacts(
                             Name="App"
                         )
                     ],
                 )
-            ]
-        ),
-        Stages(
-            Name="CFNBuild",
-            Actions=[
+            ]),
+            ("Build", [
                 Actions(
-                    Name="Container",
-                    ActionTypeId=ActionTypeID(
+                    Name="Template",
+                    Namespace=GATE_NAMESPACE,
+                    ActionTypeId=ActionTypeId(
                         Category="Build",
                         Owner="AWS",
                         Version="1",
@@ -381,15 +627,10 @@ t.add_resource(Pipeline(
                             Name="CFNBuildOutput"
                         )
                     ],
-                )
-            ]
-        ),
-        Stages(
-            Name="DockerBuild",
-            Actions=[
+                ),
                 Actions(
-                    Name="Container",
-                    ActionTypeId=ActionTypeID(
+                    Name="Image",
+                    ActionTypeId=ActionTypeId(
                         Category="Build",
                         Owner="AWS",
                         Version="1",
@@ -414,14 +655,11 @@ t.add_resource(Pipeline(
                         )
                     ],
                 )
-            ]
-        ),
-        Stages(
-            Name="Staging",
-            Actions=[
+            ]),
+            ("Staging", [
                 Actions(
                     Name="Deploy",
-                    ActionTypeId=ActionTypeID(
+                    ActionTypeId=ActionTypeId(
                         Category="Deploy",
                         Owner="AWS",
                         Version="1",
@@ -438,6 +676,7 @@ t.add_resource(Pipeline(
                         ),
                         "Capabilities": "CAPABILITY_NAMED_IAM",
                         "TemplatePath": "CFNBuildOutput::ecs-service-cf.template",
+                        "TemplateConfiguration": "CFNBuildOutput::stag-configuration.json",
                         "RoleArn": GetAtt("CloudFormationECSRole", "Arn"),
                         "ParameterOverrides": """{"Tag" : { "Fn::GetParam" : [ "DockerBuildOutput", "build.json", "tag" ] } }"""
                     },
@@ -453,14 +692,35 @@ t.add_resource(Pipeline(
                         )
                     ],
                 )
-            ]
-        ),
-        Stages(
-            Name="Approval",
-            Actions=[
+            ], {"BeforeEntry": skip_unless_changed("STAG")}),
+            ("LoadTest", [
+                Actions(
+                    Name="Locust",
+                    ActionTypeId=ActionTypeId(
+                        Category="Build",
+                        Owner="AWS",
+                        Version="1",
+                        Provider="CodeBuild"
+                    ),
+                    Configuration={
+                        "ProjectName": Ref("CodeBuildPerf"),
+                    },
+                    InputArtifacts=[
+                        InputArtifacts(
+                            Name="App"
+                        )
+                    ],
+                    OutputArtifacts=[
+                        OutputArtifacts(
+                            Name="PerfResults"
+                        )
+                    ],
+                )
+            ], {"Condition": "UsePerformanceGate"}),
+            ("Approval", [
                 Actions(
                     Name="Approval",
-                    ActionTypeId=ActionTypeID(
+                    ActionTypeId=ActionTypeId(
                         Category="Approval",
                         Owner="AWS",
                         Version="1",
@@ -469,14 +729,11 @@ t.add_resource(Pipeline(
                     Configuration={},
                     InputArtifacts=[],
                 )
-            ]
-        ),
-        Stages(
-            Name="Production",
-            Actions=[
+            ], {"BeforeEntry": skip_unless_changed("PROD")}),
+            ("Production", [
                 Actions(
                     Name="Deploy",
-                    ActionTypeId=ActionTypeID(
+                    ActionTypeId=ActionTypeId(
                         Category="Deploy",
                         Owner="AWS",
                         Version="1",
@@ -493,6 +750,7 @@ t.add_resource(Pipeline(
                         ),
                         "Capabilities": "CAPABILITY_NAMED_IAM",
                         "TemplatePath": "CFNBuildOutput::ecs-service-cf.template",
+                        "TemplateConfiguration": "CFNBuildOutput::prod-configuration.json",
                         "RoleArn": GetAtt("CloudFormationECSRole", "Arn"),
                         "ParameterOverrides": """{"Tag" : { "Fn::GetParam" : [ "DockerBuildOutput", "build.json", "tag" ] } }"""
                     },
@@ -508,29 +766,49 @@ t.add_resource(Pipeline(
                         )
                     ],
                 )
-            ]
-        )
-    ],
-))
-
-
+            ], {"BeforeEntry": skip_unless_changed("PROD")}),
+            ("Baseline", [
+                Actions(
+                    Name="Promote",
+                    ActionTypeId=ActionTypeId(
+                        Category="Build",
+                        Owner="AWS",
+                        Version="1",
+                        Provider="CodeBuild"
+                    ),
+                    Configuration={
+                        "ProjectName": Ref("CodeBuildPerfBaseline"),
+                    },
+                    InputArtifacts=[
+                        InputArtifacts(
+                            Name="PerfResults"
+                        )
+                    ],
+                )
+            ], {"Condition": "UsePerformanceGate",
+                "BeforeEntry": skip_unless_changed("PROD")}),
+        ]),
+    ))
 
+    add_source_trigger(t, "ECSCICDPipeline", Ref("RepoName"))
 
 
-###########
-# Outputs #
-###########
+    ###########
+    # Outputs #
+    ###########
 
-t.add_output(Output(
-    "CodebuildName",
-    Description="Codebuild Name",
-    Value=Join(
-            "-",
-            [Select(0, Split("-", Ref("AWS::StackName"))),
-                "codebuild"]
-        )
-))
+    t.add_output(Output(
+        "CodebuildName",
+        Description="Codebuild Name",
+        Value=Join(
+                "-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                    "codebuild"]
+            )
+    ))
 
+    return t
 
 
-print(t.to_json())
+if __name__ == '__main__':
+    print(build_deploy_service_template().to_json())
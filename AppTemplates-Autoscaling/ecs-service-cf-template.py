@@ -25,6 +25,7 @@ from troposphere.iam import (
 from troposphere.iam import Policy as IAMPolicy
 
 from troposphere import (
+    ec2,
     Parameter,
     Ref,
     Template,
@@ -36,10 +37,12 @@ from troposphere import (
 )
 
 from troposphere.applicationautoscaling import (
+    PredefinedMetricSpecification,
     ScalableTarget,
     StepAdjustment,
     StepScalingPolicyConfiguration,
     ScalingPolicy,
+    TargetTrackingScalingPolicyConfiguration,
 )
 
 from awacs.sts import AssumeRole
@@ -49,231 +52,408 @@ from troposphere.cloudwatch import (
     MetricDimension
 )
 
+from cfgen.scaling_steps import (
+    alarm_evaluation,
+    alarm_metrics,
+    expand_ladder,
+    run_suffix,
+    run_threshold,
+    scaling_metrics,
+)
 
-# Get configuration from YAML
-with open('service_config.yaml', 'r') as f:
-    doc = yaml.load(f)
-TaskCPU = doc['TaskCPU']
-TaskMemory = doc['TaskMemory']
-DesiredTaskCapacity = doc['DesiredTaskCapacity']
-MinTaskCapacity = doc['MinTaskCapacity']
-MaxTaskCapacity = doc['MaxTaskCapacity']
-ScalingMetric = doc['ScalingMetric']
-ScaleUpLevel = doc['ScaleUpLevel']
-ScaleDownLevel = doc['ScaleDownLevel']
-
-t = Template()
-
-t.add_description("ECS service")
-
-
-t.add_parameter(Parameter(
-    "Tag",
-    Type="String",
-    Default="latest",
-    Description="Tag to deploy"
-))
-
-# c5b1dc0a50a8c10a18750dc7f6246e9d1c6aa568
-
-# First, we define an ECS task
-
-t.add_resource(TaskDefinition(
-    "task",
-    ContainerDefinitions=[
-        ContainerDefinition(
-            Image=Join("", [
-                Ref("AWS::AccountId"),
-                ".dkr.ecr.",
-                Ref("AWS::Region"),
-                ".amazonaws.com",
-                "/",
-                Select(1, Split("-", Ref("AWS::StackName"))),
-                ":",
-                Ref("Tag")]),
-            Memory=TaskMemory,
-            Cpu=TaskCPU,
-            Name=Select(1, Split("-", Ref("AWS::StackName"))),
-            PortMappings=[ecs.PortMapping(
-                ContainerPort=3000)]
-        )
-    ],
-))
-
-
-
-
-# Then a service
-
-t.add_resource(Role(
-    "ServiceRole",
-    AssumeRolePolicyDocument=Policy(
-        Statement=[
-            Statement(
-                Effect=Allow,
-                Action=[AssumeRole],
-                Principal=Principal("Service", ["ecs.amazonaws.com"])
-            )
-        ]
-    ),
-    Path="/",
-    ManagedPolicyArns=[
-        'arn:aws:iam::aws:policy/service-role/AmazonEC2ContainerServiceRole']
-))
-
-ecsservice = t.add_resource(ecs.Service(
-    "service",
-    Cluster=ImportValue(Join("-",
-            [Select(0, Split("-", Ref("AWS::StackName"))),
-            "cluster-id"])),
-    DesiredCount=DesiredTaskCapacity,
-    TaskDefinition=Ref("task"),
-    LoadBalancers=[ecs.LoadBalancer(
-        ContainerName=Select(1, Split("-", Ref("AWS::StackName"))),
-        ContainerPort=3000,
-        TargetGroupArn=ImportValue(
-            Join("-",
-                [Select(0, Split("-", Ref("AWS::StackName"))),
-                Select(1, Split("-", Ref("AWS::StackName"))),
-                "tg"]),
-        ),
-    )],
-    Role=Ref("ServiceRole")
-))
-
-
-# Configure application scaling
-## Start with application autoscaling role
-appscalingrole = t.add_resource(Role(
-    "ApplicationScalingRole",
-    AssumeRolePolicyDocument=Policy(
-        Statement=[
-            Statement(
-                Effect=Allow,
-                Action=[AssumeRole],
-                Principal=Principal("Service", ["application-autoscaling.amazonaws.com"])
-            )
-        ]
-    ),
-    Path="/",
-    Policies=[
-        IAMPolicy(
-            PolicyName=Join("-",
-                [Select(0, Split("-", Ref("AWS::StackName"))),
-                Select(1, Split("-", Ref("AWS::StackName"))),
-                "ScalingRole"]),
-            PolicyDocument={
-                "Statement": [
-                    {"Effect": "Allow", "Action": "ecs:UpdateService", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "ecs:DescribeServices", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "application-autoscaling:*", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "cloudwatch:DescribeAlarms", "Resource": "*"},
-                    {"Effect": "Allow", "Action": "cloudwatch:GetMetricStatistics", "Resource": "*"},
-                ],
-            }
-        ),
-    ]
-))
-
-
-
-# Set the target
-t.add_resource(ScalableTarget(
-    "scalableTarget",
-    MaxCapacity=MaxTaskCapacity,
-    MinCapacity=MinTaskCapacity,
-    ResourceId=Join("/",
-        ["service",
-        ImportValue(Join("-", [Select(0, Split("-", Ref("AWS::StackName"))), "cluster-id"])),
-        GetAtt(ecsservice, "Name")]),
-    RoleARN=GetAtt(appscalingrole, "Arn"),
-    ScalableDimension='ecs:service:DesiredCount',
-    ServiceNamespace='ecs',
-))
-
-
-# Set scaling policies
-states = {
-    "High": {
-        "threshold": ScaleUpLevel,
-        "alarmPrefix": "ScaleUpPolicyFor",
-        "operator": "GreaterThanOrEqualToThreshold",
-        "adjustment": "1"
-    },
-    "Low": {
-        "threshold": ScaleDownLevel,
-        "alarmPrefix": "ScaleDownPolicyFor",
-        "operator": "LessThanOrEqualToThreshold",
-        "adjustment": "-1"
-    }
+
+# Predefined metrics for target tracking, keyed by ScalingMetric.
+TargetTrackingMetrics = {
+    "CPU": "ECSServiceAverageCPUUtilization",
+    "Memory": "ECSServiceAverageMemoryUtilization",
+    "RequestCount": "ALBRequestCountPerTarget",
 }
 
-for utilization in {ScalingMetric}:
-    for state, value in states.items():
-        t.add_resource(Alarm(
-            "{}UtilizationToo{}".format(utilization, state),
-            AlarmDescription="Alarm if {} utilization too {}".format(
-                utilization,
-                state),
-            Namespace="AWS/ECS",
-            MetricName="{}Utilization".format(utilization),
-            Dimensions=[
-                MetricDimension(
-                    Name="ServiceName",
-                    Value=GetAtt(ecsservice, "Name")
-                ),
-                MetricDimension(
-                    Name="ClusterName",
-                    Value=ImportValue(Join("-",
-                            [Select(0, Split("-", Ref("AWS::StackName"))),
-                            "cluster-id"]))
+
+# Memory sizes (MiB) Fargate accepts for each task CPU size (CPU units).
+FargateTaskSizes = {
+    256: [512, 1024, 2048],
+    512: list(range(1024, 4097, 1024)),
+    1024: list(range(2048, 8193, 1024)),
+    2048: list(range(4096, 16385, 1024)),
+    4096: list(range(8192, 30721, 1024)),
+    8192: list(range(16384, 61441, 4096)),
+    16384: list(range(32768, 122881, 8192)),
+}
+
+FargateCapacityProviders = ("FARGATE", "FARGATE_SPOT")
+
+
+def load_config(path='service_config.yaml'):
+    """Read the service configuration YAML."""
+    with open(path, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def build_service_template(config):
+    """Build the ECS service template from a service configuration dict."""
+    TaskCPU = config['TaskCPU']
+    TaskMemory = config['TaskMemory']
+    TaskMemoryReservation = config.get('TaskMemoryReservation')
+    DesiredTaskCapacity = config['DesiredTaskCapacity']
+    MinTaskCapacity = config['MinTaskCapacity']
+    MaxTaskCapacity = config['MaxTaskCapacity']
+    ScalingMetrics = scaling_metrics(config['ScalingMetric'])
+    ScaleUpLevel = config['ScaleUpLevel']
+    ScaleDownLevel = config['ScaleDownLevel']
+    ScalingMode = config.get('ScalingMode', 'Step')
+    TargetValue = config.get('TargetValue')
+    ScaleOutCooldown = config.get('ScaleOutCooldown', '60')
+    ScaleInCooldown = config.get('ScaleInCooldown', '300')
+    CapacityProviders = config.get('CapacityProviderStrategy') or []
+    LaunchType = config.get('LaunchType', 'EC2')
+
+    if LaunchType not in ("EC2", "FARGATE"):
+        raise ValueError(
+            "LaunchType must be EC2 or FARGATE, got {}".format(LaunchType))
+    onFargate = [item['CapacityProvider'] in FargateCapacityProviders
+                 for item in CapacityProviders]
+    if any(onFargate) and not all(onFargate):
+        raise ValueError(
+            "CapacityProviderStrategy cannot mix Fargate and EC2 providers")
+    Fargate = LaunchType == "FARGATE" or any(onFargate)
+    if Fargate and int(TaskMemory) not in FargateTaskSizes.get(
+            int(TaskCPU), []):
+        raise ValueError(
+            "Fargate has no {} CPU / {} MiB task size; valid sizes are {}"
+            .format(TaskCPU, TaskMemory, ", ".join(
+                "{} CPU with {}-{} MiB".format(cpu, sizes[0], sizes[-1])
+                for cpu, sizes in sorted(FargateTaskSizes.items()))))
+
+    if TaskMemoryReservation is not None and not (
+            0 < int(TaskMemoryReservation) < int(TaskMemory)):
+        raise ValueError(
+            "TaskMemoryReservation ({}) must be under TaskMemory ({}), the "
+            "hard limit".format(TaskMemoryReservation, TaskMemory))
+
+    if ScalingMode not in ("Step", "TargetTracking"):
+        raise ValueError(
+            "ScalingMode must be Step or TargetTracking, got {}".format(
+                ScalingMode))
+    supported = TargetTrackingMetrics if ScalingMode == "TargetTracking" \
+        else ("CPU", "Memory")
+    for metric in ScalingMetrics:
+        if metric not in supported:
+            raise ValueError(
+                "ScalingMetric must be one of {} for {} scaling".format(
+                    ", ".join(sorted(supported)), ScalingMode))
+    if ScalingMode == "TargetTracking":
+        if not isinstance(TargetValue, dict):
+            TargetValue = {metric: TargetValue for metric in ScalingMetrics}
+        if any(TargetValue.get(metric) is None for metric in ScalingMetrics):
+            raise ValueError(
+                "TargetTracking scaling needs a TargetValue for each metric")
+
+    t = Template()
+
+    t.set_description("ECS service")
+
+
+    t.add_parameter(Parameter(
+        "Tag",
+        Type="String",
+        Default="latest",
+        Description="Tag to deploy"
+    ))
+
+    # c5b1dc0a50a8c10a18750dc7f6246e9d1c6aa568
+
+    # First, we define an ECS task
+
+    container = ContainerDefinition(
+        Image=Join("", [
+            Ref("AWS::AccountId"),
+            ".dkr.ecr.",
+            Ref("AWS::Region"),
+            ".amazonaws.com",
+            "/",
+            Select(1, Split("-", Ref("AWS::StackName"))),
+            ":",
+            Ref("Tag")]),
+        Name=Select(1, Split("-", Ref("AWS::StackName"))),
+        PortMappings=[ecs.PortMapping(
+            ContainerPort=3000)]
+    )
+
+    task = t.add_resource(TaskDefinition(
+        "task",
+        ContainerDefinitions=[container],
+    ))
+
+    if Fargate:
+        # Fargate sizes and networks each task on its own
+        task.RequiresCompatibilities = ["FARGATE"]
+        task.NetworkMode = "awsvpc"
+        task.Cpu = str(TaskCPU)
+        task.Memory = str(TaskMemory)
+        task.ExecutionRoleArn = GetAtt("TaskExecutionRole", "Arn")
+
+        t.add_resource(Role(
+            "TaskExecutionRole",
+            AssumeRolePolicyDocument=Policy(
+                Statement=[
+                    Statement(
+                        Effect=Allow,
+                        Action=[AssumeRole],
+                        Principal=Principal("Service", ["ecs-tasks.amazonaws.com"])
+                    )
+                ]
+            ),
+            Path="/",
+            ManagedPolicyArns=[
+                'arn:aws:iam::aws:policy/service-role/AmazonECSTaskExecutionRolePolicy']
+        ))
+
+        t.add_resource(ec2.SecurityGroup(
+            "TaskSecurityGroup",
+            GroupDescription="Allow the load balancers to reach the tasks",
+            VpcId=ImportValue(Join("-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                "cluster-vpc-id"])),
+            SecurityGroupIngress=[
+                ec2.SecurityGroupRule(
+                    IpProtocol="tcp",
+                    FromPort=3000,
+                    ToPort=3000,
+                    CidrIp="172.16.0.0/12",
                 ),
             ],
-            Statistic="Average",
-            Period="60",
-            EvaluationPeriods="1",
-            Threshold=value['threshold'],
-            ComparisonOperator=value['operator'],
-            AlarmActions=[
-                Ref("{}{}".format(value['alarmPrefix'], utilization))]
+        ))
+    else:
+        container.Memory = TaskMemory
+        container.Cpu = TaskCPU
+        if TaskMemoryReservation is not None:
+            # Placed by the soft limit; killed only past the hard one
+            container.MemoryReservation = TaskMemoryReservation
+
+
+    # Then a service
+
+    if not Fargate:
+        # ECS registers the instances with the target group through this role
+        t.add_resource(Role(
+            "ServiceRole",
+            AssumeRolePolicyDocument=Policy(
+                Statement=[
+                    Statement(
+                        Effect=Allow,
+                        Action=[AssumeRole],
+                        Principal=Principal("Service", ["ecs.amazonaws.com"])
+                    )
+                ]
+            ),
+            Path="/",
+            ManagedPolicyArns=[
+                'arn:aws:iam::aws:policy/service-role/AmazonEC2ContainerServiceRole']
         ))
 
-        if state == "Low":
+    ecsservice = t.add_resource(ecs.Service(
+        "service",
+        Cluster=ImportValue(Join("-",
+                [Select(0, Split("-", Ref("AWS::StackName"))),
+                "cluster-id"])),
+        DesiredCount=DesiredTaskCapacity,
+        TaskDefinition=Ref("task"),
+        LoadBalancers=[ecs.LoadBalancer(
+            ContainerName=Select(1, Split("-", Ref("AWS::StackName"))),
+            ContainerPort=3000,
+            TargetGroupArn=ImportValue(
+                Join("-",
+                    [Select(0, Split("-", Ref("AWS::StackName"))),
+                    Select(1, Split("-", Ref("AWS::StackName"))),
+                    "tg"]),
+            ),
+        )],
+    ))
+
+    if Fargate:
+        ecsservice.NetworkConfiguration = ecs.NetworkConfiguration(
+            AwsvpcConfiguration=ecs.AwsvpcConfiguration(
+                AssignPublicIp="ENABLED",
+                SecurityGroups=[Ref("TaskSecurityGroup")],
+                Subnets=Split(",", ImportValue(Join("-",
+                    [Select(0, Split("-", Ref("AWS::StackName"))),
+                    "cluster-public-subnets"]))),
+            ))
+        if not CapacityProviders:
+            ecsservice.LaunchType = "FARGATE"
+    else:
+        ecsservice.Role = Ref("ServiceRole")
+
+    if CapacityProviders:
+        # "cluster" stands for the capacity provider exported by the cluster
+        ecsservice.CapacityProviderStrategy = [
+            ecs.CapacityProviderStrategyItem(
+                CapacityProvider=ImportValue(Join("-",
+                    [Select(0, Split("-", Ref("AWS::StackName"))),
+                    "cluster-capacity-provider"]))
+                if item['CapacityProvider'] == "cluster"
+                else item['CapacityProvider'],
+                Weight=item.get('Weight', 1),
+                Base=item.get('Base', 0),
+            )
+            for item in CapacityProviders
+        ]
+
+
+    # Configure application scaling
+    ## Start with application autoscaling role
+    appscalingrole = t.add_resource(Role(
+        "ApplicationScalingRole",
+        AssumeRolePolicyDocument=Policy(
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Action=[AssumeRole],
+                    Principal=Principal("Service", ["application-autoscaling.amazonaws.com"])
+                )
+            ]
+        ),
+        Path="/",
+        Policies=[
+            IAMPolicy(
+                PolicyName=Join("-",
+                    [Select(0, Split("-", Ref("AWS::StackName"))),
+                    Select(1, Split("-", Ref("AWS::StackName"))),
+                    "ScalingRole"]),
+                PolicyDocument={
+                    "Statement": [
+                        {"Effect": "Allow", "Action": "ecs:UpdateService", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "ecs:DescribeServices", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "application-autoscaling:*", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "cloudwatch:DescribeAlarms", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "cloudwatch:GetMetricStatistics", "Resource": "*"},
+                        # Target tracking policies manage their own alarms
+                        {"Effect": "Allow", "Action": "cloudwatch:PutMetricAlarm", "Resource": "*"},
+                        {"Effect": "Allow", "Action": "cloudwatch:DeleteAlarms", "Resource": "*"},
+                    ],
+                }
+            ),
+        ]
+    ))
+
+
+    # Set the target
+    t.add_resource(ScalableTarget(
+        "scalableTarget",
+        MaxCapacity=MaxTaskCapacity,
+        MinCapacity=MinTaskCapacity,
+        ResourceId=Join("/",
+            ["service",
+            ImportValue(Join("-", [Select(0, Split("-", Ref("AWS::StackName"))), "cluster-id"])),
+            GetAtt(ecsservice, "Name")]),
+        RoleARN=GetAtt(appscalingrole, "Arn"),
+        ScalableDimension='ecs:service:DesiredCount',
+        ServiceNamespace='ecs',
+    ))
+
+
+    if ScalingMode == "TargetTracking":
+        # One policy per metric, each sizing the service to hold its metric
+        # at the target. Application Auto Scaling scales out when any policy
+        # asks to and only scales in when all of them allow it.
+        for ScalingMetric in ScalingMetrics:
+            metric = PredefinedMetricSpecification(
+                PredefinedMetricType=TargetTrackingMetrics[ScalingMetric])
+            if ScalingMetric == "RequestCount":
+                metric.ResourceLabel = ImportValue(Join("-",
+                    [Select(0, Split("-", Ref("AWS::StackName"))),
+                    Select(1, Split("-", Ref("AWS::StackName"))),
+                    "tg-label"]))
+
             t.add_resource(ScalingPolicy(
-                "{}{}".format(value['alarmPrefix'], utilization),
-                PolicyName="{}{}".format(value['alarmPrefix'], utilization),
-                PolicyType='StepScaling',
+                "TargetTrackingPolicyFor{}".format(ScalingMetric),
+                PolicyName="TargetTrackingPolicyFor{}".format(ScalingMetric),
+                PolicyType='TargetTrackingScaling',
                 ScalingTargetId=Ref("scalableTarget"),
-                StepScalingPolicyConfiguration=StepScalingPolicyConfiguration(
-                    AdjustmentType='ChangeInCapacity',
-                    Cooldown=60,
-                    MetricAggregationType='Average',
-                    StepAdjustments=[
-                        StepAdjustment(
-                            MetricIntervalUpperBound=0,
-                            ScalingAdjustment=value['adjustment'],
-                        ),
-                    ],
-                ),
+                TargetTrackingScalingPolicyConfiguration=(
+                    TargetTrackingScalingPolicyConfiguration(
+                        PredefinedMetricSpecification=metric,
+                        TargetValue=TargetValue[ScalingMetric],
+                        ScaleOutCooldown=ScaleOutCooldown,
+                        ScaleInCooldown=ScaleInCooldown,
+                    )),
             ))
-        if state == "High":
+
+        return t
+
+    # Set scaling policies
+    states = {
+        "High": {
+            "threshold": ScaleUpLevel,
+            "alarmPrefix": "ScaleUpPolicyFor",
+            "operator": "GreaterThanOrEqualToThreshold",
+            "direction": 1,
+            "settings": config.get('ScaleUp') or {},
+        },
+        "Low": {
+            "threshold": ScaleDownLevel,
+            "alarmPrefix": "ScaleDownPolicyFor",
+            "operator": "LessThanOrEqualToThreshold",
+            "direction": -1,
+            "settings": config.get('ScaleDown') or {},
+        }
+    }
+
+    # With several metrics the alarms watch the highest of them
+    utilization = "".join(ScalingMetrics)
+    watched = alarm_metrics(ScalingMetrics, "{}Utilization", [
+        MetricDimension(
+            Name="ServiceName",
+            Value=GetAtt(ecsservice, "Name")
+        ),
+        MetricDimension(
+            Name="ClusterName",
+            Value=ImportValue(Join("-",
+                    [Select(0, Split("-", Ref("AWS::StackName"))),
+                    "cluster-id"]))
+        ),
+    ])
+
+    for state, value in states.items():
+        settings = value['settings']
+        runs = expand_ladder(settings.get('Steps'), value['direction'])
+        for index, run in enumerate(runs):
+            suffix = run_suffix(index)
+            policy = "{}{}{}".format(value['alarmPrefix'], utilization, suffix)
+
+            t.add_resource(Alarm(
+                "{}UtilizationToo{}{}".format(utilization, state, suffix),
+                AlarmDescription="Alarm if {} utilization too {}".format(
+                    " and ".join(ScalingMetrics),
+                    state),
+                Threshold=run_threshold(
+                    value['threshold'], run, value['direction']),
+                ComparisonOperator=value['operator'],
+                AlarmActions=[Ref(policy)],
+                **dict(watched, **alarm_evaluation(settings))
+            ))
+
+            step_config = StepScalingPolicyConfiguration(
+                AdjustmentType=run['adjustmentType'],
+                Cooldown=settings.get('Cooldown', 60),
+                MetricAggregationType='Average',
+                StepAdjustments=[
+                    StepAdjustment(**step) for step in run['steps']],
+            )
+            if run['adjustmentType'] == 'PercentChangeInCapacity':
+                step_config.MinAdjustmentMagnitude = 1
+
             t.add_resource(ScalingPolicy(
-                "{}{}".format(value['alarmPrefix'], utilization),
-                PolicyName="{}{}".format(value['alarmPrefix'], utilization),
+                policy,
+                PolicyName=policy,
                 PolicyType='StepScaling',
                 ScalingTargetId=Ref("scalableTarget"),
-                StepScalingPolicyConfiguration=StepScalingPolicyConfiguration(
-                    AdjustmentType='ChangeInCapacity',
-                    Cooldown=60,
-                    MetricAggregationType='Average',
-                    StepAdjustments=[
-                        StepAdjustment(
-                            MetricIntervalLowerBound=0,
-                            ScalingAdjustment=value['adjustment'],
-                        ),
-                    ],
-                ),
+                StepScalingPolicyConfiguration=step_config,
             ))
 
+    return t
+
 
-print(t.to_json())
+if __name__ == '__main__':
+    print(build_service_template(load_config()).to_json())
@@ -0,0 +1,126 @@
+"""Compare a Locust run against the baseline of the last promoted build.
+
+The service pipeline's LoadTest stage runs locustfile.py headless against
+the staging service and hands the CSV statistics to this script:
+
+    python perf_gate.py /tmp/perf/locust_stats.csv \\
+        --baseline /tmp/baseline.json --tolerance 20 \\
+        --output /tmp/perf/results.json
+
+It records the p50/p95/p99 latency (ms), throughput and failures of the run
+in the results file, and exits non-zero if a latency percentile is more
+than the tolerance (in percent) above the baseline, or if too many requests
+failed. Without a baseline (the first run) nothing is compared. Once a build
+reaches production its results become the new baseline.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+
+# Result keys and the Locust stats columns they are read from.
+PERCENTILES = [
+    ('p50', '50%'),
+    ('p95', '95%'),
+    ('p99', '99%'),
+]
+
+DEFAULT_MAX_FAILURE_RATE = 0.01
+
+
+def read_stats(path):
+    """Read the aggregated row of a Locust ``*_stats.csv`` file."""
+    with open(path, 'r') as f:
+        for row in csv.DictReader(f):
+            if row['Name'] != 'Aggregated':
+                continue
+            results = {
+                'requests': int(row['Request Count']),
+                'failures': int(row['Failure Count']),
+                'rps': float(row['Requests/s']),
+            }
+            if results['requests'] == 0:
+                raise ValueError("The load test made no requests")
+            for key, column in PERCENTILES:
+                results[key] = float(row[column])
+            return results
+    raise ValueError("No aggregated statistics in {}".format(path))
+
+
+def load_baseline(path):
+    """The promoted baseline results, or None if there are none yet."""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def regressions(results, baseline, tolerance):
+    """List ``(key, value, baseline, limit)`` for each latency percentile
+    more than ``tolerance`` percent above the baseline."""
+    found = []
+    for key, _ in PERCENTILES:
+        limit = baseline[key] * (1 + tolerance / 100.0)
+        if results[key] > limit:
+            found.append((key, results[key], baseline[key], limit))
+    return found
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check a Locust run against the promoted baseline.")
+    parser.add_argument('stats', help="Locust *_stats.csv file.")
+    parser.add_argument('--baseline', help="Baseline results JSON.")
+    parser.add_argument(
+        '--tolerance', type=float, default=20,
+        help="Allowed latency increase over the baseline, in percent.")
+    parser.add_argument(
+        '--max-failure-rate', type=float, default=DEFAULT_MAX_FAILURE_RATE,
+        help="Largest allowed fraction of failed requests.")
+    parser.add_argument('--output', help="Write the results JSON here.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = read_stats(args.stats)
+    baseline = load_baseline(args.baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    print("{} requests, {} failed, {:.1f} requests/s".format(
+        results['requests'], results['failures'], results['rps']))
+    for key, _ in PERCENTILES:
+        if baseline is None:
+            print("{}: {:g} ms".format(key, results[key]))
+        else:
+            print("{}: {:g} ms (baseline {:g} ms)".format(
+                key, results[key], baseline[key]))
+
+    failed = False
+    failureRate = results['failures'] / float(results['requests'])
+    if failureRate > args.max_failure_rate:
+        print("FAIL: {:.1%} of requests failed (at most {:.1%} allowed)".format(
+            failureRate, args.max_failure_rate))
+        failed = True
+
+    if baseline is None:
+        print("No baseline yet; latency is not compared.")
+    else:
+        for key, value, previous, limit in regressions(
+                results, baseline, args.tolerance):
+            print("FAIL: {} latency {:g} ms is over {:g} ms "
+                  "(baseline {:g} ms + {:g}%)".format(
+                      key, value, limit, previous, args.tolerance))
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
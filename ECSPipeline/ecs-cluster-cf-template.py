@@ -1,15 +1,20 @@
 """Generating CloudFormation template."""
 
+import hashlib
+import os
+
 import yaml
 
 from troposphere import (
     Base64,
     Export,
+    GetAtt,
     Join,
     Output,
     Parameter,
     Ref,
     Sub,
+    Tags,
     Template,
     ec2,
     FindInMap,
@@ -18,169 +23,812 @@ from troposphere import (
 
 from troposphere.autoscaling import (
     AutoScalingGroup,
+    InstancesDistribution,
     LaunchConfiguration,
-    ScalingPolicy
-)
-
-from troposphere.cloudwatch import (
-    Alarm,
-    MetricDimension
+    LaunchTemplateOverrides,
+    LaunchTemplateSpecification,
+    MixedInstancesPolicy,
+    ScalingPolicy,
+    StepAdjustments
 )
 
-from troposphere.ecs import Cluster
+from troposphere.autoscaling import LaunchTemplate as AutoScalingLaunchTemplate
 
-from troposphere.iam import (
-    InstanceProfile,
-    Role
+from troposphere.applicationautoscaling import (
+    ScalableTarget,
+    StepAdjustment,
+    StepScalingPolicyConfiguration,
 )
 
+from troposphere.applicationautoscaling import (
+    ScalingPolicy as ServiceScalingPolicy
+)
 
-# Instantiate the object
-t = Template()
-
-t.add_description("ECS Cluster Template")
-
-# Get configuration from YAML
-with open('cluster_config.yaml', 'r') as f:
-    doc = yaml.load(f)
-instanceSize = doc['instanceSize']
-desiredCapacity = doc['desiredCapacity']
-minCapacity = doc['minCapacity']
-maxCapacity = doc['maxCapacity']
-ScalingMetric = doc['ScalingMetric']
-ScaleUpLevel = doc['ScaleUpLevel']
-ScaleDownLevel = doc['ScaleDownLevel']
-
-
-
-
-##############
-# Parameters #
-##############
-
-
-t.add_parameter(Parameter(
-    "VpcId",
-    Type="String",
-    Description="VPC"
-))
-
-t.add_parameter(Parameter(
-    "PublicSubnet",
-    Description="PublicSubnet",
-    Type="String"
-))
+from troposphere.cloudwatch import (
+    Alarm,
+    Metric,
+    MetricDataQuery,
+    MetricDimension,
+    MetricStat,
+)
 
-t.add_parameter(Parameter(
-    "KeyPair",
-    Description="Name of an existing EC2 KeyPair to SSH",
-    Type="AWS::EC2::KeyPair::KeyName",
-    ConstraintDescription="must be the name of an existing EC2 KeyPair.",
-))
+from troposphere.ec2 import (
+    IamInstanceProfile,
+    LaunchTemplate,
+    LaunchTemplateData,
+    NetworkInterfaces,
+)
 
+from troposphere.ecs import (
+    AutoScalingGroupProvider,
+    CapacityProvider,
+    CapacityProviderStrategy,
+    CapacityProviderStrategyItem,
+    Cluster,
+    ClusterCapacityProviderAssociations,
+    ClusterSetting,
+    ContainerDefinition,
+    ManagedScaling,
+    PlacementStrategy,
+    Service,
+    TaskDefinition,
+)
 
+from troposphere.awslambda import (
+    Code,
+    Environment,
+    Function,
+    Permission,
+)
 
+from troposphere.events import (
+    Rule,
+    Target,
+)
 
+from troposphere.iam import (
+    InstanceProfile,
+    Policy,
+    Role
+)
 
-############
-# Mappings #
-############
+from cfgen.scaling_steps import (
+    DEFAULT_STEPS,
+    alarm_evaluation,
+    alarm_metrics,
+    expand_ladder,
+    parse_adjustment,
+    run_suffix,
+    run_threshold,
+    scaling_metrics,
+)
 
+import schedulable_slots
+
+
+def load_config(path='cluster_config.yaml'):
+    """Read the cluster configuration YAML."""
+    with open(path, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def add_step_policy(t, policy, run, settings, direction):
+    """Add the step scaling policy of one ladder run."""
+    # Step policies have no cooldown; new instances instead count
+    # towards the metric only once warmed up.
+    scaling_policy = t.add_resource(ScalingPolicy(
+        policy,
+        PolicyType="StepScaling",
+        AutoScalingGroupName=Ref("ECSAutoScalingGroup"),
+        AdjustmentType=run['adjustmentType'],
+        MetricAggregationType="Average",
+        StepAdjustments=[
+            StepAdjustments(**step) for step in run['steps']],
+    ))
+    if direction > 0:
+        scaling_policy.EstimatedInstanceWarmup = settings.get(
+            'Cooldown', 300)
+    if run['adjustmentType'] == 'PercentChangeInCapacity':
+        scaling_policy.MinAdjustmentMagnitude = 1
+
+
+def add_reservation_scaling(t, config):
+    """Scale the instances on CPU and/or memory reservation alarms."""
+    ScalingMetrics = scaling_metrics(config['ScalingMetric'])
+    ScaleUpLevel = config['ScaleUpLevel']
+    ScaleDownLevel = config['ScaleDownLevel']
+
+    for metric in ScalingMetrics:
+        if metric not in ("CPU", "Memory"):
+            raise ValueError(
+                "ScalingMetric must be CPU or Memory, got {}".format(metric))
+
+    states = {
+        "High": {
+            "threshold": ScaleUpLevel,
+            "alarmPrefix": "ScaleUpPolicyFor",
+            "operator": "GreaterThanThreshold",
+            "direction": 1,
+            "settings": config.get('ScaleUp') or {},
+        },
+        "Low": {
+            "threshold": ScaleDownLevel,
+            "alarmPrefix": "ScaleDownPolicyFor",
+            "operator": "LessThanThreshold",
+            "direction": -1,
+            "settings": config.get('ScaleDown') or {},
+        }
+    }
 
-# AMI Maps for EC2 ContainerInstances
-t.add_mapping('RegionMap', {
-    "us-east-1":      {"AMI": "ami-aff65ad2"},
-    "us-west-1":      {"AMI": "ami-69677709"},
-    "us-west-2":      {"AMI": "ami-40ddb938"}
-})
+    # With several metrics the alarms watch the highest of them
+    reservation = "".join(ScalingMetrics)
+    watched = alarm_metrics(ScalingMetrics, "{}Reservation", [
+        MetricDimension(
+            Name="ClusterName",
+            Value=Ref("ECSCluster")
+        ),
+    ])
 
+    for state, value in states.items():
+        settings = value['settings']
+        runs = expand_ladder(settings.get('Steps'), value['direction'])
+        for index, run in enumerate(runs):
+            suffix = run_suffix(index)
+            policy = "{}{}{}".format(value['alarmPrefix'], reservation, suffix)
+
+            t.add_resource(Alarm(
+                "{}ReservationToo{}{}".format(reservation, state, suffix),
+                AlarmDescription="Alarm if {} reservation too {}".format(
+                    " and ".join(ScalingMetrics),
+                    state),
+                Threshold=run_threshold(
+                    value['threshold'], run, value['direction']),
+                ComparisonOperator=value['operator'],
+                AlarmActions=[Ref(policy)],
+                **dict(watched, **alarm_evaluation(settings))
+            ))
+
+            add_step_policy(t, policy, run, settings, value['direction'])
+
+
+# Capacity providers every account has for running tasks on Fargate.
+FargateCapacityProviders = ["FARGATE", "FARGATE_SPOT"]
+
+
+def add_capacity_provider(t, settings, fargate=False):
+    """Let ECS scale the instances through a capacity provider.
+
+    With managed scaling ECS sizes the group to fit the running and pending
+    tasks, and with managed termination protection it only removes
+    instances that are not running tasks. ``fargate`` also makes the
+    Fargate capacity providers available to services.
+    """
+    protect = settings.get('ManagedTerminationProtection', True)
+
+    t.add_resource(CapacityProvider(
+        "ECSCapacityProvider",
+        AutoScalingGroupProvider=AutoScalingGroupProvider(
+            AutoScalingGroupArn=Ref("ECSAutoScalingGroup"),
+            ManagedScaling=ManagedScaling(
+                Status="ENABLED",
+                TargetCapacity=settings.get('TargetCapacity', 100),
+                MinimumScalingStepSize=settings.get(
+                    'MinimumScalingStepSize', 1),
+                MaximumScalingStepSize=settings.get(
+                    'MaximumScalingStepSize', 10),
+                InstanceWarmupPeriod=settings.get('InstanceWarmupPeriod', 300),
+            ),
+            ManagedTerminationProtection=(
+                "ENABLED" if protect else "DISABLED"),
+        ),
+    ))
+
+    t.add_resource(ClusterCapacityProviderAssociations(
+        "ECSClusterCapacityProviders",
+        Cluster=Ref("ECSCluster"),
+        CapacityProviders=[Ref("ECSCapacityProvider")] + (
+            FargateCapacityProviders if fargate else []),
+        DefaultCapacityProviderStrategy=[
+            CapacityProviderStrategy(
+                CapacityProvider=Ref("ECSCapacityProvider"),
+                Weight=1,
+            ),
+        ],
+    ))
+
+    t.add_output(Output(
+        "CapacityProvider",
+        Description="ECS capacity provider for the cluster instances",
+        Value=Ref("ECSCapacityProvider"),
+        Export=Export(Sub("${AWS::StackName}-capacity-provider")),
+    ))
+
+
+def inverted_ladder(steps, direction):
+    """Expand a ladder for a metric that falls as load rises.
+
+    The scale-up alarm then watches for the metric under its threshold, as
+    a reservation scale-down alarm does, with From counting below it; the
+    scale-down alarm watches above its threshold.
+    """
+    flipped = []
+    for step in steps or DEFAULT_STEPS[direction]:
+        adjustmentType, amount = parse_adjustment(step['Adjustment'])
+        flipped.append(dict(step, Adjustment="{}{}".format(
+            -amount,
+            "%" if adjustmentType == 'PercentChangeInCapacity' else "")))
+    runs = expand_ladder(flipped, -direction)
+    for run in runs:
+        for step in run['steps']:
+            step['ScalingAdjustment'] = str(-int(step['ScalingAdjustment']))
+    return runs
+
+
+def add_slots_scaling(t, settings):
+    """Scale the instances on how many more copies of the largest task fit.
+
+    A Lambda function runs schedulable_slots.py every minute to publish
+    the count, and the alarms add instances when it falls under ScaleUpBelow
+    and remove them when it rises over ScaleDownAbove.
+    """
+    scaleUpBelow = settings.get('ScaleUpBelow', 1)
+    scaleDownAbove = settings.get('ScaleDownAbove')
+    if scaleDownAbove is not None and not (
+            float(scaleDownAbove) > float(scaleUpBelow)):
+        raise ValueError(
+            "SchedulableSlots ScaleDownAbove ({}) must be over ScaleUpBelow "
+            "({})".format(scaleDownAbove, scaleUpBelow))
+
+    # The agent is over the 4096 characters CloudFormation takes as inline
+    # code, so the cluster build copies it into its output artifact and the
+    # function loads it from there. The Lambda Python runtime already has
+    # boto3, so nothing is built or installed. The artifact key changes on
+    # every run, so the source digest is tagged on the function to keep
+    # agent changes in the template the deploy gate fingerprints.
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'schedulable_slots.py'), 'rb') as f:
+        agentDigest = hashlib.sha256(f.read()).hexdigest()
+
+    t.add_resource(Role(
+        'SlotsAgentRole',
+        AssumeRolePolicyDocument={
+            'Version': '2012-10-17',
+            'Statement': [{
+                'Action': 'sts:AssumeRole',
+                'Principal': {'Service': 'lambda.amazonaws.com'},
+                'Effect': 'Allow',
+            }]
+        },
+        ManagedPolicyArns=[
+            'arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole',
+        ],
+        Policies=[Policy(
+            PolicyName='PublishSchedulableSlots',
+            PolicyDocument={
+                'Version': '2012-10-17',
+                'Statement': [{
+                    'Action': [
+                        'ecs:ListServices',
+                        'ecs:DescribeServices',
+                        'ecs:DescribeTaskDefinition',
+                        'ecs:ListContainerInstances',
+                        'ecs:DescribeContainerInstances',
+                        'cloudwatch:PutMetricData',
+                    ],
+                    'Resource': '*',
+                    'Effect': 'Allow',
+                }]
+            },
+        )],
+    ))
+
+    t.add_resource(Function(
+        'SlotsAgent',
+        Description="Publish the cluster's SchedulableSlots",
+        Runtime=settings.get('Runtime', 'python3.12'),
+        Handler='schedulable_slots.handler',
+        Code=Code(
+            S3Bucket=Ref('SlotsAgentBucket'),
+            S3Key=Ref('SlotsAgentKey'),
+        ),
+        Role=GetAtt('SlotsAgentRole', 'Arn'),
+        Timeout=60,
+        Environment=Environment(
+            Variables={'ECS_CLUSTER': Ref('ECSCluster')}),
+        Tags=Tags(SourceSha256=agentDigest),
+    ))
+
+    t.add_resource(Rule(
+        'SlotsAgentSchedule',
+        Description="Publish the cluster's SchedulableSlots",
+        ScheduleExpression=settings.get('Schedule', 'rate(1 minute)'),
+        Targets=[Target(
+            Id='SlotsAgent',
+            Arn=GetAtt('SlotsAgent', 'Arn'),
+        )],
+    ))
+
+    t.add_resource(Permission(
+        'SlotsAgentSchedulePermission',
+        Action='lambda:InvokeFunction',
+        FunctionName=Ref('SlotsAgent'),
+        Principal='events.amazonaws.com',
+        SourceArn=GetAtt('SlotsAgentSchedule', 'Arn'),
+    ))
+
+    states = {
+        "Low": {
+            "threshold": scaleUpBelow,
+            "alarmPrefix": "ScaleUpPolicyFor",
+            "operator": "LessThanThreshold",
+            "direction": 1,
+            "settings": settings.get('ScaleUp') or {},
+        },
+    }
+    if scaleDownAbove is not None:
+        states["High"] = {
+            "threshold": scaleDownAbove,
+            "alarmPrefix": "ScaleDownPolicyFor",
+            "operator": "GreaterThanThreshold",
+            "direction": -1,
+            "settings": settings.get('ScaleDown') or {},
+        }
 
+    for state, value in states.items():
+        stepSettings = value['settings']
+        runs = inverted_ladder(stepSettings.get('Steps'), value['direction'])
+        for index, run in enumerate(runs):
+            suffix = run_suffix(index)
+            policy = "{}SchedulableSlots{}".format(value['alarmPrefix'], suffix)
+
+            t.add_resource(Alarm(
+                "SchedulableSlotsToo{}{}".format(state, suffix),
+                AlarmDescription="Alarm if too {} copies of the largest task "
+                                 "fit".format(
+                                     "few" if state == "Low" else "many"),
+                Namespace=schedulable_slots.NAMESPACE,
+                MetricName=schedulable_slots.METRIC,
+                Dimensions=[MetricDimension(
+                    Name="ClusterName",
+                    Value=Ref("ECSCluster")
+                )],
+                Statistic="Average",
+                Period="60",
+                Threshold=run_threshold(
+                    value['threshold'], run, -value['direction']),
+                ComparisonOperator=value['operator'],
+                AlarmActions=[Ref(policy)],
+                **alarm_evaluation(stepSettings)
+            ))
+
+            add_step_policy(t, policy, run, stepSettings, value['direction'])
+
+
+# Most step adjustments a scaling policy may have
+MaxStepAdjustments = 20
+
+
+def eviction_steps(slots):
+    """Stop one placeholder task for each real task pending, and all of
+    them past the last step."""
+    bands = min(slots, MaxStepAdjustments - 1)
+    steps = []
+    for pending in range(bands + 1):
+        step = {
+            'MetricIntervalLowerBound': pending,
+            'ScalingAdjustment': -max(pending, 1),
+        }
+        if pending < bands:
+            step['MetricIntervalUpperBound'] = pending + 1
+        else:
+            step['ScalingAdjustment'] = -slots
+        steps.append(step)
+    return steps
+
+
+def add_placeholder_service(t, settings, capacityProvider=False):
+    """Keep Slots tasks' worth of instance capacity free for real tasks.
+
+    A service of pause containers holds the room, so the instance scaling
+    grows the cluster for it as for any other service. Once real tasks are
+    left pending, it stops one placeholder per pending task, and it starts
+    them all again once nothing has been pending for RestoreMinutes. The
+    pending count comes from Container Insights, which is enabled on the
+    cluster.
+    """
+    for key in ('Slots', 'TaskCPU', 'TaskMemory'):
+        if key not in settings:
+            raise ValueError("Overprovisioning needs {}".format(key))
+    slots = int(settings['Slots'])
+    if slots < 1:
+        raise ValueError(
+            "Overprovisioning Slots must be at least 1, got {}".format(slots))
+    restoreMinutes = int(settings.get('RestoreMinutes', 5))
+
+    t.add_resource(TaskDefinition(
+        'PlaceholderTask',
+        ContainerDefinitions=[ContainerDefinition(
+            Name='placeholder',
+            Image=settings.get(
+                'Image', 'public.ecr.aws/eks-distro/kubernetes/pause:3.9'),
+            Cpu=int(settings['TaskCPU']),
+            Memory=int(settings['TaskMemory']),
+            Essential=True,
+        )],
+    ))
+
+    service = Service(
+        'PlaceholderService',
+        Cluster=Ref('ECSCluster'),
+        TaskDefinition=Ref('PlaceholderTask'),
+        DesiredCount=slots,
+        # Spread the room over the instances, so any one of them can start
+        # a real task
+        PlacementStrategies=[
+            PlacementStrategy(Type='spread', Field='instanceId'),
+        ],
+        DependsOn=['ECSAutoScalingGroup'],
+    )
+    if capacityProvider:
+        # Pending placeholders then count towards managed scaling
+        service.CapacityProviderStrategy = [CapacityProviderStrategyItem(
+            CapacityProvider=Ref('ECSCapacityProvider'),
+            Weight=1,
+        )]
+        service.DependsOn.append('ECSClusterCapacityProviders')
+    else:
+        service.LaunchType = 'EC2'
+    t.add_resource(service)
+
+    t.add_resource(Role(
+        'PlaceholderScalingRole',
+        AssumeRolePolicyDocument={
+            'Version': '2012-10-17',
+            'Statement': [{
+                'Action': 'sts:AssumeRole',
+                'Principal': {
+                    'Service': 'application-autoscaling.amazonaws.com'},
+                'Effect': 'Allow',
+            }]
+        },
+        Policies=[Policy(
+            PolicyName='ScalePlaceholderService',
+            PolicyDocument={
+                'Version': '2012-10-17',
+                'Statement': [{
+                    'Action': [
+                        'ecs:UpdateService',
+                        'ecs:DescribeServices',
+                        'cloudwatch:DescribeAlarms',
+                    ],
+                    'Resource': '*',
+                    'Effect': 'Allow',
+                }]
+            },
+        )],
+    ))
+
+    t.add_resource(ScalableTarget(
+        'PlaceholderScalableTarget',
+        MinCapacity=0,
+        MaxCapacity=slots,
+        ResourceId=Join("/", [
+            "service",
+            Ref('ECSCluster'),
+            GetAtt('PlaceholderService', 'Name')]),
+        RoleARN=GetAtt('PlaceholderScalingRole', 'Arn'),
+        ScalableDimension='ecs:service:DesiredCount',
+        ServiceNamespace='ecs',
+    ))
+
+    # Real tasks pending: the cluster's pending tasks less the placeholders'
+    def pending_tasks(queryId, dimensions):
+        return MetricDataQuery(
+            Id=queryId,
+            MetricStat=MetricStat(
+                Metric=Metric(
+                    Namespace="ECS/ContainerInsights",
+                    MetricName="PendingTaskCount",
+                    Dimensions=dimensions,
+                ),
+                Period=60,
+                Stat="Maximum",
+            ),
+            ReturnData=False,
+        )
+
+    clusterDimension = MetricDimension(
+        Name="ClusterName",
+        Value=Ref("ECSCluster")
+    )
+    pending = [
+        pending_tasks("cluster", [clusterDimension]),
+        pending_tasks("placeholders", [
+            clusterDimension,
+            MetricDimension(
+                Name="ServiceName",
+                Value=GetAtt('PlaceholderService', 'Name')
+            ),
+        ]),
+        MetricDataQuery(
+            Id="pending",
+            Expression="FILL(cluster, 0) - FILL(placeholders, 0)",
+            Label="Real tasks pending",
+            ReturnData=True,
+        ),
+    ]
+
+    states = {
+        "Evict": {
+            "description": "Alarm if real tasks are pending",
+            "operator": "GreaterThanThreshold",
+            "evaluationPeriods": 1,
+            "adjustmentType": "ChangeInCapacity",
+            "steps": eviction_steps(slots),
+            "cooldown": 60,
+        },
+        "Restore": {
+            "description": "Alarm if no real task has been pending for "
+                           "{} minutes".format(restoreMinutes),
+            "operator": "LessThanOrEqualToThreshold",
+            "evaluationPeriods": restoreMinutes,
+            "adjustmentType": "ExactCapacity",
+            "steps": [{
+                'MetricIntervalUpperBound': 0,
+                'ScalingAdjustment': slots,
+            }],
+            "cooldown": restoreMinutes * 60,
+        },
+    }
 
+    for state, value in states.items():
+        policy = "{}Placeholders".format(state)
 
+        t.add_resource(Alarm(
+            "PendingTasksFor{}".format(state),
+            AlarmDescription=value['description'],
+            Metrics=pending,
+            Threshold="0",
+            ComparisonOperator=value['operator'],
+            EvaluationPeriods=value['evaluationPeriods'],
+            AlarmActions=[Ref(policy)],
+        ))
 
-#############
-# Resources #
-#############
+        t.add_resource(ServiceScalingPolicy(
+            policy,
+            PolicyName=policy,
+            PolicyType='StepScaling',
+            ScalingTargetId=Ref('PlaceholderScalableTarget'),
+            StepScalingPolicyConfiguration=StepScalingPolicyConfiguration(
+                AdjustmentType=value['adjustmentType'],
+                Cooldown=value['cooldown'],
+                MetricAggregationType='Maximum',
+                StepAdjustments=[
+                    StepAdjustment(**step) for step in value['steps']],
+            ),
+        ))
 
 
-# Security group to access the cluster. Includes PCAR proxy stuff.
-t.add_resource(ec2.SecurityGroup(
-    "SecurityGroup",
-    GroupDescription="Allow SSH and private network access",
-    SecurityGroupIngress=[
-        ec2.SecurityGroupRule(
-            IpProtocol="tcp",
-            FromPort=0,
-            ToPort=65535,
-            CidrIp="172.16.0.0/12",
-        ),
-        # Zscaler ranges
-        ec2.SecurityGroupRule(
-            IpProtocol="tcp",
-            FromPort="22",
-            ToPort="22",
-            CidrIp="165.225.50.0/23",
+def add_mixed_instances(t, asg, settings, userData):
+    """Launch the instances from a launch template over several instance
+    types, mixing on-demand and spot capacity."""
+    instanceTypes = settings.get('InstanceTypes') or []
+    if not instanceTypes:
+        raise ValueError("MixedInstances needs a list of InstanceTypes")
+    spotPercentage = int(settings.get('SpotPercentage', 100))
+    if not 0 <= spotPercentage <= 100:
+        raise ValueError(
+            "SpotPercentage must be between 0 and 100, got {}".format(
+                spotPercentage))
+
+    t.add_resource(LaunchTemplate(
+        'ContainerLaunchTemplate',
+        LaunchTemplateData=LaunchTemplateData(
+            UserData=userData,
+            ImageId=FindInMap("RegionMap", Ref("AWS::Region"), "AMI"),
+            KeyName=Ref("KeyPair"),
+            IamInstanceProfile=IamInstanceProfile(
+                Arn=GetAtt('EC2InstanceProfile', 'Arn')),
+            NetworkInterfaces=[NetworkInterfaces(
+                DeviceIndex=0,
+                AssociatePublicIpAddress=True,
+                Groups=[Ref("SecurityGroup")],
+            )],
         ),
-        ec2.SecurityGroupRule(
-            IpProtocol="tcp",
-            FromPort="22",
-            ToPort="22",
-            CidrIp="104.129.192.0/23",
+    ))
+
+    asg.MixedInstancesPolicy = MixedInstancesPolicy(
+        InstancesDistribution=InstancesDistribution(
+            OnDemandBaseCapacity=settings.get('OnDemandBaseCapacity', 0),
+            OnDemandPercentageAboveBaseCapacity=100 - spotPercentage,
+            SpotAllocationStrategy=settings.get(
+                'SpotAllocationStrategy', 'capacity-optimized'),
         ),
-        ec2.SecurityGroupRule(
-            IpProtocol="tcp",
-            FromPort="80",
-            ToPort="80",
-            CidrIp="165.225.50.0/23",
-        ),
-        ec2.SecurityGroupRule(
-            IpProtocol="tcp",
-            FromPort="80",
-            ToPort="80",
-            CidrIp="104.129.192.0/23",
+        LaunchTemplate=AutoScalingLaunchTemplate(
+            LaunchTemplateSpecification=LaunchTemplateSpecification(
+                LaunchTemplateId=Ref('ContainerLaunchTemplate'),
+                Version=GetAtt('ContainerLaunchTemplate', 'LatestVersionNumber'),
+            ),
+            Overrides=[
+                LaunchTemplateOverrides(InstanceType=instanceType)
+                for instanceType in instanceTypes
+            ],
         ),
-    ],
-    VpcId=Ref("VpcId")
-))
-
-# The ECS cluster
-t.add_resource(Cluster(
-    'ECSCluster',
-))
-
-# ECS Role
-t.add_resource(Role(
-    'EcsClusterRole',
-    ManagedPolicyArns=[
-        'arn:aws:iam::aws:policy/service-role/AmazonEC2RoleforSSM',
-        'arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryReadOnly',
-        'arn:aws:iam::aws:policy/service-role/AmazonEC2ContainerServiceforEC2Role',
-        'arn:aws:iam::aws:policy/CloudWatchFullAccess'
-    ],
-    AssumeRolePolicyDocument={
-        'Version': '2012-10-17',
-        'Statement': [{
-            'Action': 'sts:AssumeRole',
-            'Principal': {'Service': 'ec2.amazonaws.com'},
-            'Effect': 'Allow',
-        }]
-    }
-))
-
-# ECS Instance Profile
-t.add_resource(InstanceProfile(
-    'EC2InstanceProfile',
-    Roles=[Ref('EcsClusterRole')],
-))
-
-# ECS Launch Configuration to onboard new EC2 instances
-t.add_resource(LaunchConfiguration(
-    'ContainerInstances',
-    UserData=Base64(Join('', [
-        "#!/bin/bash -xe\n",
+    )
+    # Replace spot instances at elevated risk of interruption ahead of time
+    asg.CapacityRebalance = spotPercentage > 0
+
+
+def build_cluster_template(config):
+    """Build the ECS cluster template from a cluster configuration dict."""
+    instanceSize = config['instanceSize']
+    desiredCapacity = config['desiredCapacity']
+    minCapacity = config['minCapacity']
+    maxCapacity = config['maxCapacity']
+    capacityProvider = config.get('CapacityProvider')
+    fargate = config.get('FargateCapacityProviders', False)
+    mixedInstances = config.get('MixedInstances')
+    schedulableSlots = config.get('SchedulableSlots')
+    overprovisioning = config.get('Overprovisioning')
+    if capacityProvider and schedulableSlots:
+        raise ValueError(
+            "SchedulableSlots scaling cannot be combined with a "
+            "CapacityProvider, whose managed scaling already tracks placement")
+
+    # Instantiate the object
+    t = Template()
+
+    t.set_description("ECS Cluster Template")
+
+
+    ##############
+    # Parameters #
+    ##############
+
+
+    t.add_parameter(Parameter(
+        "VpcId",
+        Type="String",
+        Description="VPC"
+    ))
+
+    t.add_parameter(Parameter(
+        "PublicSubnet",
+        Description="PublicSubnet",
+        Type="String"
+    ))
+
+    t.add_parameter(Parameter(
+        "KeyPair",
+        Description="Name of an existing EC2 KeyPair to SSH",
+        Type="AWS::EC2::KeyPair::KeyName",
+        ConstraintDescription="must be the name of an existing EC2 KeyPair.",
+    ))
+
+    # Where the pipeline left schedulable_slots.py; the pipeline always
+    # passes these, and only a SchedulableSlots cluster uses them
+    t.add_parameter(Parameter(
+        "SlotsAgentBucket",
+        Description="S3 bucket of the SchedulableSlots agent code",
+        Type="String",
+        Default="",
+    ))
+
+    t.add_parameter(Parameter(
+        "SlotsAgentKey",
+        Description="S3 key of the zip holding schedulable_slots.py",
+        Type="String",
+        Default="",
+    ))
+
+
+    ############
+    # Mappings #
+    ############
+
+
+    # AMI Maps for EC2 ContainerInstances
+    t.add_mapping('RegionMap', {
+        "us-east-1":      {"AMI": "ami-aff65ad2"},
+        "us-west-1":      {"AMI": "ami-69677709"},
+        "us-west-2":      {"AMI": "ami-40ddb938"}
+    })
+
+
+    #############
+    # Resources #
+    #############
+
+
+    # Security group to access the cluster. Includes PCAR proxy stuff.
+    t.add_resource(ec2.SecurityGroup(
+        "SecurityGroup",
+        GroupDescription="Allow SSH and private network access",
+        SecurityGroupIngress=[
+            ec2.SecurityGroupRule(
+                IpProtocol="tcp",
+                FromPort=0,
+                ToPort=65535,
+                CidrIp="172.16.0.0/12",
+            ),
+            # Zscaler ranges
+            ec2.SecurityGroupRule(
+                IpProtocol="tcp",
+                FromPort="22",
+                ToPort="22",
+                CidrIp="165.225.50.0/23",
+            ),
+            ec2.SecurityGroupRule(
+                IpProtocol="tcp",
+                FromPort="22",
+                ToPort="22",
+                CidrIp="104.129.192.0/23",
+            ),
+            ec2.SecurityGroupRule(
+                IpProtocol="tcp",
+                FromPort="80",
+                ToPort="80",
+                CidrIp="165.225.50.0/23",
+            ),
+            ec2.SecurityGroupRule(
+                IpProtocol="tcp",
+                FromPort="80",
+                ToPort="80",
+                CidrIp="104.129.192.0/23",
+            ),
+        ],
+        VpcId=Ref("VpcId")
+    ))
+
+    # The ECS cluster
+    cluster = t.add_resource(Cluster(
+        'ECSCluster',
+    ))
+    if overprovisioning:
+        # The placeholders make room on the pending task counts it reports
+        cluster.ClusterSettings = [
+            ClusterSetting(Name='containerInsights', Value='enabled'),
+        ]
+    if fargate and not capacityProvider:
+        # Without a default strategy, services still default to EC2
+        cluster.CapacityProviders = FargateCapacityProviders
+
+    # ECS Role
+    t.add_resource(Role(
+        'EcsClusterRole',
+        ManagedPolicyArns=[
+            'arn:aws:iam::aws:policy/service-role/AmazonEC2RoleforSSM',
+            'arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryReadOnly',
+            'arn:aws:iam::aws:policy/service-role/AmazonEC2ContainerServiceforEC2Role',
+            'arn:aws:iam::aws:policy/CloudWatchFullAccess'
+        ],
+        AssumeRolePolicyDocument={
+            'Version': '2012-10-17',
+            'Statement': [{
+                'Action': 'sts:AssumeRole',
+                'Principal': {'Service': 'ec2.amazonaws.com'},
+                'Effect': 'Allow',
+            }]
+        }
+    ))
+
+    # ECS Instance Profile
+    t.add_resource(InstanceProfile(
+        'EC2InstanceProfile',
+        Roles=[Ref('EcsClusterRole')],
+    ))
+
+    ecsConfig = [
         "echo ECS_CLUSTER=",
         Ref('ECSCluster'),
-        " >> /etc/ecs/ecs.config\n",
+        " >> /etc/ecs/ecs.config\n"]
+    if mixedInstances:
+        # Drain tasks off spot instances when they get an interruption notice
+        ecsConfig.append("echo ECS_ENABLE_SPOT_INSTANCE_DRAINING=true"
+                         " >> /etc/ecs/ecs.config\n")
+
+    userData = Base64(Join('', [
+        "#!/bin/bash -xe\n"] + ecsConfig + [
         "yum install -y aws-cfn-bootstrap\n",
         "/opt/aws/bin/cfn-signal -e $? ",
         "         --stack ",
@@ -188,93 +836,82 @@ t.add_resource(LaunchConfiguration(
         "         --resource ECSAutoScalingGroup ",
         "         --region ",
         Ref('AWS::Region'),
-        "\n"])),
-    ImageId=FindInMap("RegionMap", Ref("AWS::Region"), "AMI"),
-    KeyName=Ref("KeyPair"),
-    SecurityGroups=[Ref("SecurityGroup")],
-    IamInstanceProfile=Ref('EC2InstanceProfile'),
-    InstanceType=instanceSize,
-    AssociatePublicIpAddress='true',
-))
-
-t.add_resource(AutoScalingGroup(
-    'ECSAutoScalingGroup',
-    DesiredCapacity=desiredCapacity,
-    MinSize=minCapacity,
-    MaxSize=maxCapacity,
-    VPCZoneIdentifier=Split(",", Ref("PublicSubnet")),
-    LaunchConfigurationName=Ref('ContainerInstances'),
-))
-
-states = {
-    "High": {
-        "threshold": ScaleUpLevel,
-        "alarmPrefix": "ScaleUpPolicyFor",
-        "operator": "GreaterThanThreshold",
-        "adjustment": "1"
-    },
-    "Low": {
-        "threshold": ScaleDownLevel,
-        "alarmPrefix": "ScaleDownPolicyFor",
-        "operator": "LessThanThreshold",
-        "adjustment": "-1"
-    }
-}
-
-for reservation in {ScalingMetric}:
-    for state, value in states.items():
-        t.add_resource(Alarm(
-            "{}ReservationToo{}".format(reservation, state),
-            AlarmDescription="Alarm if {} reservation too {}".format(
-                reservation,
-                state),
-            Namespace="AWS/ECS",
-            MetricName="{}Reservation".format(reservation),
-            Dimensions=[
-                MetricDimension(
-                    Name="ClusterName",
-                    Value=Ref("ECSCluster")
-                ),
-            ],
-            Statistic="Average",
-            Period="60",
-            EvaluationPeriods="1",
-            Threshold=value['threshold'],
-            ComparisonOperator=value['operator'],
-            AlarmActions=[
-                Ref("{}{}".format(value['alarmPrefix'], reservation))]
+        "\n"]))
+
+    asg = AutoScalingGroup(
+        'ECSAutoScalingGroup',
+        MinSize=minCapacity,
+        MaxSize=maxCapacity,
+        VPCZoneIdentifier=Split(",", Ref("PublicSubnet")),
+    )
+
+    if mixedInstances:
+        add_mixed_instances(t, asg, mixedInstances, userData)
+    else:
+        # ECS Launch Configuration to onboard new EC2 instances
+        t.add_resource(LaunchConfiguration(
+            'ContainerInstances',
+            UserData=userData,
+            ImageId=FindInMap("RegionMap", Ref("AWS::Region"), "AMI"),
+            KeyName=Ref("KeyPair"),
+            SecurityGroups=[Ref("SecurityGroup")],
+            IamInstanceProfile=Ref('EC2InstanceProfile'),
+            InstanceType=instanceSize,
+            AssociatePublicIpAddress='true',
         ))
-        t.add_resource(ScalingPolicy(
-            "{}{}".format(value['alarmPrefix'], reservation),
-            ScalingAdjustment=value['adjustment'],
-            AutoScalingGroupName=Ref("ECSAutoScalingGroup"),
-            AdjustmentType="ChangeInCapacity",
-        ))
-
-
-###########
-# Outputs #
-###########
-
-t.add_output(Output(
-    "Cluster",
-    Description="ECS Cluster Name",
-    Value=Ref("ECSCluster"),
-    Export=Export(Sub("${AWS::StackName}-id")),
-))
-
-t.add_output(Output(
-    "VpcId",
-    Description="VpcId",
-    Value=Ref("VpcId"),
-    Export=Export(Sub("${AWS::StackName}-vpc-id")),
-))
-
-t.add_output(Output(
-    "PublicSubnet",
-    Description="PublicSubnet",
-    Value=Ref("PublicSubnet"),
-    Export=Export(Sub("${AWS::StackName}-public-subnets")),
-))
-
-print(t.to_json())
+        asg.LaunchConfigurationName = Ref('ContainerInstances')
+
+    t.add_resource(asg)
+    if not capacityProvider:
+        asg.DesiredCapacity = desiredCapacity
+    elif not isinstance(capacityProvider, dict) or capacityProvider.get(
+            'ManagedTerminationProtection', True):
+        # ECS owns the desired capacity under managed scaling, and needs
+        # scale-in protection to keep instances that are running tasks.
+        asg.NewInstancesProtectedFromScaleIn = True
+
+    if capacityProvider:
+        add_capacity_provider(
+            t, capacityProvider if isinstance(capacityProvider, dict) else {},
+            fargate)
+    elif schedulableSlots:
+        add_slots_scaling(
+            t, schedulableSlots if isinstance(schedulableSlots, dict) else {})
+    else:
+        add_reservation_scaling(t, config)
+
+    if overprovisioning:
+        add_placeholder_service(
+            t, overprovisioning, capacityProvider=bool(capacityProvider))
+
+
+    ###########
+    # Outputs #
+    ###########
+
+    t.add_output(Output(
+        "Cluster",
+        Description="ECS Cluster Name",
+        Value=Ref("ECSCluster"),
+        Export=Export(Sub("${AWS::StackName}-id")),
+    ))
+
+    t.add_output(Output(
+        "VpcId",
+        Description="VpcId",
+        Value=Ref("VpcId"),
+        Export=Export(Sub("${AWS::StackName}-vpc-id")),
+    ))
+
+    t.add_output(Output(
+        "PublicSubnet",
+        Description="PublicSubnet",
+        Value=Ref("PublicSubnet"),
+        Export=Export(Sub("${AWS::StackName}-public-subnets")),
+    ))
+
+    return t
+
+
+if __name__ == '__main__':
+    print(build_cluster_template(load_config()).to_json())
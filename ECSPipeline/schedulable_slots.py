@@ -0,0 +1,182 @@
+"""Publish how many more copies of the largest task fit on the cluster.
+
+Reservation percentages say little about placement. A cluster at 80% CPU
+may still fit several tasks, and one at 50% may fit none when the free
+memory is spread over many instances. This agent takes the largest task
+any service on the cluster runs, and counts the copies that fit in what
+each container instance has left. The count is published as the cluster's
+SchedulableSlots metric for its scaling alarms:
+
+    python schedulable_slots.py --cluster my-cluster
+    SchedulableSlots=3 (largest task 256 CPU, 512 MiB, 2 instances)
+
+The largest task has the most CPU and the most memory of any EC2 service's
+task definition, and all of their fixed host ports. A task reserves its
+task-level CPU and memory when set. Otherwise it reserves the sum of its
+containers' CPU and MemoryReservation, or Memory where there is no
+reservation.
+
+ECS and CloudWatch are reached through any objects with the methods of the
+boto3 clients, so the agent can run against stubs. The cluster template
+runs it every minute as a Lambda function, through ``handler``.
+"""
+
+import argparse
+import os
+
+
+NAMESPACE = 'ECS/Headroom'
+METRIC = 'SchedulableSlots'
+
+
+def _pages(method, key, **kwargs):
+    """Every item of a paginated list call."""
+    while True:
+        response = method(**kwargs)
+        for item in response.get(key, []):
+            yield item
+        if not response.get('nextToken'):
+            return
+        kwargs['nextToken'] = response['nextToken']
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def task_requirements(task_definition):
+    """The CPU units, memory (MiB) and fixed host ports a task reserves."""
+    containers = task_definition.get('containerDefinitions', [])
+    cpu = task_definition.get('cpu')
+    memory = task_definition.get('memory')
+    if cpu is None:
+        cpu = sum(int(c.get('cpu', 0)) for c in containers)
+    if memory is None:
+        memory = sum(int(c.get('memoryReservation') or c.get('memory', 0))
+                     for c in containers)
+    ports = set()
+    if task_definition.get('networkMode', 'bridge') in ('bridge', 'host'):
+        for container in containers:
+            for mapping in container.get('portMappings', []):
+                port = mapping.get('hostPort')
+                if task_definition.get('networkMode') == 'host':
+                    port = port or mapping.get('containerPort')
+                if port:
+                    ports.add(str(port))
+    return {'cpu': int(cpu), 'memory': int(memory), 'ports': ports}
+
+
+def largest_task(ecs, cluster):
+    """The largest task the cluster's EC2 services run, or None."""
+    arns = list(_pages(ecs.list_services, 'serviceArns', cluster=cluster))
+    definitions = set()
+    for batch in _batches(arns, 10):
+        for service in ecs.describe_services(
+                cluster=cluster, services=batch)['services']:
+            if service.get('launchType') == 'FARGATE' or any(
+                    item['capacityProvider'].startswith('FARGATE')
+                    for item in service.get('capacityProviderStrategy', [])):
+                continue
+            definitions.add(service['taskDefinition'])
+    if not definitions:
+        return None
+    largest = {'cpu': 0, 'memory': 0, 'ports': set()}
+    for arn in sorted(definitions):
+        task = task_requirements(ecs.describe_task_definition(
+            taskDefinition=arn)['taskDefinition'])
+        largest['cpu'] = max(largest['cpu'], task['cpu'])
+        largest['memory'] = max(largest['memory'], task['memory'])
+        largest['ports'] |= task['ports']
+    return largest
+
+
+def instance_slots(instance, task):
+    """Copies of the task that fit in what a container instance has left."""
+    if instance.get('status') != 'ACTIVE' or not instance.get(
+            'agentConnected', False):
+        return 0
+    remaining = dict((resource['name'], resource)
+                     for resource in instance.get('remainingResources', []))
+    fits = []
+    for name, key in (('CPU', 'cpu'), ('MEMORY', 'memory')):
+        if task[key] > 0:
+            free = remaining.get(name, {}).get('integerValue', 0)
+            fits.append(free // task[key])
+    if task['ports']:
+        # A fixed host port takes the whole instance for one copy
+        taken = set(remaining.get('PORTS', {}).get('stringSetValue', []))
+        fits.append(0 if task['ports'] & taken else 1)
+    return min(fits) if fits else 0
+
+
+def schedulable_slots(ecs, cluster, task=None):
+    """Count the copies of the task (by default the largest) that fit.
+
+    Returns the count, the task and the number of active instances.
+    """
+    task = task or largest_task(ecs, cluster)
+    arns = list(_pages(ecs.list_container_instances, 'containerInstanceArns',
+                       cluster=cluster, status='ACTIVE'))
+    instances = []
+    for batch in _batches(arns, 100):
+        instances.extend(ecs.describe_container_instances(
+            cluster=cluster, containerInstances=batch)['containerInstances'])
+    if task is None:
+        return 0, None, len(instances)
+    return (sum(instance_slots(instance, task) for instance in instances),
+            task, len(instances))
+
+
+def publish(cloudwatch, cluster, slots):
+    cloudwatch.put_metric_data(
+        Namespace=NAMESPACE,
+        MetricData=[{
+            'MetricName': METRIC,
+            'Dimensions': [{'Name': 'ClusterName', 'Value': cluster}],
+            'Value': slots,
+            'Unit': 'Count',
+        }])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Publish how many more copies of the largest task fit "
+                    "on the cluster.")
+    parser.add_argument(
+        '--cluster', default=os.environ.get('ECS_CLUSTER'),
+        help="Cluster name (default: $ECS_CLUSTER).")
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help="Print the count without publishing it.")
+    args = parser.parse_args(argv)
+    if not args.cluster:
+        parser.error("--cluster or ECS_CLUSTER is required")
+    return args
+
+
+def main(argv=None, ecs=None, cloudwatch=None):
+    args = parse_args(argv)
+    if ecs is None or cloudwatch is None:
+        import boto3
+        ecs = ecs or boto3.client('ecs')
+        cloudwatch = cloudwatch or boto3.client('cloudwatch')
+    slots, task, instances = schedulable_slots(ecs, args.cluster)
+    if task is None:
+        print("No EC2 services on {}; nothing to publish".format(
+            args.cluster))
+        return slots
+    print("{}={} (largest task {} CPU, {} MiB, {} instances)".format(
+        METRIC, slots, task['cpu'], task['memory'], instances))
+    if not args.dry_run:
+        publish(cloudwatch, args.cluster, slots)
+    return slots
+
+
+def handler(event, context):
+    """Lambda entry point; the cluster comes from ECS_CLUSTER."""
+    return main([])
+
+
+if __name__ == '__main__':
+    main()
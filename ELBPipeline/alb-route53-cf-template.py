@@ -4,6 +4,8 @@ from troposphere import elasticloadbalancingv2 as elb
 
 from troposphere import route53
 
+from troposphere.cloudformation import Stack
+
 from troposphere import (
     Export,
     GetAtt,
@@ -20,210 +22,591 @@ from troposphere import (
     FindInMap
 )
 
-import yaml
-
-
-
+import argparse
 
+import os
 
+import sys
 
+import yaml
 
-t = Template()
+from rule_priorities import (
+    STATE_FILE,
+    allocate,
+    load_state,
+    save_state,
+    unassigned
+)
 
-t.add_description("Multi-path ALB for the ECS Cluster")
 
 """
 This template creates an ALB that can provide path forwarding
 to multiple services on an ECS cluster.
 """
 
-# Define a list of services, in order of priority, to be routed by the ALB:
-with open('services.yaml', 'r') as f:
-    doc = yaml.load(f)
-domain = next(iter(doc))
-services = doc[domain]
-
-Environments = ["stag", "prod"]
-
 
+def load_config(path='services.yaml'):
+    """Read the services YAML.
 
+    The listener rule priority state kept next to it is loaded into the
+    ``RulePriorities`` key, so the config holds everything the template is
+    rendered from.
+    """
+    with open(path, 'r') as f:
+        config = yaml.safe_load(f)
+    config['RulePriorities'] = load_state(state_path(path))
+    return config
 
 
-t.add_mapping('RegionZIDMap', {
-    "us-east-1":      {"ZoneID": "Z35SXDOTRQ7X7K"},
-    "us-west-1":      {"ZoneID": "Z368ELLRRE2KJ0"},
-    "us-west-2":      {"ZoneID": "Z1H1FL5HABSF5"}
-})
+def state_path(config_path):
+    return os.path.join(os.path.dirname(config_path), STATE_FILE)
 
 
-# Create a set of resources for each environment
-for e in Environments:
+Environments = ["stag", "prod"]
 
-    # Define a Security group with Port 80, this is the port the LB will listen on
-    t.add_resource(ec2.SecurityGroup(
-        "{}ELBSecurityGroup".format(e),
-        GroupDescription="Web load balancer security group.",
+# Default budgets for packing services onto load balancers and stacks. An
+# ALB listener takes 100 rules (excluding the default action), and a
+# CloudFormation stack takes 500 resources and 200 outputs.
+MaxRulesPerListener = 100
+MaxResourcesPerStack = 500
+MaxOutputsPerStack = 200
+
+# Nested stack resources the main stack keeps room for.
+MaxNestedStacks = 50
+
+# Resources and outputs generated per environment for each security group,
+# ALB shard (load balancer and listener) and service (target group,
+# listener rule and DNS record; target group, resource label and URL
+# outputs).
+RESOURCES_PER_STACK = 1
+RESOURCES_PER_SHARD = 2
+RESOURCES_PER_SERVICE = 3
+OUTPUTS_PER_SERVICE = 3
+
+TEMPLATE_NAME = "alb-route53-cf.template"
+SERVICE_TEMPLATE_NAME = "alb-route53-service-cf.template"
+
+
+def services_for(config):
+    """Return the domain and the list of service names.
+
+    The domain is the one key in services.yaml that holds a list; the other
+    keys are optional sharding budgets. Rules match on the host header, so
+    the order of services does not matter for routing.
+    """
+    domains = [k for k, v in config.items() if isinstance(v, list)]
+    if len(domains) != 1:
+        raise ValueError(
+            "services.yaml must list services under exactly one domain, "
+            "found {}".format(domains or "none"))
+    return domains[0], list(service_options(config[domains[0]]))
+
+
+def service_options(entries):
+    """Map each service name to its options.
+
+    A service is listed either by name or as a one-key mapping of its name
+    to options, e.g. ``- myapi: {TargetType: ip}`` for a Fargate service.
+    """
+    options = {}
+    for entry in entries:
+        if isinstance(entry, dict):
+            if len(entry) != 1:
+                raise ValueError(
+                    "Service entries must name one service, got {}".format(
+                        entry))
+            name, settings = next(iter(entry.items()))
+            options[name] = settings or {}
+        else:
+            options[entry] = {}
+    return options
+
+
+def target_type(options):
+    """Target type of a service's target groups: ``instance`` or ``ip``."""
+    kind = options.get('TargetType', 'instance')
+    if kind not in ("instance", "ip"):
+        raise ValueError(
+            "TargetType must be instance or ip, got {}".format(kind))
+    return kind
+
+
+def stack_usage(sizes, nested=0, nested_services=False,
+                environments=Environments):
+    """Count the resources and outputs of a stack of ALB shards.
+
+    ``sizes`` holds the number of services on each shard in the stack. With
+    ``nested_services`` each service is a single nested stack resource.
+    """
+    services = sum(sizes)
+    resources = len(environments) * (
+        RESOURCES_PER_STACK +
+        RESOURCES_PER_SHARD * len(sizes)) + nested
+    if nested_services:
+        return resources + services, 0
+    resources += len(environments) * RESOURCES_PER_SERVICE * services
+    outputs = len(environments) * OUTPUTS_PER_SERVICE * services
+    return resources, outputs
+
+
+def assign_rules(config):
+    """Assign each service an ALB shard, stack and listener rule priority.
+
+    Services in the ``RulePriorities`` state keep their slots; new ones are
+    packed within the listener rule, stack resource and output budgets.
+    """
+    max_resources = config.get('MaxResourcesPerStack', MaxResourcesPerStack)
+    max_outputs = config.get('MaxOutputsPerStack', MaxOutputsPerStack)
+    nested_services = config.get('NestedServiceStacks', False)
+
+    def fits(sizes, nested):
+        resources, outputs = stack_usage(sizes, nested, nested_services)
+        return resources <= max_resources and outputs <= max_outputs
+
+    domain, services = services_for(config)
+    return allocate(
+        services,
+        config.get('RulePriorities') or {},
+        fits,
+        config.get('MaxRulesPerListener', MaxRulesPerListener),
+        config.get('MaxNestedStacks', MaxNestedStacks))
+
+
+def shard_suffix(index):
+    """Logical ID suffix for an ALB shard. The first keeps the plain names."""
+    return "" if index == 0 else str(index)
+
+
+def child_template_name(index):
+    return "alb-route53-cf-stack{}.template".format(index)
+
+
+def url_prefix(e):
+    """Set a URL extension for non-prod environments."""
+    if e == "prod":
+        return ""
+    return "{}.".format(e)
+
+
+def add_region_zone_map(t):
+    t.add_mapping('RegionZIDMap', {
+        "us-east-1":      {"ZoneID": "Z35SXDOTRQ7X7K"},
+        "us-west-1":      {"ZoneID": "Z368ELLRRE2KJ0"},
+        "us-west-2":      {"ZoneID": "Z1H1FL5HABSF5"}
+    })
+
+
+def add_service_routing(t, prefix, e, s, priority, domain, listener,
+                        dns_name, load_balancer, export, label,
+                        depends_on=None, target_type=None):
+    """Add the target group, host-header rule, DNS record and outputs for a
+    service in one environment.
+
+    ``s`` is the service name or a reference to it, ``prefix`` the logical
+    ID prefix of the resources, ``load_balancer`` the load balancer's full
+    name, ``export`` the target group export name (an Fn::Sub string) and
+    ``label`` the service as named in descriptions. ``target_type``
+    overrides the default ``instance`` target type, e.g. with ``ip`` for
+    tasks using awsvpc networking.
+
+    Besides the target group ARN, the ``<export>-label`` export holds the
+    resource label ALBRequestCountPerTarget scaling policies need.
+    """
+    URLPathMod = url_prefix(e)
+
+    targetgroup = t.add_resource(elb.TargetGroup(
+        "{}TargetGroup".format(prefix),
+        Name=Join("-", [e, s, "TG"]),
+        HealthCheckIntervalSeconds="20",
+        HealthCheckProtocol="HTTP",
+        HealthCheckTimeoutSeconds="15",
+        HealthyThresholdCount="5",
+        HealthCheckPath="/",
+        Matcher=elb.Matcher(
+            HttpCode="200"),
+        Port=3000,
+        Protocol="HTTP",
+        UnhealthyThresholdCount="3",
         VpcId=ImportValue(
-            Join(
-                "-",
-                [e, "cluster-vpc-id"]
-            )
+            Join("-", [e, "cluster-vpc-id"])
         ),
-        SecurityGroupIngress=[
-            # ec2.SecurityGroupRule(
-            #     IpProtocol="tcp",
-            #     FromPort="80",
-            #     ToPort="80",
-            #     CidrIp="0.0.0.0/0",
-            ec2.SecurityGroupRule(
-                IpProtocol="tcp",
-                FromPort=0,
-                ToPort=65535,
-                CidrIp="172.16.0.0/12",
-            ),
-            # Zscaler ranges
-            ec2.SecurityGroupRule(
-                IpProtocol="tcp",
-                FromPort="22",
-                ToPort="22",
-                CidrIp="165.225.50.0/23",
-            ),
-            ec2.SecurityGroupRule(
-                IpProtocol="tcp",
-                FromPort="22",
-                ToPort="22",
-                CidrIp="104.129.192.0/23",
-            ),
-            ec2.SecurityGroupRule(
-                IpProtocol="tcp",
-                FromPort="80",
-                ToPort="80",
-                CidrIp="165.225.50.0/23",
-            ),
-            ec2.SecurityGroupRule(
-                IpProtocol="tcp",
-                FromPort="80",
-                ToPort="80",
-                CidrIp="104.129.192.0/23",
-            ),
-        ],
+        **({'DependsOn': depends_on} if depends_on else {})
     ))
+    if target_type is not None:
+        targetgroup.TargetType = target_type
+
+    t.add_resource(elb.ListenerRule(
+            "{}ListenerRule".format(prefix),
+            ListenerArn=listener,
+            Conditions=[elb.Condition(
+                Field="host-header",
+                Values=[Join("", [s, ".", URLPathMod, domain])]
+                )],
+            Actions=[elb.ListenerRuleAction(
+                Type="forward",
+                TargetGroupArn=Ref("{}TargetGroup".format(prefix))
+            )],
+            Priority=priority
+        ))
 
+    t.add_resource(route53.RecordSetType(
+        "{}DNSRecord".format(prefix),
+        HostedZoneName=Join("", [domain, "."]),
+        Name=Join("", [s, ".", URLPathMod, domain, "."]),
+        Type="A",
+        AliasTarget=route53.AliasTarget(
+            FindInMap("RegionZIDMap", Ref("AWS::Region"), "ZoneID"),
+            dns_name
+        )
+    ))
 
+    # Outputs
+    t.add_output(Output(
+        "{}TargetGroup".format(prefix),
+        Description="Target group for {} {}".format(e, label),
+        Value=Ref("{}TargetGroup".format(prefix)),
+        Export=Export(Sub(export))
+    ))
 
+    t.add_output(Output(
+        "{}TargetGroupLabel".format(prefix),
+        Description="Request count resource label for {} {}".format(
+            e, label),
+        Value=Join("/", [
+            load_balancer,
+            GetAtt("{}TargetGroup".format(prefix), "TargetGroupFullName")]),
+        Export=Export(Sub("{}-label".format(export)))
+    ))
 
-    # Add the LB using our SG and user-defined subnets
-    ALBResource = t.add_resource(elb.LoadBalancer(
-        "{}LoadBalancer".format(e),
-        Scheme="internet-facing",
-        Subnets=Split(
-            ',',
-            ImportValue(
-                Join("-", [e, "cluster-public-subnets"])
-            )
-        ),
-        SecurityGroups=[Ref("{}ELBSecurityGroup".format(e))],
+    t.add_output(Output(
+        "{}URL".format(prefix),
+        Description="Loadbalancer URL for {} in {}".format(label, e),
+        Value=Join("", ["http://", s, ".", URLPathMod, domain])
     ))
 
 
+def add_alb_shards(t, domain, shards, options, nested_services=False):
+    """Add the load balancers, listeners and per-service routing for shards.
 
+    ``shards`` is a list of shard states from ``assign_rules`` and
+    ``options`` maps services to their options in services.yaml. With
+    ``nested_services`` each service's routing goes into its own nested
+    stack instead of this template.
+    """
+    if not nested_services:
+        add_region_zone_map(t)
 
-    # Run a for-loop to create target groups for each service
-    for s in services:
-        t.add_resource(elb.TargetGroup(
-            #"TargetGroup",
-            "{}{}TargetGroup".format(e, s),
-            Name=Join("-", [e, s, "TG"]),
-            DependsOn="{}LoadBalancer".format(e),
-            HealthCheckIntervalSeconds="20",
-            HealthCheckProtocol="HTTP",
-            HealthCheckTimeoutSeconds="15",
-            HealthyThresholdCount="5",
-            HealthCheckPath="/",
-            Matcher=elb.Matcher(
-                HttpCode="200"),
-            Port=3000,
-            Protocol="HTTP",
-            UnhealthyThresholdCount="3",
+
+    # Create a set of resources for each environment
+    for e in Environments:
+        # Define a Security group with Port 80, this is the port the LB will listen on
+        t.add_resource(ec2.SecurityGroup(
+            "{}ELBSecurityGroup".format(e),
+            GroupDescription="Web load balancer security group.",
             VpcId=ImportValue(
-                Join("-", [e, "cluster-vpc-id"])
+                Join(
+                    "-",
+                    [e, "cluster-vpc-id"]
+                )
             ),
+            SecurityGroupIngress=[
+                # ec2.SecurityGroupRule(
+                #     IpProtocol="tcp",
+                #     FromPort="80",
+                #     ToPort="80",
+                #     CidrIp="0.0.0.0/0",
+                ec2.SecurityGroupRule(
+                    IpProtocol="tcp",
+                    FromPort=0,
+                    ToPort=65535,
+                    CidrIp="172.16.0.0/12",
+                ),
+                # Zscaler ranges
+                ec2.SecurityGroupRule(
+                    IpProtocol="tcp",
+                    FromPort="22",
+                    ToPort="22",
+                    CidrIp="165.225.50.0/23",
+                ),
+                ec2.SecurityGroupRule(
+                    IpProtocol="tcp",
+                    FromPort="22",
+                    ToPort="22",
+                    CidrIp="104.129.192.0/23",
+                ),
+                ec2.SecurityGroupRule(
+                    IpProtocol="tcp",
+                    FromPort="80",
+                    ToPort="80",
+                    CidrIp="165.225.50.0/23",
+                ),
+                ec2.SecurityGroupRule(
+                    IpProtocol="tcp",
+                    FromPort="80",
+                    ToPort="80",
+                    CidrIp="104.129.192.0/23",
+                ),
+            ],
         ))
 
 
+        for state in shards:
+            shard = shard_suffix(state['id'])
+            # Rule priorities are kept stable across runs by assign_rules
+            rules = sorted(
+                (priority, s) for s, priority in state['rules'].items())
+
+            # Add the LB using our SG and user-defined subnets
+            t.add_resource(elb.LoadBalancer(
+                "{}LoadBalancer{}".format(e, shard),
+                Scheme="internet-facing",
+                Subnets=Split(
+                    ',',
+                    ImportValue(
+                        Join("-", [e, "cluster-public-subnets"])
+                    )
+                ),
+                SecurityGroups=[Ref("{}ELBSecurityGroup".format(e))],
+            ))
 
+            if nested_services:
+                # The target groups live in the service stacks, which depend
+                # on this listener, so unmatched hosts get a plain 404.
+                default_action = elb.Action(
+                    Type="fixed-response",
+                    FixedResponseConfig=elb.FixedResponseConfig(
+                        StatusCode="404",
+                        ContentType="text/plain",
+                        MessageBody="Not Found"
+                    )
+                )
+            else:
+                default_action = elb.Action(
+                    Type="forward",
+                    TargetGroupArn=Ref("{}{}TargetGroup".format(e, rules[0][1]))
+                )
+
+            t.add_resource(elb.Listener(
+                "{}Listener{}".format(e, shard),
+                Port="80",
+                Protocol="HTTP",
+                LoadBalancerArn=Ref("{}LoadBalancer{}".format(e, shard)),
+                DefaultActions=[default_action]
+            ))
 
+            if nested_services:
+                continue
+
+            for priority, s in rules:
+                add_service_routing(
+                    t, "{}{}".format(e, s), e, s, priority, domain,
+                    listener=Ref("{}Listener{}".format(e, shard)),
+                    dns_name=GetAtt(
+                        "{}LoadBalancer{}".format(e, shard), "DNSName"),
+                    load_balancer=GetAtt(
+                        "{}LoadBalancer{}".format(e, shard),
+                        "LoadBalancerFullName"),
+                    export="{}-{}-tg".format(e, s),
+                    label=s,
+                    depends_on="{}LoadBalancer{}".format(e, shard),
+                    target_type=(
+                        None if target_type(options[s]) == "instance"
+                        else target_type(options[s])))
+
+    if not nested_services:
+        return
+
+    for state in shards:
+        shard = shard_suffix(state['id'])
+        for s, priority in sorted(state['rules'].items()):
+            parameters = {"ServiceName": s, "DomainName": domain}
+            if target_type(options[s]) != "instance":
+                parameters["TargetType"] = target_type(options[s])
+            for e in Environments:
+                env = e.capitalize()
+                parameters["{}ListenerArn".format(env)] = Ref(
+                    "{}Listener{}".format(e, shard))
+                parameters["{}LoadBalancerDNSName".format(env)] = GetAtt(
+                    "{}LoadBalancer{}".format(e, shard), "DNSName")
+                parameters["{}LoadBalancerFullName".format(env)] = GetAtt(
+                    "{}LoadBalancer{}".format(e, shard),
+                    "LoadBalancerFullName")
+                parameters["{}Priority".format(env)] = str(priority)
+            t.add_resource(Stack(
+                "{}ServiceStack".format(s),
+                TemplateURL=SERVICE_TEMPLATE_NAME,
+                Parameters=parameters,
+            ))
 
-    t.add_resource(elb.Listener(
-        "{}Listener".format(e),
-        Port="80",
-        Protocol="HTTP",
-        LoadBalancerArn=Ref("{}LoadBalancer".format(e)),
-        DefaultActions=[elb.Action(
-            Type="forward",
-            TargetGroupArn=Ref("{}{}TargetGroup".format(e, services[0]))
-        )]
-    ))
 
+def build_service_routing_template():
+    """Build the nested stack template that routes one service.
 
+    The same template is used for every service; the service, its listener
+    rule priority and the listeners it attaches to are parameters.
+    """
+    t = Template()
 
+    t.set_description("Host-based routing for one service on the ALBs")
 
-    for s in services:
-        # Set an integer for the rule priority. This assumes the list of
-        # services is ordered by priority.
-        priority = services.index(s) + 1
+    t.add_parameter(Parameter(
+        "ServiceName",
+        Type="String",
+        Description="Name of the service (the host name prefix)"
+    ))
 
-        # Set a URL extension for non-prod environments
-        if e == "prod":
-            URLPathMod = ""
-        else:
-            URLPathMod = "{}.".format(e)
-
-        t.add_resource(elb.ListenerRule(
-                "{}{}ListenerRule".format(e, s),
-                ListenerArn=Ref("{}Listener".format(e)),
-                Conditions=[elb.Condition(
-                    Field="host-header",
-                    Values=[Join("", [s, ".", URLPathMod, domain])]
-                    )],
-                Actions=[elb.Action(
-                    Type="forward",
-                    TargetGroupArn=Ref("{}{}TargetGroup".format(e, s))
-                )],
-                Priority=priority
-            ))
+    t.add_parameter(Parameter(
+        "DomainName",
+        Type="String",
+        Description="Domain name registered in Route53"
+    ))
 
+    t.add_parameter(Parameter(
+        "TargetType",
+        Type="String",
+        Default="instance",
+        AllowedValues=["instance", "ip"],
+        Description="Target type of the target groups (ip for awsvpc tasks)"
+    ))
 
-        t.add_resource(route53.RecordSetType(
-            "{}{}DNSRecord".format(e, s),
-            HostedZoneName=Join("", [domain, "."]),
-            Name=Join("", [s, ".", URLPathMod, domain, "."]),
-            Type="A",
-            AliasTarget=route53.AliasTarget(
-                FindInMap("RegionZIDMap", Ref("AWS::Region"), "ZoneID"),
-                GetAtt("{}LoadBalancer".format(e), "DNSName")
-            )
+    for e in Environments:
+        env = e.capitalize()
+        t.add_parameter(Parameter(
+            "{}ListenerArn".format(env),
+            Type="String",
+            Description="Listener to add the {} rule to".format(e)
         ))
-
-
-
-    # Outputs
-
-    for s in services:
-        t.add_output(Output(
-            "{}{}TargetGroup".format(e, s),
-            Description="Target group for {} {}".format(e, s),
-            Value=Ref("{}{}TargetGroup".format(e, s)),
-            Export=Export(Sub("{}-{}-tg".format(e, s)))
+        t.add_parameter(Parameter(
+            "{}LoadBalancerDNSName".format(env),
+            Type="String",
+            Description="DNS name of the {} load balancer".format(e)
         ))
-
-
-        t.add_output(Output(
-            "{}{}URL".format(e, s),
-            Description="Loadbalancer URL for {} in {}".format(s, e),
-            Value=Join("", ["http://", s, ".", URLPathMod, domain])
+        t.add_parameter(Parameter(
+            "{}LoadBalancerFullName".format(env),
+            Type="String",
+            Description="Full name of the {} load balancer".format(e)
+        ))
+        t.add_parameter(Parameter(
+            "{}Priority".format(env),
+            Type="Number",
+            Description="Priority of the {} listener rule".format(e)
         ))
 
+    add_region_zone_map(t)
+
+    for e in Environments:
+        env = e.capitalize()
+        add_service_routing(
+            t, e, e, Ref("ServiceName"),
+            Ref("{}Priority".format(env)), Ref("DomainName"),
+            listener=Ref("{}ListenerArn".format(env)),
+            dns_name=Ref("{}LoadBalancerDNSName".format(env)),
+            load_balancer=Ref("{}LoadBalancerFullName".format(env)),
+            export="{}-${{ServiceName}}-tg".format(e),
+            label="the service",
+            target_type=Ref("TargetType"))
+
+    return t
+
+
+def check_rules(config):
+    """Fail unless the rule priority state covers every service."""
+    domain, services = services_for(config)
+    missing = unassigned(services, config.get('RulePriorities') or {})
+    if missing:
+        raise ValueError(
+            "{} {} no listener rule priority in {}; run "
+            "alb-route53-cf-template.py --update-state and commit {}".format(
+                ", ".join(missing), "has" if len(missing) == 1 else "have",
+                STATE_FILE, STATE_FILE))
+
+
+def build_alb_route53_stacks(config):
+    """Build the ALB and Route53 templates from a services dict.
+
+    Returns a dict of template file name to Template, the main template
+    first. Shards assigned to stacks other than the main one go into nested
+    stacks, and with ``NestedServiceStacks`` so does each service's routing.
+    Nested stacks reference their templates by relative path for
+    ``aws cloudformation package``. Fails unless the rule priority state
+    covers every service.
+    """
+    check_rules(config)
+    domain, services = services_for(config)
+    options = service_options(config[domain])
+    nested_services = config.get('NestedServiceStacks', False)
+    shards = assign_rules(config)['shards']
+    stacks = sorted(set(shard['stack'] for shard in shards) | {0})
+
+    def stack_shards(stack):
+        return [shard for shard in shards if shard['stack'] == stack]
+
+    t = Template()
+
+    t.set_description("Multi-path ALB for the ECS Cluster")
+
+    add_alb_shards(t, domain, stack_shards(0), options, nested_services)
+
+    templates = {TEMPLATE_NAME: t}
+    for index in stacks[1:]:
+        child = Template()
+        child.set_description(
+            "Multi-path ALB for the ECS Cluster (stack {})".format(index))
+        add_alb_shards(
+            child, domain, stack_shards(index), options, nested_services)
+
+        name = child_template_name(index)
+        templates[name] = child
+        t.add_resource(Stack(
+            "ALBStack{}".format(index),
+            TemplateURL=name,
+        ))
 
-
-print(t.to_json())
+    if nested_services:
+        templates[SERVICE_TEMPLATE_NAME] = build_service_routing_template()
+
+    return templates
+
+
+def build_alb_route53_template(config):
+    """Build the main ALB and Route53 template from a services dict."""
+    return build_alb_route53_stacks(config)[TEMPLATE_NAME]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--output-dir',
+        help="Write the main template and any nested stack templates here "
+             "instead of printing the main template.")
+    parser.add_argument(
+        '--update-state', action='store_true',
+        help="Assign rule priorities to new services and drop removed ones "
+             "in {}, to commit with services.yaml.".format(STATE_FILE))
+    args = parser.parse_args(argv)
+
+    config = load_config()
+    if args.update_state:
+        config['RulePriorities'] = assign_rules(config)
+        save_state(state_path('services.yaml'), config['RulePriorities'])
+    try:
+        templates = build_alb_route53_stacks(config)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.output_dir is None:
+        if len(templates) > 1:
+            parser.error(
+                "services need {} stacks; use --output-dir to write the "
+                "nested stack templates".format(len(templates)))
+        print(templates[TEMPLATE_NAME].to_json())
+        return 0
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for name, template in templates.items():
+        with open(os.path.join(args.output_dir, name), 'w') as f:
+            f.write(template.to_json())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
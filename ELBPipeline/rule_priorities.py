@@ -0,0 +1,151 @@
+"""Persistent listener rule priorities for the ALB template.
+
+The state file records which ALB shard each service's rule lives on and its
+priority on that shard's listener, plus the stack each shard is deployed in:
+
+    shards:
+    - id: 0
+      stack: 0
+      rules:
+        helloworld: 1
+        goodbyeworld: 2
+
+Services already in the state keep their shard and priority. Removed
+services free their priority, and new services take the lowest free
+priority on the first shard with room, so adding or removing a service only
+touches that service's rule. Commit the state file alongside services.yaml.
+
+The state is only written by ``alb-route53-cf-template.py --update-state``.
+Other renders, the pipeline's included, fail while it misses a service, as
+a priority handed out there would not be kept for the next build.
+"""
+
+import heapq
+
+import yaml
+
+
+STATE_FILE = 'rule_priorities.yaml'
+
+STATE_HEADER = """\
+# Listener rule priorities, written by alb-route53-cf-template.py
+# --update-state. Commit this file with services.yaml so existing rules keep
+# their slots.
+"""
+
+
+def load_state(path):
+    """Read the state file, or return an empty state if there is none."""
+    try:
+        with open(path, 'r') as f:
+            state = yaml.safe_load(f)
+    except FileNotFoundError:
+        return {'shards': []}
+    return state or {'shards': []}
+
+
+def save_state(path, state):
+    with open(path, 'w') as f:
+        f.write(STATE_HEADER)
+        yaml.safe_dump(state, f, default_flow_style=False)
+
+
+def unassigned(services, state):
+    """The services that have no rule in the state yet."""
+    assigned = set(s for shard in state.get('shards', [])
+                   for s in shard['rules'])
+    return [s for s in services if s not in assigned]
+
+
+class FreeList(object):
+    """Hands out the lowest priorities not already taken on a listener."""
+
+    def __init__(self, used):
+        used = set(used)
+        self.next = max(used) + 1 if used else 1
+        self.free = [p for p in range(1, self.next) if p not in used]
+        heapq.heapify(self.free)
+
+    def take(self):
+        if self.free:
+            return heapq.heappop(self.free)
+        self.next += 1
+        return self.next - 1
+
+
+def _lowest_unused(ids):
+    ids = set(ids)
+    n = 0
+    while n in ids:
+        n += 1
+    return n
+
+
+def allocate(services, state, fits, max_rules, max_nested=0):
+    """Assign every service a shard and a listener rule priority.
+
+    ``fits(sizes, nested)`` reports whether a stack holding shards of the
+    given sizes (services per shard) and ``nested`` nested stack resources is
+    within budget. New shards go into the first stack with room, then into a
+    new stack; the main stack (0) keeps room for ``max_nested`` nested stack
+    resources. Returns the new state; ``state`` is left untouched.
+    """
+    wanted = set(services)
+    shards = []
+    for shard in state.get('shards', []):
+        rules = {s: p for s, p in shard['rules'].items() if s in wanted}
+        if rules:
+            shards.append(
+                {'id': shard['id'], 'stack': shard['stack'], 'rules': rules})
+
+    assigned = set(s for shard in shards for s in shard['rules'])
+    free = {shard['id']: FreeList(shard['rules'].values()) for shard in shards}
+
+    def sizes(stack, grow=None):
+        return [len(shard['rules']) + (shard is grow)
+                for shard in shards if shard['stack'] == stack]
+
+    def nested():
+        return len(set(shard['stack'] for shard in shards) - {0})
+
+    def stack_fits(stack, candidate, extra_nested=0):
+        if stack != 0:
+            return fits(candidate, 0)
+        return fits(candidate, max(nested() + extra_nested, max_nested))
+
+    for s in services:
+        if s in assigned:
+            continue
+        assigned.add(s)
+
+        shard = next(
+            (existing for existing in shards
+             if len(existing['rules']) < max_rules and
+             stack_fits(existing['stack'], sizes(existing['stack'], existing))),
+            None)
+
+        if shard is None:
+            stacks = sorted(set(sh['stack'] for sh in shards) | {0})
+            stack = next(
+                (n for n in stacks if stack_fits(n, sizes(n) + [1])), None)
+            if stack is None:
+                stack = _lowest_unused(stacks)
+                if not fits([1], 0):
+                    raise ValueError(
+                        "Sharding budgets are too small to hold a single "
+                        "service")
+                if not stack_fits(0, sizes(0), extra_nested=1):
+                    raise ValueError(
+                        "No room in the main stack for another nested stack; "
+                        "raise MaxNestedStacks")
+            shard = {
+                'id': _lowest_unused(sh['id'] for sh in shards),
+                'stack': stack,
+                'rules': {},
+            }
+            shards.append(shard)
+            free[shard['id']] = FreeList([])
+
+        shard['rules'][s] = free[shard['id']].take()
+
+    return {'shards': sorted(shards, key=lambda shard: shard['id'])}
@@ -0,0 +1,78 @@
+"""Load test all services behind the ALBs.
+
+One user class per service in ELBPipeline/services.yaml, weighted and
+paced as loadtest.yaml says, each sending its service's host name in the
+Host header. Point --host at the load balancer (or the local stand-in in
+docker-compose.yml):
+
+    locust -f alb_locustfile.py --host http://localhost:8080
+
+Settings come from the environment:
+
+    LOADTEST_SERVICES     services.yaml (default: ELBPipeline/services.yaml)
+    LOADTEST_CONFIG       loadtest.yaml (default: next to this file)
+    LOADTEST_ENVIRONMENT  stag or prod (default: from loadtest.yaml)
+    LOADTEST_REPORT       prefix of the per-service CSV/JSON report
+                          (default: loadtest)
+    LOADTEST_SHAPE        ramp, spike, step or soak to drive the service in
+                          LOADTEST_SERVICE_CONFIG across its scaling levels
+                          (default: a fixed user count from the command line)
+    LOADTEST_SERVICE_CONFIG  service_config.yaml (default:
+                          AppTemplates-Autoscaling/service_config.yaml)
+"""
+
+import os
+
+from locust import events
+from locust.runners import WorkerRunner
+
+from loadtest.config import load_yaml, targets
+from loadtest.report import service_rows, write_reports
+from loadtest.shapes import PhaseLog, phases, scaling_levels, shape_class
+from loadtest.users import user_classes
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SERVICES = os.environ.get(
+    'LOADTEST_SERVICES',
+    os.path.join(HERE, '..', '..', 'ELBPipeline', 'services.yaml'))
+CONFIG = os.environ.get('LOADTEST_CONFIG', os.path.join(HERE, 'loadtest.yaml'))
+REPORT = os.environ.get('LOADTEST_REPORT', 'loadtest')
+SHAPE = os.environ.get('LOADTEST_SHAPE')
+SERVICE_CONFIG = os.environ.get(
+    'LOADTEST_SERVICE_CONFIG',
+    os.path.join(HERE, '..', '..', 'AppTemplates-Autoscaling',
+                 'service_config.yaml'))
+
+config = load_yaml(CONFIG)
+phaseLog = PhaseLog()
+
+
+# Locust picks up the user classes defined at module level.
+globals().update(
+    (user.__name__, user)
+    for user in user_classes(targets(
+        load_yaml(SERVICES),
+        config,
+        os.environ.get('LOADTEST_ENVIRONMENT'))))
+
+if SHAPE:
+    shapeSettings = config.get('Shapes') or {}
+    ScalingShape = shape_class(
+        phases(SHAPE,
+               scaling_levels(load_yaml(SERVICE_CONFIG)),
+               float(shapeSettings.get('UsersPerTaskAtScaleUp', 10)),
+               shapeSettings),
+        phaseLog,
+        spawn_rate=float(shapeSettings.get('SpawnRate', 10)))
+
+
+@events.test_stop.add_listener
+def report_services(environment, **kwargs):
+    # Workers only hold their share; the master (or a local run) reports.
+    if isinstance(environment.runner, WorkerRunner):
+        return
+    write_reports(service_rows(environment.stats), REPORT)
+    if phaseLog.marks:
+        phaseLog.write(REPORT)
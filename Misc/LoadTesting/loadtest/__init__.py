@@ -0,0 +1,9 @@
+"""Load test every service behind the ALBs, as production traffic does.
+
+The services come from ELBPipeline/services.yaml, and loadtest.yaml sets
+each one's share of the users, its weighted mix of requests and its wait
+times. Every request goes to the load balancer with the service's host
+name in the Host header, so the listener rules route it as they would a
+real client's. Latency percentiles and error rates are reported per
+service.
+"""
@@ -0,0 +1,127 @@
+"""Read the services and their load test settings.
+
+services.yaml lists the services under their domain, by name or as a
+one-key mapping of the name to ALB options:
+
+    data-muffin.com:
+      - helloworld
+      - myapi: {TargetType: ip}
+
+loadtest.yaml sets the environment and the default wait time, and per
+service its weight (share of users), wait time and requests:
+
+    Environment: stag
+    WaitTime: [1, 3]
+    Services:
+      helloworld:
+        Weight: 3
+        Tasks:
+        - Path: /
+          Weight: 4
+        - Path: /health
+          Weight: 1
+
+Services missing from loadtest.yaml get a weight of 1 and a single GET /.
+"""
+
+import yaml
+
+
+Environments = ["stag", "prod"]
+
+DEFAULT_WAIT_TIME = [1, 3]
+
+DEFAULT_TASKS = [{'Method': 'GET', 'Path': '/', 'Weight': 1}]
+
+
+def load_yaml(path):
+    with open(path, 'r') as f:
+        return yaml.safe_load(f) or {}
+
+
+def services_for(config):
+    """Return the domain and the service names listed in services.yaml."""
+    domains = [k for k, v in config.items() if isinstance(v, list)]
+    if len(domains) != 1:
+        raise ValueError(
+            "services.yaml must list services under exactly one domain, "
+            "found {}".format(domains or "none"))
+    names = []
+    for entry in config[domains[0]]:
+        names.append(next(iter(entry)) if isinstance(entry, dict) else entry)
+    return domains[0], names
+
+
+def host_name(service, domain, environment):
+    """The host the ALB routes to a service, as in the listener rules."""
+    if environment not in Environments:
+        raise ValueError("Environment must be one of {}, got {}".format(
+            ", ".join(Environments), environment))
+    if environment == "prod":
+        return "{}.{}".format(service, domain)
+    return "{}.{}.{}".format(service, environment, domain)
+
+
+def wait_time(value):
+    """Normalise a wait time, seconds or a [min, max] range, to a pair."""
+    if isinstance(value, list):
+        if len(value) != 2 or value[0] > value[1]:
+            raise ValueError(
+                "WaitTime must be seconds or [min, max], got {}".format(value))
+        return float(value[0]), float(value[1])
+    return float(value), float(value)
+
+
+def parse_tasks(tasks, service):
+    parsed = []
+    for task in tasks:
+        if 'Path' not in task:
+            raise ValueError("Every task of {} needs a Path".format(service))
+        weight = int(task.get('Weight', 1))
+        if weight < 1:
+            raise ValueError(
+                "Task weights must be positive, got {} for {} {}".format(
+                    weight, service, task['Path']))
+        parsed.append({
+            'Method': task.get('Method', 'GET').upper(),
+            'Path': task['Path'],
+            'Weight': weight,
+        })
+    return parsed
+
+
+def targets(services_config, loadtest_config, environment=None):
+    """Build the load test target of every service.
+
+    Returns a list of dicts with the service ``name``, the ``host`` to send
+    in the Host header, its user ``weight``, ``wait`` range in seconds and
+    ``tasks`` (Method, Path and Weight).
+    """
+    domain, names = services_for(services_config)
+    environment = environment or loadtest_config.get('Environment', 'stag')
+    settings = loadtest_config.get('Services') or {}
+    unknown = sorted(set(settings) - set(names))
+    if unknown:
+        raise ValueError(
+            "loadtest.yaml configures services not in services.yaml: "
+            "{}".format(", ".join(unknown)))
+
+    defaultWait = loadtest_config.get('WaitTime', DEFAULT_WAIT_TIME)
+    result = []
+    for name in names:
+        service = settings.get(name) or {}
+        weight = int(service.get('Weight', 1))
+        if weight < 0:
+            raise ValueError(
+                "Weight must not be negative, got {} for {}".format(
+                    weight, name))
+        if weight == 0:
+            continue
+        result.append({
+            'name': name,
+            'host': host_name(name, domain, environment),
+            'weight': weight,
+            'wait': wait_time(service.get('WaitTime', defaultWait)),
+            'tasks': parse_tasks(service.get('Tasks', DEFAULT_TASKS), name),
+        })
+    return result
@@ -0,0 +1,63 @@
+"""Per-service latency percentiles and error rates.
+
+Locust reports each request name separately. This groups the entries by
+service (the first word of the request name) and writes one row per
+service, plus the total, as CSV and JSON.
+"""
+
+import csv
+import json
+
+
+PERCENTILES = [
+    ('p50', 0.50),
+    ('p95', 0.95),
+    ('p99', 0.99),
+]
+
+COLUMNS = ['service', 'requests', 'failures', 'error_rate', 'rps',
+           'average'] + [key for key, _ in PERCENTILES]
+
+
+def service_of(entry_name):
+    return entry_name.split(' ', 1)[0]
+
+
+def _row(service, entry):
+    requests = entry.num_requests
+    row = {
+        'service': service,
+        'requests': requests,
+        'failures': entry.num_failures,
+        'error_rate': entry.num_failures / float(requests) if requests else 0.0,
+        'rps': entry.total_rps,
+        'average': entry.avg_response_time,
+    }
+    for key, percentile in PERCENTILES:
+        row[key] = entry.get_response_time_percentile(percentile)
+    return row
+
+
+def service_rows(stats):
+    """Summarise a Locust RequestStats per service, with a Total row."""
+    from locust.stats import StatsEntry
+
+    totals = {}
+    for entry in stats.entries.values():
+        service = service_of(entry.name)
+        if service not in totals:
+            totals[service] = StatsEntry(stats, service, "")
+        totals[service].extend(entry)
+    rows = [_row(service, totals[service]) for service in sorted(totals)]
+    rows.append(_row("Total", stats.total))
+    return rows
+
+
+def write_reports(rows, prefix):
+    """Write ``<prefix>_services.csv`` and ``<prefix>_services.json``."""
+    with open("{}_services.csv".format(prefix), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open("{}_services.json".format(prefix), 'w') as f:
+        json.dump(rows, f, indent=1)
@@ -0,0 +1,213 @@
+"""Load shapes that drive a service across its autoscaling thresholds.
+
+The levels come from the service's service_config.yaml: the scale-up and
+scale-down levels (ScaleUpLevel/ScaleDownLevel, or TargetValue with target
+tracking), the task capacity range and the cooldowns. Users are sized from
+UsersPerTaskAtScaleUp in loadtest.yaml, the number of users that puts one
+task at the scale-up level (measure it once with a short run against a
+single task), assuming the metric grows in proportion to users per task.
+
+Each profile starts below the scale-down level, crosses the scale-up
+level, holds, and drops back below the scale-down level:
+
+    ramp   ramps up to the peak, holds, ramps back down
+    spike  jumps straight to the peak, holds, drops
+    step   climbs in steps, each past the scale-up level of the capacity
+           the previous step should have scaled out to
+    soak   ramps up and holds the peak for a long time
+
+Every phase change is logged with its time, so time-to-scale and latency
+during scale-out can be lined up with the load.
+"""
+
+import csv
+import math
+import time
+
+
+PROFILES = ['ramp', 'spike', 'step', 'soak']
+
+# How far past each level the load goes, as a fraction of the level.
+OVERSHOOT = 0.2
+
+# Most steps the step profile takes between the capacity limits.
+MAX_STEPS = 5
+
+EVALUATION_SECONDS = 60
+
+
+def _level(value):
+    if isinstance(value, dict):
+        return min(float(v) for v in value.values())
+    return float(value)
+
+
+def scaling_levels(service_config):
+    """Read the scaling thresholds, capacity and timings of a service.
+
+    Returns a dict with the ``up`` and ``down`` levels, the ``min`` and
+    ``max`` task counts, and ``scale_out``/``scale_in``: roughly how many
+    seconds one scaling action takes to be triggered and to settle.
+    """
+    if service_config.get('ScalingMode', 'Step') == 'TargetTracking':
+        up = _level(service_config['TargetValue'])
+        # Target tracking scales in once the metric is well under target.
+        down = up / 2
+        scaleOut = EVALUATION_SECONDS * 3 + int(
+            service_config.get('ScaleOutCooldown', 60))
+        scaleIn = EVALUATION_SECONDS * 15 + int(
+            service_config.get('ScaleInCooldown', 300))
+    else:
+        up = _level(service_config['ScaleUpLevel'])
+        down = _level(service_config['ScaleDownLevel'])
+        scaleUp = service_config.get('ScaleUp') or {}
+        scaleDown = service_config.get('ScaleDown') or {}
+        scaleOut = EVALUATION_SECONDS * int(
+            scaleUp.get('EvaluationPeriods', 1)) + int(
+                scaleUp.get('Cooldown', 60))
+        scaleIn = EVALUATION_SECONDS * int(
+            scaleDown.get('EvaluationPeriods', 1)) + int(
+                scaleDown.get('Cooldown', 60))
+    if not 0 < down < up:
+        raise ValueError(
+            "The scale-down level ({:g}) must be positive and under the "
+            "scale-up level ({:g})".format(down, up))
+    return {
+        'up': up,
+        'down': down,
+        'min': int(service_config['MinTaskCapacity']),
+        'max': int(service_config['MaxTaskCapacity']),
+        'scale_out': scaleOut,
+        'scale_in': scaleIn,
+    }
+
+
+def users_for(level, tasks, levels, users_per_task):
+    """Users that put ``tasks`` tasks at ``level`` of the scaling metric."""
+    return max(1, int(math.ceil(
+        users_per_task * tasks * level / levels['up'])))
+
+
+def phases(profile, levels, users_per_task, settings=None):
+    """List the phases of a profile.
+
+    Each phase is a dict with its ``name``, ``duration`` in seconds and the
+    ``users`` it starts and ends at, ramping linearly in between. Drops
+    back to low load happen at the start of the final cool-down phase.
+    ``settings`` can override RampSeconds, HoldSeconds, CoolDownSeconds and
+    SoakSeconds, which otherwise follow the scaling timings.
+    """
+    if profile not in PROFILES:
+        raise ValueError("Profile must be one of {}, got {}".format(
+            ", ".join(PROFILES), profile))
+    settings = settings or {}
+    steps = min(MAX_STEPS, levels['max'] - levels['min'] + 1)
+    hold = int(settings.get(
+        'HoldSeconds', levels['scale_out'] * max(2, steps)))
+    ramp = int(settings.get('RampSeconds', levels['scale_out'] * 2))
+    coolDown = int(settings.get(
+        'CoolDownSeconds',
+        levels['scale_in'] * (levels['max'] - levels['min'] + 1)))
+    soak = int(settings.get('SoakSeconds', max(hold, 3600)))
+
+    low = users_for(
+        levels['down'] * (1 - OVERSHOOT), levels['min'], levels,
+        users_per_task)
+    peak = users_for(
+        levels['up'] * (1 + OVERSHOOT), levels['min'], levels,
+        users_per_task)
+
+    def phase(name, duration, start, end=None):
+        return {'name': name, 'duration': duration, 'users': (
+            start, start if end is None else end)}
+
+    baseline = phase('baseline', levels['scale_in'], low)
+    if profile == 'ramp':
+        middle = [phase('ramp-up', ramp, low, peak),
+                  phase('hold', hold, peak),
+                  phase('ramp-down', ramp, peak, low)]
+    elif profile == 'spike':
+        middle = [phase('spike', hold, peak)]
+    elif profile == 'soak':
+        middle = [phase('ramp-up', ramp, low, peak),
+                  phase('soak', soak, peak),
+                  phase('ramp-down', ramp, peak, low)]
+    else:
+        capacities = sorted(set(
+            levels['min'] + int(round(
+                n * (levels['max'] - levels['min']) / float(max(1, steps - 1))))
+            for n in range(steps)))
+        middle = [
+            phase('step-{}'.format(tasks), levels['scale_out'] * 2,
+                  users_for(levels['up'] * (1 + OVERSHOOT), tasks, levels,
+                            users_per_task))
+            for tasks in capacities
+        ]
+    return [baseline] + middle + [phase('cool-down', coolDown, low)]
+
+
+class PhaseLog(object):
+    """Records when each phase of a shape starts."""
+
+    def __init__(self):
+        self.marks = []
+
+    def mark(self, name, users, now=None):
+        now = time.time() if now is None else now
+        offset = now - self.marks[0]['time'] if self.marks else 0.0
+        self.marks.append(
+            {'phase': name, 'time': now, 'offset': offset, 'users': users})
+        print("Load phase {} at {} (+{:.0f}s, {} users)".format(
+            name, time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now)),
+            offset, users))
+
+    def write(self, prefix):
+        """Write ``<prefix>_phases.csv``."""
+        with open("{}_phases.csv".format(prefix), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['phase', 'timestamp', 'offset', 'users'])
+            for mark in self.marks:
+                writer.writerow([
+                    mark['phase'],
+                    time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                  time.gmtime(mark['time'])),
+                    "{:.0f}".format(mark['offset']),
+                    mark['users'],
+                ])
+
+
+def users_at(plan, elapsed):
+    """Return ``(index, users)`` for the phase running at ``elapsed``
+    seconds, or None once the plan is over."""
+    start = 0.0
+    for index, phase in enumerate(plan):
+        end = start + phase['duration']
+        if elapsed < end:
+            first, last = phase['users']
+            fraction = (elapsed - start) / phase['duration']
+            return index, int(round(first + (last - first) * fraction))
+        start = end
+    return None
+
+
+def shape_class(plan, log, spawn_rate=10):
+    """A Locust LoadTestShape following the plan and logging its phases."""
+    from locust import LoadTestShape
+
+    def tick(self):
+        current = users_at(plan, self.get_run_time())
+        if current is None:
+            return None
+        index, users = current
+        if index != self.phase:
+            self.phase = index
+            log.mark(plan[index]['name'], users)
+        # Jumps (spikes and drops) start every user at once.
+        first, last = plan[index]['users']
+        rate = max(spawn_rate, users) if first == last else spawn_rate
+        return users, rate
+
+    return type('ScalingShape', (LoadTestShape,), {
+        'phase': None,
+        'tick': tick,
+    })
@@ -0,0 +1,41 @@
+"""Build a Locust user class per service.
+
+Requests are named ``<service> <path>`` so that Locust's own statistics
+keep the services apart, and report.py can group them per service.
+"""
+
+from locust import HttpUser, between
+
+
+def request_name(service, path):
+    return "{} {}".format(service, path)
+
+
+def _request_task(method, path, host, name):
+    def request(user):
+        user.client.request(method, path, headers={'Host': host}, name=name)
+    request.__name__ = name
+    return request
+
+
+def user_class(target):
+    """An HttpUser class making the target's weighted requests."""
+    tasks = {
+        _request_task(task['Method'], task['Path'], target['host'],
+                      request_name(target['name'], task['Path'])):
+            task['Weight']
+        for task in target['tasks']
+    }
+    class_name = "{}User".format(
+        "".join(part.capitalize()
+                for part in target['name'].replace('_', '-').split('-')))
+    return type(class_name, (HttpUser,), {
+        'weight': target['weight'],
+        'wait_time': between(*target['wait']),
+        'tasks': tasks,
+        'service': target['name'],
+    })
+
+
+def user_classes(targets):
+    return [user_class(target) for target in targets]
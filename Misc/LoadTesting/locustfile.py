@@ -1,11 +1,8 @@
-from locust import HttpLocust, TaskSet, task
+from locust import HttpUser, task
 
 
-class UserBehavior(TaskSet):
+class WebsiteUser(HttpUser):
 
     @task
     def get_something(self):
-        self.client.get("")
-
-class WebsiteUser(HttpLocust):
-    task_set = UserBehavior
+        self.client.get("/")
@@ -0,0 +1,132 @@
+"""Shared settings for the template-builder image.
+
+The pipelines' CFN build stages run the template generators, which need
+troposphere, awacs and PyYAML. By default each build installs them from
+PyPI before generating anything. The builder image stack
+(0_builder-image-cf-template.py) bakes the same pinned versions into an
+image in ECR, and a pipeline given that image as its BuilderImage
+parameter starts generating templates straight away.
+
+The image also carries the cfgen package, so the builds can render through
+its cache. Pipelines that do need the image.
+"""
+
+import base64
+import glob
+import gzip
+import hashlib
+import io
+import os
+import tarfile
+
+from troposphere import (
+    Equals,
+    If,
+    Not,
+    Parameter,
+    Ref
+)
+
+from troposphere.codebuild import Environment
+
+
+# Keep in step with the versions the generators are developed against.
+REQUIREMENTS = [
+    'troposphere==4.11.0',
+    'awacs==2.6.0',
+    'PyYAML==6.0.3',
+]
+
+# The ALB pipeline packages its nested stacks with the AWS CLI, and cfgen
+# keeps its render cache in S3 (boto3 to match the CLI's botocore).
+CLI_REQUIREMENTS = [
+    'awscli==1.32.0',
+    'boto3==1.34.0',
+]
+
+# Installs the generator dependencies unless the build image already has them.
+INSTALL_COMMAND = (
+    'python -c "import troposphere, awacs, yaml" 2>/dev/null || '
+    'pip install {}'.format(' '.join(REQUIREMENTS)))
+
+CFGEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cfgen')
+
+
+def cfgen_archive():
+    """The cfgen sources as a gzipped tar. Entries carry no timestamps or
+    owners, so the archive only changes with the sources."""
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as compressed:
+        with tarfile.open(fileobj=compressed, mode='w') as archive:
+            for path in sorted(glob.glob(os.path.join(CFGEN_DIR, '*.py'))):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                info = tarfile.TarInfo(
+                    'cfgen/{}'.format(os.path.basename(path)))
+                info.size = len(data)
+                info.mode = 0o644
+                archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+# The image build writes this out as cfgen.tar.gz next to the Dockerfile.
+CFGEN_ARCHIVE = base64.b64encode(cfgen_archive()).decode('ascii')
+
+DOCKERFILE = """FROM public.ecr.aws/docker/library/python:3.11-slim
+RUN pip install --no-cache-dir {}
+ADD cfgen.tar.gz /opt/cfgen/
+ENV PYTHONPATH=/opt/cfgen
+""".format(' '.join(REQUIREMENTS + CLI_REQUIREMENTS))
+
+# Tag the image by its contents, so changing a pin or cfgen publishes a new
+# tag and pipelines pick it up only when their BuilderImage parameter is
+# updated.
+IMAGE_TAG = hashlib.sha256(
+    (DOCKERFILE + CFGEN_ARCHIVE).encode('utf-8')).hexdigest()[:12]
+
+# Used when no builder image is given.
+STOCK_IMAGE = 'aws/codebuild/standard:7.0'
+
+
+def add_builder_image(t, required=False):
+    """Add the BuilderImage parameter and, unless the pipeline requires the
+    image, the UseBuilderImage condition."""
+    if required:
+        t.add_parameter(Parameter(
+            "BuilderImage",
+            Type="String",
+            MinLength=1,
+            Description="Template-builder image URI from the builder image "
+                        "stack"
+        ))
+        return
+
+    t.add_parameter(Parameter(
+        "BuilderImage",
+        Type="String",
+        Default="",
+        Description="Template-builder image URI from the builder image stack "
+                    "(leave empty to install the dependencies on each build)"
+    ))
+
+    t.add_condition(
+        "UseBuilderImage",
+        Not(Equals(Ref("BuilderImage"), ""))
+    )
+
+
+def builder_environment(required=False, **kwargs):
+    """A CodeBuild Environment running the builder image when one is given,
+    or the stock image otherwise."""
+    if required:
+        return Environment(
+            Image=Ref("BuilderImage"),
+            ImagePullCredentialsType="SERVICE_ROLE",
+            **kwargs
+        )
+    return Environment(
+        Image=If("UseBuilderImage", Ref("BuilderImage"), STOCK_IMAGE),
+        ImagePullCredentialsType=If(
+            "UseBuilderImage", "SERVICE_ROLE", "CODEBUILD"),
+        **kwargs
+    )
@@ -0,0 +1,8 @@
+"""Offline capacity planning for the ECS cluster and its services.
+
+These tools read the same YAML configs the generators do
+(ECSPipeline/cluster_config.yaml and each service's service_config.yaml)
+and need NumPy on top of the generators' requirements:
+
+    python -m capacity.simulate trace.csv --sweep service.ScaleUpLevel=50:90:10
+"""
@@ -0,0 +1,123 @@
+"""Load the cluster and service configs and the instance types they name."""
+
+import copy
+import importlib.util
+import os
+import sys
+
+import yaml
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CLUSTER_CONFIG = os.path.join(ROOT, 'ECSPipeline', 'cluster_config.yaml')
+SERVICE_CONFIG = os.path.join(
+    ROOT, 'AppTemplates-Autoscaling', 'service_config.yaml')
+SERVICES = os.path.join(ROOT, 'ELBPipeline', 'services.yaml')
+
+# vCPUs, memory (MiB) and approximate on-demand Linux price (USD per hour,
+# us-east-1) of the instance types the cluster is likely to run. ECS
+# registers 1024 CPU units per vCPU.
+INSTANCE_TYPES = {
+    't2.micro': (1, 1024, 0.0116),
+    't2.small': (1, 2048, 0.023),
+    't2.medium': (2, 4096, 0.0464),
+    't2.large': (2, 8192, 0.0928),
+    't3.micro': (2, 1024, 0.0104),
+    't3.small': (2, 2048, 0.0208),
+    't3.medium': (2, 4096, 0.0416),
+    't3.large': (2, 8192, 0.0832),
+    't3a.micro': (2, 1024, 0.0094),
+    't3a.small': (2, 2048, 0.0188),
+    't3a.medium': (2, 4096, 0.0376),
+    't3a.large': (2, 8192, 0.0752),
+    'm5.large': (2, 8192, 0.096),
+    'm5.xlarge': (4, 16384, 0.192),
+    'm5.2xlarge': (8, 32768, 0.384),
+    'c5.large': (2, 4096, 0.085),
+    'c5.xlarge': (4, 8192, 0.17),
+    'c5.2xlarge': (8, 16384, 0.34),
+    'r5.large': (2, 16384, 0.126),
+    'r5.xlarge': (4, 32768, 0.252),
+}
+
+# Share of an instance's memory left for tasks once the OS and the ECS
+# agent have taken theirs.
+REGISTERED_MEMORY = 0.94
+
+
+def load_yaml(path):
+    with open(path, 'r') as f:
+        return yaml.safe_load(f) or {}
+
+
+def instance_resources(instance_type):
+    """CPU units and memory (MiB) an instance type registers with ECS."""
+    if instance_type not in INSTANCE_TYPES:
+        raise ValueError("Unknown instance type {}; known types: {}".format(
+            instance_type, ", ".join(sorted(INSTANCE_TYPES))))
+    vcpus, memory, _ = INSTANCE_TYPES[instance_type]
+    return vcpus * 1024, int(memory * REGISTERED_MEMORY)
+
+
+def task_memory(service_config):
+    """Memory (MiB) a service's tasks are placed by: the soft
+    TaskMemoryReservation when set, else the TaskMemory hard limit."""
+    return int(service_config.get('TaskMemoryReservation')
+               or service_config['TaskMemory'])
+
+
+def cluster_instance_type(cluster_config):
+    """The instance type the cluster launches (the first of a mix)."""
+    mixed = cluster_config.get('MixedInstances')
+    if mixed:
+        return mixed['InstanceTypes'][0]
+    return cluster_config['instanceSize']
+
+
+def service_names(services_config):
+    """The service names listed under the domain in services.yaml, by name
+    or as a one-key mapping of the name to ALB options."""
+    domains = [k for k, v in services_config.items() if isinstance(v, list)]
+    if len(domains) != 1:
+        raise ValueError(
+            "services.yaml must list services under exactly one domain, "
+            "found {}".format(domains or "none"))
+    return [next(iter(entry)) if isinstance(entry, dict) else entry
+            for entry in services_config[domains[0]]]
+
+
+def set_setting(config, name, value):
+    """Return a copy of a config with a setting replaced. ``name`` may be
+    dotted to reach into a section, e.g. ``ScaleUp.Cooldown``."""
+    config = copy.deepcopy(config)
+    keys = name.split('.')
+    section = config
+    for key in keys[:-1]:
+        if not isinstance(section.get(key), dict):
+            section[key] = {}
+        section = section[key]
+    section[keys[-1]] = value
+    return config
+
+
+def load_module(name, path):
+    """Import one of the generators' modules from its file; the generator
+    directories are separate repositories, not packages."""
+    path = os.path.join(ROOT, path)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    # Generators import their neighbours, as when run from their directory
+    sys.path.insert(0, os.path.dirname(path))
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.pop(0)
+    return module
+
+
+def is_fargate(service_config):
+    """Whether a service's tasks run on Fargate rather than the cluster."""
+    return service_config.get('LaunchType') == 'FARGATE' or any(
+        item.get('CapacityProvider', '').startswith('FARGATE')
+        for item in service_config.get('CapacityProviderStrategy') or [])
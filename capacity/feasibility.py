@@ -0,0 +1,353 @@
+"""Check that every service can scale to its maximum on the cluster.
+
+Every service can run MaxTaskCapacity tasks of TaskCPU/TaskMemory on the
+cluster's instances. The stag and prod stacks of a service run on the
+stag-cluster and prod-cluster, both built from cluster_config.yaml, so each
+cluster holds one stack of every service. This packs that worst case
+(first fit, largest tasks first) onto maxCapacity instances of the
+cluster's instance type and reports:
+
+- the tasks left without room, and the services they belong to;
+- the CPU and memory stranded on instances where no task fits any more;
+- the services the cluster would not scale out for. The reservation
+  alarms only fire past ScaleUpLevel, so a cluster full of tasks that no
+  longer fit must reserve more than that. Packing one service's tasks
+  onto an instance shows whether the cluster is blocked. Mixing services
+  can strand more, which shows whether it is at risk.
+
+It then packs the same tasks onto every known instance type at once and
+recommends the cheapest types and counts that fit them without blocking:
+
+    python -m capacity.feasibility helloworld=../helloworld/service_config.yaml
+
+Services listed in ELBPipeline/services.yaml without a config of their own
+are checked with the template's service_config.yaml. Fargate services need
+no instances and are skipped. Exits with 1 when the current cluster cannot
+hold the worst case, so it can gate a config change.
+"""
+
+import argparse
+import math
+import os
+import sys
+
+import numpy as np
+
+from capacity.configs import (
+    CLUSTER_CONFIG,
+    INSTANCE_TYPES,
+    SERVICE_CONFIG,
+    SERVICES,
+    cluster_instance_type,
+    instance_resources,
+    is_fargate,
+    load_yaml,
+    service_names,
+    task_memory,
+)
+
+
+# Stacks of each service on one cluster: stag and prod have their own.
+ENVIRONMENTS = 1
+
+
+class Service(object):
+    """The worst-case demand of one service on the cluster."""
+
+    def __init__(self, name, config, environments=ENVIRONMENTS):
+        self.name = name
+        self.cpu = int(config['TaskCPU'])
+        self.memory = task_memory(config)
+        self.tasks = int(config['MaxTaskCapacity']) * environments
+        self.fargate = is_fargate(config)
+
+
+def load_services(arguments, services_path=SERVICES,
+                  environments=ENVIRONMENTS):
+    """Load ``NAME=PATH`` (or ``PATH``, named after its directory) service
+    configs, adding the services in services.yaml that have none."""
+    services = []
+    for argument in arguments:
+        name, _, path = argument.rpartition('=')
+        name = name or os.path.basename(
+            os.path.dirname(os.path.abspath(path)))
+        services.append(Service(name, load_yaml(path), environments))
+    if services_path and os.path.exists(services_path):
+        given = set(service.name for service in services)
+        default = load_yaml(SERVICE_CONFIG)
+        for name in service_names(load_yaml(services_path)):
+            if name not in given:
+                services.append(Service(name, default, environments))
+    return [service for service in services if not service.fargate]
+
+
+def worst_case(services):
+    """Every task the services can run, largest first, as arrays of CPU,
+    memory and the index of the service they belong to."""
+    owner = np.repeat(np.arange(len(services)),
+                      [service.tasks for service in services])
+    cpu = np.array([service.cpu for service in services])[owner]
+    memory = np.array([service.memory for service in services])[owner]
+    order = np.lexsort((-memory, -cpu))
+    return cpu[order], memory[order], owner[order]
+
+
+def pack(cpu, memory, instance_cpu, instance_memory, instances):
+    """First fit the tasks onto up to ``instances`` instances of each type.
+
+    ``instance_cpu`` and ``instance_memory`` hold one entry per instance
+    type, packed side by side. Returns the free CPU and memory left on
+    each (type, instance), whether each instance was used, and whether
+    each task was placed, per type.
+    """
+    freeCpu = np.repeat(instance_cpu[:, None], instances, axis=1)
+    freeMemory = np.repeat(instance_memory[:, None], instances, axis=1)
+    placed = np.zeros((len(instance_cpu), len(cpu)), dtype=bool)
+    types = np.arange(len(instance_cpu))
+    for index in range(len(cpu)):
+        fits = (freeCpu >= cpu[index]) & (freeMemory >= memory[index])
+        first = fits.argmax(axis=1)
+        fitted = fits[types, first]
+        freeCpu[types[fitted], first[fitted]] -= cpu[index]
+        freeMemory[types[fitted], first[fitted]] -= memory[index]
+        placed[:, index] = fitted
+    used = ((freeCpu < instance_cpu[:, None])
+            | (freeMemory < instance_memory[:, None]))
+    return freeCpu, freeMemory, used, placed
+
+
+def stranded(free_cpu, free_memory, used, services):
+    """CPU and memory left on used instances where no task fits, per type."""
+    cpu = np.array([service.cpu for service in services])
+    memory = np.array([service.memory for service in services])
+    fitsAny = ((free_cpu[..., None] >= cpu)
+               & (free_memory[..., None] >= memory)).any(axis=-1)
+    stuck = used & ~fitsAny
+    return ((free_cpu * stuck).sum(axis=1),
+            (free_memory * stuck).sum(axis=1))
+
+
+def watched_metrics(cluster):
+    metrics = cluster.get('ScalingMetric', 'CPU')
+    return metrics if isinstance(metrics, list) else [metrics]
+
+
+def full_reservation(service, services, instance_cpu, instance_memory,
+                     metrics):
+    """The reservation (%) the cluster's alarms see on instances too full
+    for another of the service's tasks: packed with only its tasks, and at
+    worst, mixed with the other services' tasks.
+
+    An instance is full once any resource is short of a task. If that
+    resource is watched, it is nearly all reserved. If not, the watched
+    one holds at least what it takes to fill the other with the tasks
+    that use the most of it for the least of the watched one.
+    """
+    slots = min(instance_cpu // service.cpu, instance_memory // service.memory)
+    totals = {'CPU': instance_cpu, 'Memory': instance_memory}
+    size = {'CPU': service.cpu, 'Memory': service.memory}
+    packed = max(100.0 * slots * size[metric] / totals[metric]
+                 for metric in metrics)
+
+    def sizes(task):
+        return {'CPU': task.cpu, 'Memory': task.memory}
+
+    bounds = []
+    for resource, total in totals.items():
+        # Full once more than this much of the resource is reserved
+        short = total - size[resource] + 1
+        if resource in metrics:
+            bounds.append(100.0 * short / total)
+            continue
+        watched = [metric for metric in metrics if metric != resource][0]
+        ratio = max(float(sizes(task)[resource]) / sizes(task)[watched]
+                    for task in services)
+        bounds.append(min(100.0, 100.0 * short / ratio / totals[watched]))
+    return packed, min(bounds)
+
+
+def check_cluster(services, cluster):
+    """Pack the worst case onto the cluster. Returns a dict with the
+    ``problems`` that block scaling and the numbers behind them."""
+    instanceType = cluster_instance_type(cluster)
+    instanceCpu, instanceMemory = instance_resources(instanceType)
+    provider = cluster.get('CapacityProvider') or {}
+    target = float(provider.get('TargetCapacity', 100))
+    # Managed scaling keeps TargetCapacity % of the instances in use.
+    instances = int(math.floor(int(cluster['maxCapacity']) * target / 100))
+    metrics = watched_metrics(cluster)
+    level = float(cluster['ScaleUpLevel'])
+
+    cpu, memory, owner = worst_case(services)
+    freeCpu, freeMemory, used, placed = pack(
+        cpu, memory, np.array([instanceCpu]), np.array([instanceMemory]),
+        max(instances, 1))
+    strandedCpu, strandedMemory = stranded(
+        freeCpu, freeMemory, used, services)
+
+    problems = []
+    rows = []
+    for index, service in enumerate(services):
+        mine = owner == index
+        unplaced = int((~placed[0] & mine).sum())
+        packed, worst = full_reservation(
+            service, services, instanceCpu, instanceMemory, metrics)
+        status = 'ok'
+        fits = service.cpu <= instanceCpu and service.memory <= instanceMemory
+        if not fits:
+            status = 'too large'
+            problems.append(
+                "{}: a {} CPU, {} MiB task does not fit on a {}".format(
+                    service.name, service.cpu, service.memory, instanceType))
+        elif unplaced:
+            status = 'capped'
+            problems.append(
+                "{}: {} of {} tasks do not fit on maxCapacity {} x {}".format(
+                    service.name, unplaced, service.tasks,
+                    cluster['maxCapacity'], instanceType))
+        # The alarms only matter for tasks that fit on an instance at all
+        watched = fits and not provider
+        if watched and packed <= level:
+            status = 'blocked'
+            problems.append(
+                "{}: instances full of its tasks reserve {:.0f}% {}, not "
+                "over ScaleUpLevel {:g}, so the cluster never scales out for "
+                "it".format(service.name, packed, "/".join(metrics), level))
+        elif watched and worst <= level and status == 'ok':
+            status = 'at risk'
+        rows.append({
+            'service': service.name,
+            'tasks': service.tasks,
+            'cpu': service.cpu,
+            'memory': service.memory,
+            'unplaced': unplaced,
+            'packed': packed,
+            'worst': worst,
+            'status': status,
+        })
+    return {
+        'instance_type': instanceType,
+        'instances': instances,
+        'needed': int(used[0].sum()),
+        'tasks': len(cpu),
+        'unplaced': int((~placed[0]).sum()),
+        'stranded_cpu': int(strandedCpu[0]),
+        'stranded_memory': int(strandedMemory[0]),
+        'services': rows,
+        'problems': problems,
+    }
+
+
+def compare_instance_types(services, cluster, types=None):
+    """Pack the worst case onto every instance type at once and list the
+    types that hold it, cheapest first."""
+    types = sorted(types or INSTANCE_TYPES)
+    resources = np.array([instance_resources(name) for name in types])
+    prices = np.array([INSTANCE_TYPES[name][2] for name in types])
+    instanceCpu, instanceMemory = resources[:, 0], resources[:, 1]
+
+    cpu, memory, _ = worst_case(services)
+    freeCpu, freeMemory, used, placed = pack(
+        cpu, memory, instanceCpu, instanceMemory, max(len(cpu), 1))
+    strandedCpu, strandedMemory = stranded(
+        freeCpu, freeMemory, used, services)
+    needed = used.sum(axis=1)
+    provider = cluster.get('CapacityProvider') or {}
+    target = float(provider.get('TargetCapacity', 100))
+    count = np.ceil(needed * 100.0 / target).astype(int)
+    count = np.maximum(count, int(cluster.get('minCapacity', 1)))
+
+    # Types whose reservation alarms would not fire for some service
+    metrics = watched_metrics(cluster)
+    level = float(cluster['ScaleUpLevel'])
+    blocked = np.zeros(len(types), dtype=bool)
+    if not provider:
+        for service in services:
+            slots = np.minimum(instanceCpu // service.cpu,
+                               instanceMemory // service.memory)
+            reservation = np.zeros(len(types))
+            if 'CPU' in metrics:
+                reservation = np.maximum(
+                    reservation, 100.0 * slots * service.cpu / instanceCpu)
+            if 'Memory' in metrics:
+                reservation = np.maximum(
+                    reservation,
+                    100.0 * slots * service.memory / instanceMemory)
+            blocked |= reservation <= level
+
+    feasible = placed.all(axis=1) & ~blocked
+    cost = count * prices
+    order = [index for index in np.lexsort((strandedCpu + strandedMemory,
+                                            cost))
+             if feasible[index]]
+    return [{
+        'instance_type': types[index],
+        'instances': int(count[index]),
+        'hourly': float(cost[index]),
+        'stranded_cpu': int(strandedCpu[index]),
+        'stranded_memory': int(strandedMemory[index]),
+    } for index in order]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m capacity.feasibility',
+        description="Check that every service can scale to its maximum on "
+                    "the cluster.")
+    parser.add_argument(
+        'configs', nargs='*', metavar='[NAME=]SERVICE_CONFIG',
+        help="a service's service_config.yaml (named after its directory)")
+    parser.add_argument('--cluster-config', default=CLUSTER_CONFIG)
+    parser.add_argument(
+        '--services', default=SERVICES,
+        help="services.yaml; listed services without a config get the "
+             "template's (default: ELBPipeline/services.yaml)")
+    parser.add_argument(
+        '--environments', type=int, default=ENVIRONMENTS,
+        help="stacks of each service on one cluster (default: 1, as stag and "
+             "prod have their own clusters)")
+    parser.add_argument(
+        '--top', type=int, default=5,
+        help="instance types to recommend (default: 5)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    cluster = load_yaml(args.cluster_config)
+    services = load_services(args.configs, args.services, args.environments)
+    if not services:
+        print("No services run on the cluster's instances")
+        return 0
+
+    report = check_cluster(services, cluster)
+    print("Worst case: {} tasks on up to {} x {} ({} used, {} tasks without "
+          "room)".format(report['tasks'], report['instances'],
+                         report['instance_type'], report['needed'],
+                         report['unplaced']))
+    print("Stranded on full instances: {} CPU units, {} MiB".format(
+        report['stranded_cpu'], report['stranded_memory']))
+    print("")
+    print("{:<20} {:>6} {:>6} {:>7} {:>9} {:>8} {:>8}  {}".format(
+        "service", "tasks", "cpu", "memory", "unplaced", "full %",
+        "worst %", "status"))
+    for row in report['services']:
+        print("{:<20} {:>6} {:>6} {:>7} {:>9} {:>8.0f} {:>8.0f}  {}".format(
+            row['service'], row['tasks'], row['cpu'], row['memory'],
+            row['unplaced'], row['packed'], row['worst'], row['status']))
+    print("")
+    for problem in report['problems']:
+        print("BLOCKED " + problem)
+
+    print("")
+    print("Instance types that hold the worst case, cheapest first:")
+    for option in compare_instance_types(services, cluster)[:args.top]:
+        print("  maxCapacity {:>3} x {:<11} ${:.3f}/h, stranded {} CPU, "
+              "{} MiB".format(option['instances'], option['instance_type'],
+                              option['hourly'], option['stranded_cpu'],
+                              option['stranded_memory']))
+    return 1 if report['problems'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,305 @@
+"""Recommend TaskCPU and memory limits from a service's exported metrics.
+
+Reads the service's CPUUtilization and MemoryUtilization as exported from
+CloudWatch (percent of what its tasks reserve, the ECS service metrics),
+in any of:
+
+- CSV files, with a column whose name contains ``cpu`` and/or one whose
+  name contains ``mem``;
+- JSON Lines files (``.jsonl``), one object per datapoint with such keys;
+- ``aws cloudwatch get-metric-data`` output pages (``.json``), where each
+  result's Id or Label names the metric.
+
+Values are streamed into fixed-size histograms, so months of one-minute
+data take constant memory. Usage is then:
+
+- TaskCPU reserves the --percentile of CPU usage at the target
+  utilization: the scaling level when the service scales on CPU, otherwise
+  --target;
+- TaskMemoryReservation, the soft limit tasks are placed by, reserves the
+  --percentile of memory usage the same way;
+- TaskMemory, the hard limit tasks are stopped at, covers the highest
+  memory usage seen plus --headroom. Export the Maximum statistic for
+  memory so it covers the largest task, not the average one.
+
+The service_config.yaml is printed with those values replaced, comments
+and all, to redirect over the original:
+
+    python -m capacity.rightsize service_config.yaml cpu.csv memory.json \\
+        > service_config.new.yaml
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import sys
+
+import numpy as np
+
+from capacity.configs import (
+    is_fargate,
+    load_module,
+    load_yaml,
+    task_memory,
+)
+
+
+# Histogram resolution and range, in utilization percent. ECS reports CPU
+# over 100% when tasks use idle CPU beyond their reservation.
+BIN_WIDTH = 0.1
+MAX_UTILIZATION = 1000.0
+
+# Values read before adding them to a histogram at once
+CHUNK = 8192
+
+CPU_STEP = 32
+MEMORY_STEP = 8
+
+METRICS = ('cpu', 'memory')
+
+
+class Histogram(object):
+    """Utilization values, counted in BIN_WIDTH bins."""
+
+    def __init__(self):
+        self.counts = np.zeros(
+            int(MAX_UTILIZATION / BIN_WIDTH) + 1, dtype=np.int64)
+        self.maximum = 0.0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.maximum = max(self.maximum, float(values.max()))
+        bins = np.clip(np.floor(values / BIN_WIDTH), 0,
+                       len(self.counts) - 1).astype(int)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def percentile(self, q):
+        """The upper edge of the bin holding the q-th percentile."""
+        if not self.total:
+            return None
+        if q >= 100:
+            return self.maximum
+        rank = np.searchsorted(
+            np.cumsum(self.counts), math.ceil(self.total * q / 100.0))
+        return min((rank + 1) * BIN_WIDTH, self.maximum)
+
+
+def metric_for(name):
+    """Which metric a column, key or result Id/Label holds, if any."""
+    name = name.lower()
+    if 'cpu' in name:
+        return 'cpu'
+    if 'mem' in name:
+        return 'memory'
+    return None
+
+
+def _read_rows(rows, histograms):
+    pending = dict((metric, []) for metric in METRICS)
+    for row in rows:
+        for key, value in row.items():
+            metric = metric_for(key or '')
+            if metric is None or value in (None, ''):
+                continue
+            pending[metric].append(float(value))
+            if len(pending[metric]) >= CHUNK:
+                histograms[metric].add(pending[metric])
+                pending[metric] = []
+    for metric, values in pending.items():
+        histograms[metric].add(values)
+
+
+def read_metrics(paths, histograms=None):
+    """Stream the files into a histogram per metric."""
+    histograms = histograms or dict(
+        (metric, Histogram()) for metric in METRICS)
+    for path in paths:
+        with open(path, 'r', newline='') as f:
+            if path.endswith('.csv'):
+                _read_rows(csv.DictReader(f), histograms)
+            elif path.endswith('.jsonl'):
+                _read_rows((json.loads(line) for line in f if line.strip()),
+                           histograms)
+            elif path.endswith('.json'):
+                # One get-metric-data page, at most 100,800 datapoints
+                for result in json.load(f).get('MetricDataResults', []):
+                    metric = metric_for(
+                        result.get('Label') or result.get('Id', ''))
+                    if metric:
+                        histograms[metric].add(result.get('Values', []))
+            else:
+                raise ValueError(
+                    "{} is not a .csv, .jsonl or .json file".format(path))
+    return histograms
+
+
+def _round_up(value, step):
+    return max(step, int(math.ceil(value / float(step))) * step)
+
+
+def target_utilization(config, metric, default):
+    """The utilization (%) a metric's reservation should sit at: the level
+    the service scales at, if it scales on the metric."""
+    name = {'cpu': 'CPU', 'memory': 'Memory'}[metric]
+    metrics = config.get('ScalingMetric', 'CPU')
+    if name not in (metrics if isinstance(metrics, list) else [metrics]):
+        return default
+    if config.get('ScalingMode', 'Step') == 'TargetTracking':
+        value = config['TargetValue']
+        return float(value[name] if isinstance(value, dict) else value)
+    return float(config['ScaleUpLevel'])
+
+
+def recommend(config, histograms, percentile=95, target=80, headroom=0.25):
+    """Recommend TaskCPU, TaskMemoryReservation and TaskMemory.
+
+    Returns a dict of the recommended values (for the metrics that have
+    data) and a dict of the usage behind them.
+    """
+    values = {}
+    usage = {}
+    cpu = histograms['cpu']
+    if cpu.total:
+        used = cpu.percentile(percentile) / 100.0 * int(config['TaskCPU'])
+        usage['cpu'] = used
+        values['TaskCPU'] = _round_up(
+            used * 100.0 / target_utilization(config, 'cpu', target),
+            CPU_STEP)
+    memory = histograms['memory']
+    if memory.total:
+        # The metric is relative to what the tasks are placed by
+        reserved = task_memory(config)
+        used = memory.percentile(percentile) / 100.0 * reserved
+        peak = memory.maximum / 100.0 * reserved
+        usage['memory'] = used
+        usage['memory_peak'] = peak
+        reservation = _round_up(
+            used * 100.0 / target_utilization(config, 'memory', target),
+            MEMORY_STEP)
+        limit = _round_up(peak * (1 + headroom), MEMORY_STEP)
+        values['TaskMemoryReservation'] = reservation
+        values['TaskMemory'] = max(limit, reservation + MEMORY_STEP)
+    return values, usage
+
+
+def fargate_size(config, values):
+    """Round recommendations up to the smallest Fargate task size that
+    holds them. Fargate sizes the whole task, so there is no soft limit."""
+    template = load_module('service_template', os.path.join(
+        'AppTemplates-Autoscaling', 'ecs-service-cf-template.py'))
+    cpu = values.get('TaskCPU', int(config['TaskCPU']))
+    memory = values.get('TaskMemory', int(config['TaskMemory']))
+    for size, memories in sorted(template.FargateTaskSizes.items()):
+        fitting = [m for m in memories if m >= memory]
+        if size >= cpu and fitting:
+            return {'TaskCPU': size, 'TaskMemory': fitting[0]}
+    raise ValueError(
+        "No Fargate task size has {} CPU and {} MiB".format(cpu, memory))
+
+
+def update_config(text, values):
+    """Replace settings in service_config.yaml text, keeping its comments
+    and quoting. Missing settings are added after the last one replaced."""
+    lines = text.splitlines(True)
+    last = 0
+    for key in ['TaskCPU', 'TaskMemory', 'TaskMemoryReservation']:
+        if key not in values:
+            continue
+        pattern = re.compile(
+            r"^({}:\s*)(['\"]?)[^'\"#\s]*(['\"]?)(.*)$".format(key), re.S)
+        for index, line in enumerate(lines):
+            match = pattern.match(line)
+            if match:
+                lines[index] = "{}{}{}{}{}".format(
+                    match.group(1), match.group(2), values[key],
+                    match.group(3), match.group(4))
+                last = index + 1
+                break
+        else:
+            lines.insert(last, "{}: '{}'\n".format(key, values[key]))
+            last += 1
+    return "".join(lines)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m capacity.rightsize',
+        description="Recommend TaskCPU and memory limits from a service's "
+                    "exported metrics.")
+    parser.add_argument('config', help="the service's service_config.yaml")
+    parser.add_argument(
+        'metrics', nargs='+',
+        help="CSV, JSON Lines or get-metric-data JSON exports")
+    parser.add_argument(
+        '--percentile', type=float, default=95,
+        help="usage percentile to reserve for (default: 95)")
+    parser.add_argument(
+        '--target', type=float, default=80,
+        help="utilization %% to reserve for on metrics the service does not "
+             "scale on (default: 80)")
+    parser.add_argument(
+        '--headroom', type=float, default=0.25,
+        help="share above the peak memory for the hard limit (default: "
+             "0.25)")
+    parser.add_argument(
+        '--output', help="file to write the updated config to "
+                         "(default: standard output)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    with open(args.config, 'r') as f:
+        text = f.read()
+    config = load_yaml(args.config)
+    histograms = read_metrics(args.metrics)
+    values, usage = recommend(config, histograms, args.percentile,
+                              args.target, args.headroom)
+    if not values:
+        sys.stderr.write("No CPU or memory datapoints found\n")
+        return 1
+
+    for metric in METRICS:
+        sys.stderr.write("{}: {} datapoints\n".format(
+            metric, histograms[metric].total))
+    if 'cpu' in usage:
+        sys.stderr.write(
+            "TaskCPU {} -> {} (p{:g} use {:.0f} units)\n".format(
+                config['TaskCPU'], values['TaskCPU'], args.percentile,
+                usage['cpu']))
+    if 'memory' in usage:
+        sys.stderr.write(
+            "TaskMemoryReservation {} -> {} (p{:g} use {:.0f} MiB)\n"
+            "TaskMemory {} -> {} (peak use {:.0f} MiB)\n".format(
+                config.get('TaskMemoryReservation', '-'),
+                values['TaskMemoryReservation'], args.percentile,
+                usage['memory'], config['TaskMemory'], values['TaskMemory'],
+                usage['memory_peak']))
+
+    if is_fargate(config):
+        values = fargate_size(config, values)
+        sys.stderr.write(
+            "Fargate task size: {TaskCPU} CPU, {TaskMemory} MiB\n".format(
+                **values))
+
+    updated = update_config(text, values)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(updated)
+    else:
+        sys.stdout.write(updated)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
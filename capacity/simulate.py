@@ -0,0 +1,638 @@
+"""Replay a load trace against the scaling config, offline.
+
+Reads a service's service_config.yaml and the cluster_config.yaml and steps
+through a trace one minute at a time, as CloudWatch does:
+
+- the service's metric is the demand spread over its running tasks;
+- alarms go off when DatapointsToAlarm of the last EvaluationPeriods
+  minutes breach, and the step policies change the desired count by the
+  ladder's adjustment for the current breach, within the cooldowns (target
+  tracking is approximated by its 3-of-3 and 15-of-15 minute alarms);
+- tasks are placed on ready instances while CPU and memory allow, and
+  start serving the next minute;
+- the cluster's reservation alarms (or the capacity provider's managed
+  scaling) launch instances, which host tasks after a boot delay and count
+  towards capacity until warmed up; scaled-in instances stop their tasks.
+
+The trace is a CSV file with one row per minute and either a ``requests``
+column (requests per minute, with --requests-per-task saying how many take
+one task to 100% of the scaling metric) or a ``utilization`` column (the
+metric in %) with the ``tasks`` that were running. Demand above what the
+running tasks can serve at --saturation-level counts as saturation.
+
+Every setting can be swept: each --sweep multiplies the variants, and all
+variants are simulated together as NumPy arrays, so a thousand of them
+take seconds:
+
+    python -m capacity.simulate trace.csv \\
+        --sweep service.ScaleUpLevel=50:90:10 \\
+        --sweep service.ScaleUp.EvaluationPeriods=1,2,3 \\
+        --sweep cluster.instanceSize=t3.small,t3.medium
+
+Settings in the ScaleUp/ScaleDown sections are dotted; cluster.BootMinutes
+overrides --boot-minutes.
+"""
+
+import argparse
+import csv
+import itertools
+import math
+import sys
+import time
+
+import numpy as np
+
+from capacity.configs import (
+    CLUSTER_CONFIG,
+    SERVICE_CONFIG,
+    cluster_instance_type,
+    instance_resources,
+    is_fargate,
+    load_yaml,
+    set_setting,
+    task_memory,
+)
+from cfgen import scaling_steps
+
+
+PERIOD = 60
+
+# Target tracking's own alarms: over target for 3 of 3 minutes to scale
+# out, under 90% of it for 15 of 15 minutes to scale in.
+TRACKING_OUT_PERIODS = 3
+TRACKING_IN_PERIODS = 15
+TRACKING_IN_RATIO = 0.9
+
+# Managed scaling scales in after 15 minutes under target.
+PROVIDER_IN_PERIODS = 15
+
+# Room for tasks on Fargate, which needs no instances.
+UNLIMITED = 10 ** 6
+
+SUMMARY_FIELDS = [
+    'saturated_minutes',
+    'peak_shortfall',
+    'unplaced_minutes',
+    'task_minutes',
+    'instance_minutes',
+    'max_tasks',
+    'max_instances',
+]
+
+# Per-minute values of a timeline. Tasks serve the minute after they are
+# placed, so ``serving`` is last minute's ``running``.
+TIMELINE_FIELDS = [
+    'demand',
+    'utilization',
+    'serving',
+    'desired',
+    'running',
+    'pending',
+    'instances',
+    'booting',
+    'reservation',
+    'saturated',
+]
+
+
+def read_trace(path, requests_per_task=None):
+    """Read a trace into demand per minute, counted in tasks at 100% of
+    the scaling metric."""
+    with open(path, 'r', newline='') as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        raise ValueError("{} has no rows".format(path))
+    if 'requests' in rows[0]:
+        if not requests_per_task:
+            raise ValueError(
+                "A requests trace needs --requests-per-task: the requests "
+                "per minute that take one task to 100% of its metric")
+        demand = [float(row['requests']) / requests_per_task for row in rows]
+    elif 'utilization' in rows[0]:
+        if 'tasks' not in rows[0]:
+            raise ValueError(
+                "A utilization trace needs the tasks column it was "
+                "measured with")
+        demand = [float(row['utilization']) / 100 * float(row['tasks'])
+                  for row in rows]
+    else:
+        raise ValueError(
+            "{} needs a requests or a utilization column".format(path))
+    return np.array(demand)
+
+
+def sweep_values(text):
+    """Parse the values of a sweep: ``start:stop:step`` (inclusive) or a
+    comma separated list."""
+    def number(value):
+        try:
+            value = float(value)
+        except ValueError:
+            return value
+        return int(value) if value.is_integer() else value
+
+    if text.count(':') == 2:
+        start, stop, step = (float(part) for part in text.split(':'))
+        if step <= 0:
+            raise ValueError("The step of {} must be positive".format(text))
+        count = int(math.floor((stop - start) / step + 1e-9)) + 1
+        return [number(start + step * n) for n in range(count)]
+    return [number(value) for value in text.split(',')]
+
+
+def variants(service, cluster, sweeps):
+    """Yield ``(settings, service, cluster)`` for every combination of the
+    sweeps, each a ``(name, values)`` pair."""
+    names = [name for name, _ in sweeps]
+    for combination in itertools.product(*[values for _, values in sweeps]):
+        serviceConfig, clusterConfig = service, cluster
+        for name, value in zip(names, combination):
+            section, _, setting = name.partition('.')
+            if section == 'service':
+                serviceConfig = set_setting(serviceConfig, setting, value)
+            elif section == 'cluster':
+                clusterConfig = set_setting(clusterConfig, setting, value)
+            else:
+                raise ValueError(
+                    "Sweep {} must start with service. or cluster.".format(
+                        name))
+        yield dict(zip(names, combination)), serviceConfig, clusterConfig
+
+
+def _minutes(seconds):
+    return int(math.ceil(float(seconds) / PERIOD))
+
+
+def _level(value):
+    if isinstance(value, dict):
+        return min(float(v) for v in value.values())
+    return float(value)
+
+
+def _ladder(settings, direction):
+    """Breach bands of a ladder as (from, amount, is percentage) lists."""
+    steps = sorted(
+        settings.get('Steps') or scaling_steps.DEFAULT_STEPS[direction],
+        key=lambda s: s['From'])
+    bands = []
+    for step in steps:
+        adjustmentType, amount = scaling_steps.parse_adjustment(
+            step['Adjustment'])
+        bands.append((float(step['From']), amount,
+                      adjustmentType == 'PercentChangeInCapacity'))
+    return bands
+
+
+def _evaluation(settings, default=1):
+    periods = int(settings.get('EvaluationPeriods', default))
+    return periods, int(settings.get('DatapointsToAlarm', periods))
+
+
+def variant_parameters(service, cluster, boot_minutes):
+    """Flatten one service and cluster config into simulation parameters."""
+    scaleUp = service.get('ScaleUp') or {}
+    scaleDown = service.get('ScaleDown') or {}
+    tracking = service.get('ScalingMode', 'Step') == 'TargetTracking'
+    metrics = scaling_steps.scaling_metrics(service.get('ScalingMetric', 'CPU'))
+    if 'RequestCount' in metrics:
+        raise ValueError(
+            "RequestCount target tracking is not simulated; scale on CPU or "
+            "Memory")
+    for settings in (scaleUp, scaleDown):
+        scaling_steps.alarm_evaluation(settings)
+    for direction, settings in ((1, scaleUp), (-1, scaleDown)):
+        scaling_steps.expand_ladder(settings.get('Steps'), direction)
+
+    params = {
+        'tracking': tracking,
+        'min_tasks': int(service['MinTaskCapacity']),
+        'max_tasks': int(service['MaxTaskCapacity']),
+        'desired_tasks': int(service.get(
+            'DesiredTaskCapacity', service['MinTaskCapacity'])),
+    }
+    if tracking:
+        target = _level(service['TargetValue'])
+        params.update({
+            'up_level': target,
+            'down_level': target * TRACKING_IN_RATIO,
+            'up_n': TRACKING_OUT_PERIODS, 'up_m': TRACKING_OUT_PERIODS,
+            'down_n': TRACKING_IN_PERIODS, 'down_m': TRACKING_IN_PERIODS,
+            'up_cooldown': _minutes(service.get('ScaleOutCooldown', 60)),
+            'down_cooldown': _minutes(service.get('ScaleInCooldown', 300)),
+        })
+    else:
+        upPeriods, upDatapoints = _evaluation(scaleUp)
+        downPeriods, downDatapoints = _evaluation(scaleDown)
+        params.update({
+            'up_level': float(service['ScaleUpLevel']),
+            'down_level': float(service['ScaleDownLevel']),
+            'up_n': upPeriods, 'up_m': upDatapoints,
+            'down_n': downPeriods, 'down_m': downDatapoints,
+            'up_cooldown': _minutes(scaleUp.get('Cooldown', 60)),
+            'down_cooldown': _minutes(scaleDown.get('Cooldown', 60)),
+        })
+    params['up_ladder'] = _ladder(scaleUp, 1)
+    params['down_ladder'] = _ladder(scaleDown, -1)
+
+    clusterUp = cluster.get('ScaleUp') or {}
+    clusterDown = cluster.get('ScaleDown') or {}
+    provider = cluster.get('CapacityProvider')
+    fargate = is_fargate(service)
+    instanceCpu, instanceMemory = instance_resources(
+        cluster_instance_type(cluster))
+    taskCpu = int(service['TaskCPU'])
+    taskMemory = task_memory(service)
+    clusterMetrics = scaling_steps.scaling_metrics(
+        cluster.get('ScalingMetric', 'CPU'))
+    upPeriods, upDatapoints = _evaluation(clusterUp)
+    downPeriods, downDatapoints = _evaluation(clusterDown)
+    if provider:
+        downPeriods = downDatapoints = PROVIDER_IN_PERIODS
+    params.update({
+        'slots': UNLIMITED if fargate else min(
+            instanceCpu // taskCpu, instanceMemory // taskMemory),
+        'task_cpu': taskCpu,
+        'task_memory': taskMemory,
+        'instance_cpu': instanceCpu,
+        'instance_memory': instanceMemory,
+        'watch_cpu': 'CPU' in clusterMetrics,
+        'watch_memory': 'Memory' in clusterMetrics,
+        'cluster_up_level': float(cluster['ScaleUpLevel']),
+        'cluster_down_level': float(cluster['ScaleDownLevel']),
+        'cluster_up_n': upPeriods, 'cluster_up_m': upDatapoints,
+        'cluster_down_n': downPeriods, 'cluster_down_m': downDatapoints,
+        'cluster_up_ladder': _ladder(clusterUp, 1),
+        'cluster_down_ladder': _ladder(clusterDown, -1),
+        'min_instances': 0 if fargate else int(cluster['minCapacity']),
+        'max_instances': 0 if fargate else int(cluster['maxCapacity']),
+        'desired_instances': 0 if fargate else int(cluster.get(
+            'desiredCapacity', cluster['minCapacity'])),
+        'boot': max(1, int(cluster.get('BootMinutes', boot_minutes))),
+        'warmup': _minutes((provider or {}).get(
+            'InstanceWarmupPeriod', clusterUp.get('Cooldown', 300))),
+        'fargate': fargate,
+        'provider': bool(provider) and not fargate,
+        'provider_target': float((provider or {}).get('TargetCapacity', 100)),
+        'provider_min_step': int((provider or {}).get(
+            'MinimumScalingStepSize', 1)),
+        'provider_max_step': int((provider or {}).get(
+            'MaximumScalingStepSize', 10000)),
+    })
+    if params['slots'] < 1:
+        raise ValueError(
+            "A {} task ({} CPU, {} MiB) does not fit on a {}".format(
+                service.get('Name', 'service'), taskCpu, taskMemory,
+                cluster_instance_type(cluster)))
+    return params
+
+
+def stack_parameters(variant_params):
+    """Stack per-variant parameters into arrays with one row per variant.
+    Ladders become (variants, bands) arrays padded with bands that are
+    never reached."""
+    stacked = {}
+    for key in variant_params[0]:
+        values = [params[key] for params in variant_params]
+        if not key.endswith('_ladder'):
+            stacked[key] = np.array(values)
+            continue
+        width = max(len(ladder) for ladder in values)
+        padded = [ladder + [(np.inf, 0, False)] * (width - len(ladder))
+                  for ladder in values]
+        stacked[key + '_from'] = np.array(
+            [[band[0] for band in ladder] for ladder in padded])
+        stacked[key + '_amount'] = np.array(
+            [[band[1] for band in ladder] for ladder in padded])
+        stacked[key + '_percent'] = np.array(
+            [[band[2] for band in ladder] for ladder in padded])
+    return stacked
+
+
+class AlarmHistory(object):
+    """The breaching minutes of one alarm across all variants."""
+
+    def __init__(self, periods, datapoints):
+        self.periods = periods
+        self.datapoints = datapoints
+        self.breaches = np.zeros(
+            (len(periods), int(periods.max())), dtype=bool)
+        self.position = 0
+
+    def update(self, breaching):
+        """Record this minute and return which alarms are in ALARM."""
+        width = self.breaches.shape[1]
+        self.position = (self.position + 1) % width
+        self.breaches[:, self.position] = breaching
+        ages = (self.position - np.arange(width)) % width
+        recent = ages[None, :] < self.periods[:, None]
+        return (self.breaches & recent).sum(axis=1) >= self.datapoints
+
+
+def ladder_change(params, name, breach, capacity):
+    """The signed capacity change a ladder makes for each variant's breach
+    (points past the threshold) at its current capacity."""
+    bands = params[name + '_from']
+    band = np.maximum((breach[:, None] >= bands).sum(axis=1) - 1, 0)
+    rows = np.arange(len(band))
+    amount = params[name + '_amount'][rows, band]
+    percent = params[name + '_percent'][rows, band]
+    # Percentages round towards zero, but change at least one task
+    # (MinAdjustmentMagnitude).
+    scaled = np.sign(amount) * np.maximum(
+        1, np.floor(np.abs(amount) / 100.0 * capacity))
+    return np.where(percent, scaled, amount).astype(int)
+
+
+def simulate(demand, params, saturation_level=100, timeline=False):
+    """Step all variants through the trace.
+
+    Returns a dict of per-variant totals (see SUMMARY_FIELDS) and, when
+    ``timeline`` is set, a ``timeline`` of per-minute arrays for each
+    variant.
+    """
+    p = params
+    count = len(p['min_tasks'])
+    rows = np.arange(count)
+
+    desired = np.clip(p['desired_tasks'], p['min_tasks'], p['max_tasks'])
+    ready = np.clip(p['desired_instances'], p['min_instances'],
+                    p['max_instances'])
+    running = np.minimum(desired, np.where(
+        p['fargate'], UNLIMITED, ready * p['slots']))
+    upWait = np.zeros(count, dtype=int)
+    downWait = np.zeros(count, dtype=int)
+
+    serviceUp = AlarmHistory(p['up_n'], p['up_m'])
+    serviceDown = AlarmHistory(p['down_n'], p['down_m'])
+    clusterUp = AlarmHistory(p['cluster_up_n'], p['cluster_up_m'])
+    clusterDown = AlarmHistory(p['cluster_down_n'], p['cluster_down_m'])
+
+    # Instances launched in each of the last few minutes: they host tasks
+    # once booted, and count towards capacity until warmed up.
+    launchWidth = int(max(p['boot'].max(), p['warmup'].max())) + 1
+    launches = np.zeros((count, launchWidth), dtype=int)
+    ages = np.arange(launchWidth)
+    booting = np.zeros(count, dtype=int)
+    warming = np.zeros(count, dtype=int)
+
+    totals = dict((field, np.zeros(count)) for field in SUMMARY_FIELDS)
+    history = dict((key, []) for key in TIMELINE_FIELDS)
+
+    for load in demand:
+        # Service metric and saturation, against the tasks serving this
+        # minute (those placed last minute)
+        serving = running
+        utilization = np.where(
+            running > 0, 100.0 * load / np.maximum(running, 1),
+            100.0 if load > 0 else 0.0)
+        utilization = np.minimum(utilization, 100.0)
+        capacity = running * saturation_level / 100.0
+        saturated = load > capacity
+        totals['saturated_minutes'] += saturated
+        totals['peak_shortfall'] = np.maximum(
+            totals['peak_shortfall'], load - capacity)
+
+        # Service scaling
+        upBreach = np.where(p['tracking'], utilization > p['up_level'],
+                            utilization >= p['up_level'])
+        downBreach = np.where(p['tracking'], utilization < p['down_level'],
+                              utilization <= p['down_level'])
+        upAlarm = serviceUp.update(upBreach)
+        downAlarm = serviceDown.update(downBreach)
+        upWait = np.maximum(upWait - 1, 0)
+        downWait = np.maximum(downWait - 1, 0)
+
+        tracked = np.ceil(desired * utilization / np.maximum(
+            p['up_level'], 1e-9)).astype(int)
+        scaleOut = np.where(
+            p['tracking'], np.maximum(tracked, desired),
+            desired + ladder_change(
+                p, 'up_ladder', utilization - p['up_level'], desired))
+        scaleIn = np.where(
+            p['tracking'], np.minimum(tracked, desired),
+            desired + ladder_change(
+                p, 'down_ladder', p['down_level'] - utilization, desired))
+        outNow = upAlarm & (upWait == 0)
+        inNow = downAlarm & ~outNow & (upWait == 0) & (downWait == 0)
+        target = np.where(outNow, scaleOut, np.where(inNow, scaleIn, desired))
+        target = np.clip(target, p['min_tasks'], p['max_tasks'])
+        upWait = np.where(outNow & (target > desired), p['up_cooldown'],
+                          upWait)
+        # A scale-out ends the scale-in cooldown.
+        downWait = np.where(outNow & (target > desired), 0, downWait)
+        downWait = np.where(inNow & (target < desired), p['down_cooldown'],
+                            downWait)
+        desired = target
+
+        # Cluster scaling
+        hostCpu = np.maximum(ready * p['instance_cpu'], 1)
+        hostMemory = np.maximum(ready * p['instance_memory'], 1)
+        reservation = np.maximum(
+            np.where(p['watch_cpu'], 100.0 * running * p['task_cpu'] / hostCpu,
+                     0.0),
+            np.where(p['watch_memory'],
+                     100.0 * running * p['task_memory'] / hostMemory, 0.0))
+        # Launches still warming up count towards capacity, so a scale-out
+        # only adds what they do not already cover.
+        counted = ready + booting
+        settled = counted - warming
+
+        if p['provider'].any():
+            # Managed scaling keeps enough instances for every desired task
+            # at TargetCapacity.
+            needed = np.ceil(np.ceil(desired / p['slots'].astype(float))
+                             * 100.0 / p['provider_target']).astype(int)
+            providerOut = np.clip(needed - counted, 0, None)
+            providerOut = np.where(
+                providerOut > 0,
+                np.clip(providerOut, p['provider_min_step'],
+                        p['provider_max_step']), 0)
+        else:
+            needed = ready
+            providerOut = 0
+        clusterUpAlarm = clusterUp.update(np.where(
+            p['provider'], needed > counted,
+            reservation > p['cluster_up_level']))
+        clusterDownAlarm = clusterDown.update(np.where(
+            p['provider'], needed < ready,
+            reservation < p['cluster_down_level']))
+
+        stepOut = np.clip(
+            settled + ladder_change(
+                p, 'cluster_up_ladder', reservation - p['cluster_up_level'],
+                settled),
+            p['min_instances'], p['max_instances']) - counted
+        launch = np.where(p['provider'], providerOut, stepOut)
+        launch = np.where(clusterUpAlarm, launch, 0)
+        launch = np.clip(launch, 0, np.maximum(p['max_instances'] - counted, 0))
+        stepIn = ladder_change(p, 'cluster_down_ladder',
+                               p['cluster_down_level'] - reservation, ready)
+        providerIn = -np.clip(ready - needed, 0, p['provider_max_step'])
+        terminate = np.where(clusterDownAlarm & (launch == 0) & (booting == 0),
+                             np.where(p['provider'], providerIn, stepIn), 0)
+        ready = np.clip(ready + terminate, p['min_instances'], None)
+
+        # New launches start booting; those launched BootMinutes ago join.
+        launches = np.roll(launches, 1, axis=1)
+        launches[:, 0] = launch
+        ready = ready + launches[rows, p['boot']]
+        booting = (launches * (ages[None, :] < p['boot'][:, None])).sum(axis=1)
+        warming = (launches * (ages[None, :] < np.maximum(
+            p['warmup'], p['boot'])[:, None])).sum(axis=1)
+
+        # Placement: tasks start on instances with room and serve from the
+        # next minute; tasks on scaled-in instances stop.
+        placed = np.minimum(desired, np.where(
+            p['fargate'], UNLIMITED, ready * p['slots']))
+        running = placed
+
+        totals['unplaced_minutes'] += desired > placed
+        totals['task_minutes'] += running
+        totals['instance_minutes'] += ready + booting
+        totals['max_tasks'] = np.maximum(totals['max_tasks'], running)
+        totals['max_instances'] = np.maximum(totals['max_instances'],
+                                             ready + booting)
+        if timeline:
+            for key, value in (
+                    ('demand', np.full(count, load)),
+                    ('utilization', utilization),
+                    ('serving', serving),
+                    ('desired', desired),
+                    ('running', running),
+                    ('pending', desired - placed),
+                    ('instances', ready),
+                    ('booting', booting),
+                    ('reservation', reservation),
+                    ('saturated', saturated)):
+                history[key].append(np.array(value, copy=True))
+
+    result = dict(totals)
+    if timeline:
+        result['timeline'] = dict(
+            (key, np.array(values).T) for key, values in history.items())
+    return result
+
+
+def saturation_windows(saturated, demand, capacity):
+    """Contiguous saturated minutes as (start, end, peak shortfall)."""
+    windows = []
+    start = None
+    for minute, flag in enumerate(list(saturated) + [False]):
+        if flag and start is None:
+            start = minute
+        elif not flag and start is not None:
+            shortfall = max(demand[m] - capacity[m] for m in range(
+                start, minute))
+            windows.append((start, minute, shortfall))
+            start = None
+    return windows
+
+
+def write_timeline(path, timeline):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['minute'] + TIMELINE_FIELDS)
+        for minute in range(len(timeline['demand'][0])):
+            writer.writerow([minute] + [
+                "{:.2f}".format(timeline[key][0][minute])
+                if key in ('demand', 'utilization', 'reservation')
+                else int(timeline[key][0][minute])
+                for key in TIMELINE_FIELDS])
+
+
+def write_summary(path, names, settings, totals):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(names + SUMMARY_FIELDS)
+        for index, values in enumerate(settings):
+            writer.writerow([values[name] for name in names] + [
+                "{:g}".format(totals[field][index])
+                for field in SUMMARY_FIELDS])
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m capacity.simulate',
+        description="Replay a load trace against the scaling config.")
+    parser.add_argument('trace', help="CSV trace, one row per minute")
+    parser.add_argument('--service-config', default=SERVICE_CONFIG)
+    parser.add_argument('--cluster-config', default=CLUSTER_CONFIG)
+    parser.add_argument(
+        '--requests-per-task', type=float,
+        help="requests per minute that take one task to 100%% of its metric")
+    parser.add_argument(
+        '--boot-minutes', type=int, default=3,
+        help="minutes from an instance launch until it hosts tasks "
+             "(default: 3)")
+    parser.add_argument(
+        '--saturation-level', type=float, default=100,
+        help="metric %% above which a task is saturated (default: 100)")
+    parser.add_argument(
+        '--sweep', action='append', default=[], metavar='NAME=VALUES',
+        help="setting to vary, e.g. service.ScaleUpLevel=50:90:10 or "
+             "cluster.instanceSize=t3.small,t3.medium; repeatable")
+    parser.add_argument(
+        '--output',
+        help="timeline CSV, or the per-variant summary CSV of a sweep "
+             "(default: simulation.csv or sweep.csv)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    sweeps = []
+    for sweep in args.sweep:
+        name, _, values = sweep.partition('=')
+        if not values:
+            raise SystemExit("--sweep needs NAME=VALUES, got {}".format(sweep))
+        sweeps.append((name, sweep_values(values)))
+    names = [name for name, _ in sweeps]
+
+    demand = read_trace(args.trace, args.requests_per_task)
+    settings = []
+    params = []
+    for values, service, cluster in variants(
+            load_yaml(args.service_config), load_yaml(args.cluster_config),
+            sweeps):
+        settings.append(values)
+        params.append(variant_parameters(service, cluster, args.boot_minutes))
+
+    started = time.time()
+    result = simulate(demand, stack_parameters(params),
+                      saturation_level=args.saturation_level,
+                      timeline=not sweeps)
+    print("Simulated {} variant(s) over {} minutes in {:.1f}s".format(
+        len(params), len(demand), time.time() - started))
+
+    if not sweeps:
+        timeline = result['timeline']
+        output = args.output or 'simulation.csv'
+        write_timeline(output, timeline)
+        capacity = timeline['serving'][0] * args.saturation_level / 100.0
+        windows = saturation_windows(
+            timeline['saturated'][0], demand, capacity)
+        for start, end, shortfall in windows:
+            print("Saturated minutes {}-{} ({} min), short by {:.1f} "
+                  "tasks".format(start, end, end - start, shortfall))
+        if not windows:
+            print("No saturation")
+        print("Timeline written to {}".format(output))
+        return 0
+
+    output = args.output or 'sweep.csv'
+    write_summary(output, names, settings, result)
+    order = np.lexsort((result['instance_minutes'],
+                        result['saturated_minutes']))
+    print("Least saturated variants:")
+    for index in order[:10]:
+        print("  {}: {:g} saturated min, {:g} instance-min".format(
+            ", ".join("{}={}".format(name, settings[index][name])
+                      for name in names),
+            result['saturated_minutes'][index],
+            result['instance_minutes'][index]))
+    print("Summary written to {}".format(output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,10 @@
+"""Tooling to render the CloudFormation templates in this repository."""
+
+from cfgen.generators import (  # noqa: F401
+    GENERATORS,
+    Generator,
+    build,
+    get_generator,
+    load_module,
+    render,
+)
@@ -0,0 +1,185 @@
+"""Render the CloudFormation templates in a single process.
+
+Usage:
+    python -m cfgen                       # render everything into CFTemplates/
+    python -m cfgen ecs-cluster ecs-service
+    python -m cfgen --jobs 1 --output-dir /tmp/templates
+    python -m cfgen --cache ~/.cache/cfgen
+    python -m cfgen --cache s3://my-bucket/render-cache --param Env=stag
+    python -m cfgen ecs-service --source-dir . --output-dir /tmp
+    python -m cfgen --minify --report
+    python -m cfgen --format yaml --hoist
+"""
+
+import argparse
+import functools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# Import troposphere and awacs once in the parent so forked workers inherit
+# them instead of paying for the import again.
+import awacs.aws  # noqa: F401
+import troposphere  # noqa: F401
+
+from cfgen.cache import (
+    DEFAULT_MAX_BYTES,
+    cache_key,
+    generator_inputs,
+    open_cache,
+)
+from cfgen.generators import (
+    GENERATORS,
+    ROOT,
+    locate,
+    render,
+)
+from cfgen.serialize import repeated_expressions, serialize, size_report
+
+
+def parse_param(value):
+    name, sep, setting = value.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(
+            "expected NAME=VALUE, got {!r}".format(value))
+    return name, setting
+
+
+def parse_args(argv=None):
+    names = [g.name for g in GENERATORS]
+    parser = argparse.ArgumentParser(
+        prog='python -m cfgen',
+        description="Render the CloudFormation templates.")
+    parser.add_argument(
+        'generators', nargs='*', metavar='GENERATOR',
+        help="Generators to render (default: all). One of: {}".format(
+            ", ".join(names)))
+    parser.add_argument(
+        '--output-dir', default=os.path.join(ROOT, 'CFTemplates'),
+        help="Directory to write the rendered templates to.")
+    parser.add_argument(
+        '--source-dir', metavar='DIR',
+        help="Render from a checkout of the generators' own repository, "
+             "with their scripts and configs at the top (as in CodeBuild).")
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=os.cpu_count() or 1,
+        help="Number of worker processes (1 renders in this process).")
+    parser.add_argument(
+        '--cache', metavar='LOCATION',
+        help="Render cache directory or s3://bucket/prefix URL.")
+    parser.add_argument(
+        '--cache-max-bytes', type=int, default=DEFAULT_MAX_BYTES,
+        help="Evict least recently used entries past this size.")
+    parser.add_argument(
+        '--param', dest='params', type=parse_param, action='append',
+        default=[], metavar='NAME=VALUE',
+        help="Parameter value to fold into the cache key (repeatable).")
+    parser.add_argument(
+        '--format', choices=['json', 'yaml'], default='json',
+        help="Output format (yaml uses short-form intrinsic functions).")
+    parser.add_argument(
+        '--compact', action='store_true',
+        help="Write JSON without indentation.")
+    parser.add_argument(
+        '--hoist', action='store_true',
+        help="Rewrite Fn::Join as Fn::Sub with shared variables where smaller.")
+    parser.add_argument(
+        '--minify', action='store_true',
+        help="Shorthand for --compact --hoist.")
+    parser.add_argument(
+        '--report', action='store_true',
+        help="List the most repeated expressions in each template.")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.generators if name not in names]
+    if unknown:
+        parser.error("unknown generator(s): {}".format(", ".join(unknown)))
+    if args.minify:
+        args.compact = args.hoist = True
+    return args
+
+
+def render_all(names, jobs, source_dir=None):
+    """Render the named generators, fanning out over a process pool."""
+    if jobs <= 1 or len(names) <= 1:
+        return [render(name, source_dir) for name in names]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(names))) as pool:
+        return list(pool.map(
+            functools.partial(render, source_dir=source_dir), names))
+
+
+def render_cached(names, jobs, cache, parameters=None, source_dir=None):
+    """Render the named generators, skipping those already in the cache.
+
+    Returns ``(name, files, hit)`` tuples in the order of ``names``.
+    """
+    keys = {}
+    files = {}
+    for name in names:
+        generator, root = locate(name, source_dir)
+        config = generator.config and os.path.join(root, generator.config)
+        keys[name] = cache_key(
+            "{}:{}".format(os.path.basename(generator.script),
+                           generator.builder),
+            generator_inputs(os.path.join(root, generator.script), config),
+            parameters)
+        cached = cache.get(keys[name])
+        files[name] = cached and [tuple(f) for f in json.loads(cached)]
+
+    misses = [name for name in names if files[name] is None]
+    for name, rendered in render_all(misses, jobs, source_dir):
+        cache.put(keys[name], json.dumps(rendered))
+        files[name] = rendered
+    return [(name, files[name], name not in misses) for name in names]
+
+
+SIZE_NOTES = {
+    'inline': "",
+    's3': ", over the 51,200 byte inline limit: deploy from S3",
+    'too large': ", OVER the 1 MB S3 limit: split the stack",
+}
+
+
+def report_repeats(file_name, body, limit=5):
+    repeats = repeated_expressions(json.loads(body))
+    if not repeats:
+        return
+    print("Repeated expressions in {}:".format(file_name))
+    for count, size, expression in repeats[:limit]:
+        if len(expression) > 100:
+            expression = expression[:97] + "..."
+        print("  {:>4} x {:>5} bytes  {}".format(count, size, expression))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = args.generators or [g.name for g in GENERATORS]
+
+    if args.cache:
+        cache = open_cache(args.cache, max_bytes=args.cache_max_bytes)
+        results = render_cached(names, args.jobs, cache, dict(args.params),
+                                args.source_dir)
+    else:
+        results = [(name, files, False) for name, files in render_all(
+            names, args.jobs, args.source_dir)]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for name, files, hit in results:
+        for file_name, body in files:
+            if args.report:
+                report_repeats(file_name, body)
+            body = serialize(
+                body, args.format, args.compact, args.hoist)
+            path = os.path.join(args.output_dir, file_name)
+            with open(path, 'w') as f:
+                f.write(body)
+                f.write('\n')
+            size, status = size_report(body)
+            print("{} {} -> {} ({} bytes{})".format(
+                "Cached" if hit else "Rendered", name, path, size,
+                SIZE_NOTES[status]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""Content-addressed cache for rendered templates.
+
+A rendered template is keyed by a hash of everything that can change it:
+the generator sources, its YAML config, any parameter values passed along
+with the render and the installed troposphere/awacs versions. Entries live
+either in a local directory or in an S3-style blob store, and the least
+recently used entries are evicted once the cache grows past a size cap.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import time
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Files next to a generator that can change what it renders.
+INPUT_PATTERNS = ['*.py', '*.yaml', '*.yml', '*.json']
+
+CFGEN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Tag holding an S3 cache entry's last-use time, in seconds since the epoch.
+LAST_USED_TAG = 'last-used'
+
+
+def library_versions():
+    """Return the installed troposphere and awacs versions."""
+    import awacs
+    import troposphere
+    return "troposphere={};awacs={}".format(
+        troposphere.__version__, getattr(awacs, '__version__', 'unknown'))
+
+
+def generator_inputs(script, config=None):
+    """List the files whose contents feed a generator's output.
+
+    That is every source, config and state file in the generator's
+    directory, its config file if it lives elsewhere, and the cfgen sources.
+    """
+    paths = set()
+    for directory in (os.path.dirname(os.path.abspath(script)), CFGEN_DIR):
+        for pattern in INPUT_PATTERNS:
+            paths.update(glob.glob(os.path.join(directory, pattern)))
+    paths.add(os.path.abspath(script))
+    if config is not None:
+        paths.add(os.path.abspath(config))
+    return sorted(paths)
+
+
+def cache_key(target, paths, parameters=None, versions=None):
+    """Hash the render target, its inputs and library versions into a key.
+
+    ``target`` names what is rendered from the inputs (generators sharing a
+    directory share inputs). Files are identified by base name rather than
+    absolute path, so the same checkout renders to the same key on every
+    machine.
+    """
+    digest = hashlib.sha256()
+    digest.update(target.encode('utf-8'))
+    digest.update(b'\0')
+    for path in sorted(paths, key=lambda p: (os.path.basename(p), p)):
+        digest.update(os.path.basename(path).encode('utf-8'))
+        digest.update(b'\0')
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    digest.update(json.dumps(parameters or {}, sort_keys=True).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update((versions or library_versions()).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class LocalCache(object):
+    """Render cache stored as one file per entry in a local directory.
+
+    A file's mtime is bumped on every hit and used as its last-use time.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, "{}.template".format(key))
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path, None)
+        return body
+
+    def put(self, key, body):
+        path = self._path(key)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(body)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until under the size cap."""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*.template')):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class S3Cache(object):
+    """Render cache stored in an S3 bucket (or any S3-compatible store).
+
+    S3 has no access time, so each entry carries its last-use time in a
+    tag, set when it is written and bumped on every hit. Tagging leaves the
+    object and its metadata alone, unlike copying it onto itself. Eviction
+    only reads the tags once the cache is over its size cap.
+    """
+
+    def __init__(self, bucket, prefix='', max_bytes=DEFAULT_MAX_BYTES,
+                 client=None):
+        if client is None:
+            import boto3
+            client = boto3.client('s3')
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.max_bytes = max_bytes
+        self.client = client
+
+    def _key(self, key):
+        name = "{}.template".format(key)
+        return "{}/{}".format(self.prefix, name) if self.prefix else name
+
+    def get(self, key):
+        name = self._key(key)
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=name)
+        except Exception as error:
+            if _error_code(error) in ('NoSuchKey', '404', 'NotFound'):
+                return None
+            raise
+        body = response['Body'].read().decode('utf-8')
+        self.client.put_object_tagging(
+            Bucket=self.bucket,
+            Key=name,
+            Tagging={'TagSet': [{'Key': LAST_USED_TAG,
+                                 'Value': repr(time.time())}]},
+        )
+        return body
+
+    def put(self, key, body):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(key),
+            Body=body.encode('utf-8'),
+            ContentType='application/json',
+            Tagging="{}={}".format(LAST_USED_TAG, repr(time.time())),
+        )
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until under the size cap."""
+        entries = []
+        prefix = "{}/".format(self.prefix) if self.prefix else ''
+        kwargs = {'Bucket': self.bucket, 'Prefix': prefix}
+        while True:
+            response = self.client.list_objects_v2(**kwargs)
+            for item in response.get('Contents', []):
+                if item['Key'].endswith('.template'):
+                    entries.append(
+                        (item['LastModified'], item['Size'], item['Key']))
+            if not response.get('IsTruncated'):
+                break
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        entries = [(self._last_used(name, modified), size, name)
+                   for modified, size, name in entries]
+        stale = []
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            stale.append({'Key': name})
+            total -= size
+        for start in range(0, len(stale), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': stale[start:start + 1000], 'Quiet': True})
+
+    def _last_used(self, name, modified):
+        """An entry's last-use time: its tag, or when it was written."""
+        response = self.client.get_object_tagging(
+            Bucket=self.bucket, Key=name)
+        for tag in response.get('TagSet', []):
+            if tag['Key'] == LAST_USED_TAG:
+                return float(tag['Value'])
+        return modified.timestamp()
+
+
+def _error_code(error):
+    return str(getattr(error, 'response', {}).get('Error', {}).get('Code'))
+
+
+def open_cache(location, max_bytes=DEFAULT_MAX_BYTES):
+    """Open a cache from a directory path or an ``s3://bucket/prefix`` URL."""
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        return S3Cache(bucket, prefix, max_bytes=max_bytes)
+    return LocalCache(location, max_bytes=max_bytes)
@@ -0,0 +1,140 @@
+"""Decide which stacks a pipeline run actually needs to deploy.
+
+The build stage fingerprints the rendered template together with each
+stack's parameter overrides, and compares it to the fingerprint the last
+successful deploy left as the stack's DeployFingerprint tag. For every
+stack it writes a CloudFormation template configuration file carrying the
+new tag, and prints a shell assignment saying whether the stack changed:
+
+    python -m cfgen.deploy_gate /tmp/ecs-cluster-cf.template \\
+        --output-dir /tmp \\
+        --stack STAG stag-cluster /tmp/StageVpcId.json /tmp/KeyPair.json
+    export STAG_CHANGED=false
+
+The pipeline skips the deploy stages of stacks that have not changed.
+
+Stack status is read through any object with the ``describe_stacks`` method
+of a boto3 CloudFormation client, so the gate can be run against a local
+stub. By default it calls the AWS CLI, which the builder image has. The
+cluster and service pipelines both run this module from the image.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+
+
+FINGERPRINT_TAG = 'DeployFingerprint'
+
+# Statuses in which the stack's tags are those of its last successful
+# deploy. After a failed update CloudFormation rolls the tags back with the
+# rest of the stack; a stack whose creation failed has to be deployed again.
+SETTLED_STATUSES = (
+    'CREATE_COMPLETE',
+    'UPDATE_COMPLETE',
+    'UPDATE_ROLLBACK_COMPLETE',
+    'IMPORT_COMPLETE',
+    'IMPORT_ROLLBACK_COMPLETE',
+)
+
+
+class CLIClient(object):
+    """CloudFormation's DescribeStacks through the AWS CLI, shaped like the
+    boto3 client method. A stack that does not exist is reported as no
+    stacks rather than an error."""
+
+    def describe_stacks(self, StackName):
+        try:
+            output = subprocess.check_output(
+                ['aws', 'cloudformation', 'describe-stacks',
+                 '--stack-name', StackName, '--output', 'json'],
+                stderr=subprocess.PIPE)
+        except subprocess.CalledProcessError as e:
+            if b'does not exist' in e.stderr:
+                return {'Stacks': []}
+            raise
+        return json.loads(output)
+
+
+def fingerprint(template, parameters):
+    """Hash a rendered template (bytes) and its parameter overrides."""
+    digest = hashlib.sha256()
+    digest.update(template)
+    digest.update(b'\0')
+    digest.update(json.dumps(parameters, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def deployed_fingerprint(client, stack):
+    """The fingerprint of the stack's last successful deploy, or None."""
+    stacks = client.describe_stacks(StackName=stack).get('Stacks', [])
+    if not stacks or stacks[0]['StackStatus'] not in SETTLED_STATUSES:
+        return None
+    for tag in stacks[0].get('Tags', []):
+        if tag['Key'] == FINGERPRINT_TAG:
+            return tag['Value']
+    return None
+
+
+def load_parameters(paths):
+    """Merge the JSON parameter files handed to the deploy action."""
+    parameters = {}
+    for path in paths:
+        with open(path, 'r') as f:
+            parameters.update(json.load(f))
+    return parameters
+
+
+def gate(client, template, stacks, output_dir):
+    """Fingerprint each stack and write its template configuration.
+
+    ``stacks`` holds ``(variable, stack name, parameters)`` tuples. Returns
+    a dict mapping each variable to whether its stack changed.
+    """
+    changed = {}
+    for variable, stack, parameters in stacks:
+        new = fingerprint(template, parameters)
+        changed[variable] = new != deployed_fingerprint(client, stack)
+        path = os.path.join(
+            output_dir, "{}-configuration.json".format(variable.lower()))
+        with open(path, 'w') as f:
+            json.dump({'Tags': {FINGERPRINT_TAG: new}}, f)
+    return changed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m cfgen.deploy_gate',
+        description="Decide which stacks need deploying.")
+    parser.add_argument('template', help="Rendered template.")
+    parser.add_argument(
+        '--stack', action='append', nargs='+', default=[],
+        metavar='VARIABLE STACK [PARAMETERS...]',
+        help="Variable prefix, stack name and JSON parameter files "
+             "(repeatable).")
+    parser.add_argument(
+        '--output-dir', default='.',
+        help="Directory for the template configuration files.")
+    args = parser.parse_args(argv)
+    for stack in args.stack:
+        if len(stack) < 2:
+            parser.error("--stack needs a variable prefix and a stack name")
+    return args
+
+
+def main(argv=None, client=None):
+    args = parse_args(argv)
+    with open(args.template, 'rb') as f:
+        template = f.read()
+    stacks = [(stack[0], stack[1], load_parameters(stack[2:]))
+              for stack in args.stack]
+    changed = gate(client or CLIClient(), template, stacks, args.output_dir)
+    for variable, stack, _ in stacks:
+        print("export {}_CHANGED={}".format(
+            variable, "true" if changed[variable] else "false"))
+
+
+if __name__ == '__main__':
+    main()
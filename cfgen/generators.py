@@ -0,0 +1,151 @@
+"""Registry of the template generators and helpers to load and render them.
+
+The generator scripts keep their hyphenated file names so they can still be
+run directly (``python ecs-cluster-cf-template.py``) inside CodeBuild. Here
+they are loaded by path and driven through their ``build_*`` functions.
+"""
+
+import importlib.util
+import os
+import sys
+from collections import namedtuple
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ``stacks`` optionally names a function returning every template the
+# generator renders (its main template first, then nested stack templates).
+Generator = namedtuple(
+    'Generator', ['name', 'script', 'builder', 'config', 'output', 'stacks'])
+Generator.__new__.__defaults__ = (None,)
+
+
+GENERATORS = [
+    Generator(
+        'builder-image',
+        '0_builder-image-cf-template.py',
+        'build_builder_image_template',
+        None,
+        'builder-image-cf.template'),
+    Generator(
+        'ecs-pipeline',
+        '1_ecs-pipeline-cf-template.py',
+        'build_ecs_pipeline_template',
+        None,
+        'ecs-pipeline-cf.template'),
+    Generator(
+        'alb-route53-pipeline',
+        '2_alb-route53-pipeline-cf-template.py',
+        'build_alb_route53_pipeline_template',
+        None,
+        'alb-route53-pipeline-cf.template'),
+    Generator(
+        'deploy-service',
+        '3_deploy-service-cf-template.py',
+        'build_deploy_service_template',
+        None,
+        'deploy-service-cf.template'),
+    Generator(
+        'ecs-cluster',
+        'ECSPipeline/ecs-cluster-cf-template.py',
+        'build_cluster_template',
+        'ECSPipeline/cluster_config.yaml',
+        'ecs-cluster-cf.template'),
+    Generator(
+        'alb-route53',
+        'ELBPipeline/alb-route53-cf-template.py',
+        'build_alb_route53_template',
+        'ELBPipeline/services.yaml',
+        'route53-ecs-alb-cf.template',
+        'build_alb_route53_stacks'),
+    Generator(
+        'ecs-service',
+        'AppTemplates-Autoscaling/ecs-service-cf-template.py',
+        'build_service_template',
+        'AppTemplates-Autoscaling/service_config.yaml',
+        'ecs-service-cf.template'),
+]
+
+
+def get_generator(name):
+    """Look up a registered generator by name."""
+    for generator in GENERATORS:
+        if generator.name == name:
+            return generator
+    raise KeyError("Unknown generator: {}".format(name))
+
+
+def locate(name, source_dir=None):
+    """Look up a generator and the directory its paths are relative to.
+
+    With a ``source_dir`` the generator is rendered from a checkout of its
+    own repository, as in CodeBuild, where its script and config sit at the
+    top instead of in a directory of this tree.
+    """
+    generator = get_generator(name)
+    if source_dir is None:
+        return generator, ROOT
+    return generator._replace(
+        script=os.path.basename(generator.script),
+        config=generator.config and os.path.basename(generator.config),
+    ), os.path.abspath(source_dir)
+
+
+def load_module(generator, root=ROOT):
+    """Import a generator script by path and return the module.
+
+    The script's directory is put on ``sys.path`` so that helper modules
+    sitting next to it resolve the same way they do when it is run directly.
+    """
+    module_name = "cfgen_{}".format(generator.name.replace('-', '_'))
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    path = os.path.join(root, generator.script)
+    directory = os.path.dirname(path)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_config(generator, root=ROOT):
+    """Load the YAML config for a generator, or None if it takes none."""
+    if generator.config is None:
+        return None
+    module = load_module(generator, root)
+    return module.load_config(os.path.join(root, generator.config))
+
+
+def build(generator, config=None, root=ROOT):
+    """Build the troposphere Template for a generator."""
+    module = load_module(generator, root)
+    if config is None:
+        config = load_config(generator, root)
+    return getattr(module, generator.builder)(config)
+
+
+def render(name, source_dir=None):
+    """Render a generator by name and return ``(name, files)``.
+
+    ``files`` is a list of ``(file_name, template_json)`` pairs, the main
+    template first under the generator's output name, followed by any nested
+    stack templates under the names the main template refers to them by.
+    This is the unit of work handed to the process pool, so it only takes
+    and returns picklable values. See ``locate`` for ``source_dir``.
+    """
+    generator, root = locate(name, source_dir)
+    if generator.stacks is None:
+        return name, [(generator.output, build(generator, root=root).to_json())]
+
+    module = load_module(generator, root)
+    templates = getattr(module, generator.stacks)(load_config(generator, root))
+    files = [(file_name, template.to_json())
+             for file_name, template in templates.items()]
+    files[0] = (generator.output, files[0][1])
+    return name, files
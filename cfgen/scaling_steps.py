@@ -0,0 +1,194 @@
+"""Expand the scaling settings in the YAML config into alarms and steps.
+
+A ladder lists breach bands, each giving how far past the alarm threshold
+it starts and the capacity change to make there, along with how the alarm
+evaluates and how long to wait between scaling actions:
+
+    ScaleUp:
+      Steps:
+      - From: 0          # 0-10 points over ScaleUpLevel: add one
+        Adjustment: 1
+      - From: 10         # 10-25 points over: add three
+        Adjustment: 3
+      - From: 25         # further over: add half again
+        Adjustment: 50%
+      EvaluationPeriods: 3
+      DatapointsToAlarm: 2
+      Cooldown: 60
+
+ScaleDown ladders count points under ScaleDownLevel and take negative
+adjustments. A step policy has a single adjustment type, so a ladder mixing
+absolute and percentage adjustments is split into one policy per run of the
+same type, each with its own alarm offset from the threshold. Earlier runs
+end in a zero step so that only one policy changes capacity at a time.
+
+When several metrics are configured, each alarm watches the highest of
+them, so capacity is added when any metric is high and only removed once
+all of them are low.
+"""
+
+from troposphere.cloudwatch import (
+    Metric,
+    MetricDataQuery,
+    MetricStat,
+)
+
+
+DEFAULT_STEPS = {
+    1: [{'From': 0, 'Adjustment': 1}],
+    -1: [{'From': 0, 'Adjustment': -1}],
+}
+
+
+def parse_adjustment(value):
+    """Split an adjustment such as ``3``, ``'-1'`` or ``'50%'`` into its
+    adjustment type and amount."""
+    text = str(value).strip()
+    if text.endswith('%'):
+        return 'PercentChangeInCapacity', int(text[:-1])
+    return 'ChangeInCapacity', int(text)
+
+
+def _runs(steps):
+    runs = []
+    for step in steps:
+        adjustment_type, amount = parse_adjustment(step['Adjustment'])
+        if not runs or runs[-1]['adjustmentType'] != adjustment_type:
+            runs.append({
+                'offset': step['From'],
+                'adjustmentType': adjustment_type,
+                'bands': [],
+            })
+        runs[-1]['bands'].append((step['From'], amount))
+    return runs
+
+
+def expand_ladder(steps, direction):
+    """Turn a ladder into step policy runs.
+
+    ``direction`` is 1 for scaling up and -1 for scaling down. Returns a
+    list of dicts with the run's ``offset`` from the alarm threshold, its
+    ``adjustmentType`` and its ``steps``: StepAdjustment keyword arguments
+    with bounds relative to the run's own alarm threshold.
+    """
+    steps = sorted(steps or DEFAULT_STEPS[direction], key=lambda s: s['From'])
+    if steps[0]['From'] != 0:
+        raise ValueError("The first scaling step must start From 0")
+    if len(set(step['From'] for step in steps)) != len(steps):
+        raise ValueError("Scaling steps must start at different points")
+    for step in steps:
+        if parse_adjustment(step['Adjustment'])[1] * direction <= 0:
+            raise ValueError(
+                "Scale {} adjustments must be {}, got {}".format(
+                    "up" if direction > 0 else "down",
+                    "positive" if direction > 0 else "negative",
+                    step['Adjustment']))
+
+    runs = _runs(steps)
+    for index, run in enumerate(runs):
+        bands = run.pop('bands')
+        offset = run['offset']
+        ends = [start for start, _ in bands[1:]]
+        if index + 1 < len(runs):
+            ends.append(runs[index + 1]['offset'])
+        else:
+            ends.append(None)
+
+        intervals = [(start - offset, end if end is None else end - offset,
+                      amount)
+                     for (start, amount), end in zip(bands, ends)]
+        if index + 1 < len(runs):
+            intervals.append((ends[-1] - offset, None, 0))
+
+        run['steps'] = []
+        for lower, upper, amount in intervals:
+            if direction < 0:
+                lower, upper = (upper if upper is None else -upper), -lower
+            step = {'ScalingAdjustment': str(amount)}
+            if direction > 0:
+                step['MetricIntervalLowerBound'] = lower
+                if upper is not None:
+                    step['MetricIntervalUpperBound'] = upper
+            else:
+                step['MetricIntervalUpperBound'] = upper
+                if lower is not None:
+                    step['MetricIntervalLowerBound'] = lower
+            run['steps'].append(step)
+    return runs
+
+
+def run_suffix(index):
+    """Logical ID suffix for a ladder run. The first keeps the plain names."""
+    return "" if index == 0 else "Step{}".format(index + 1)
+
+
+def run_threshold(threshold, run, direction):
+    """The alarm threshold of a run, offset from the configured level."""
+    if run['offset'] == 0:
+        return threshold
+    return "{:g}".format(float(threshold) + direction * run['offset'])
+
+
+def alarm_evaluation(settings):
+    """EvaluationPeriods and, for m-of-n alarms, DatapointsToAlarm."""
+    periods = int(settings.get('EvaluationPeriods', 1))
+    evaluation = {'EvaluationPeriods': str(periods)}
+    if 'DatapointsToAlarm' in settings:
+        datapoints = int(settings['DatapointsToAlarm'])
+        if not 1 <= datapoints <= periods:
+            raise ValueError(
+                "DatapointsToAlarm must be between 1 and EvaluationPeriods "
+                "({}), got {}".format(periods, datapoints))
+        evaluation['DatapointsToAlarm'] = str(datapoints)
+    return evaluation
+
+
+def scaling_metrics(value):
+    """Normalise ScalingMetric, a single metric or a list, into a list."""
+    metrics = value if isinstance(value, list) else [value]
+    if not metrics or len(set(metrics)) != len(metrics):
+        raise ValueError(
+            "ScalingMetric must name one or more distinct metrics, "
+            "got {}".format(value))
+    return metrics
+
+
+def alarm_metrics(metrics, metric_name, dimensions):
+    """Alarm properties that watch one ECS metric, or the highest of several.
+
+    ``metric_name`` is formatted with each metric, e.g. ``"{}Reservation"``.
+    """
+    if len(metrics) == 1:
+        return {
+            'Namespace': "AWS/ECS",
+            'MetricName': metric_name.format(metrics[0]),
+            'Dimensions': dimensions,
+            'Statistic': "Average",
+            'Period': "60",
+        }
+
+    queries = [
+        MetricDataQuery(
+            Id=metric.lower(),
+            MetricStat=MetricStat(
+                Metric=Metric(
+                    Namespace="AWS/ECS",
+                    MetricName=metric_name.format(metric),
+                    Dimensions=dimensions,
+                ),
+                Period=60,
+                Stat="Average",
+            ),
+            ReturnData=False,
+        )
+        for metric in metrics
+    ]
+    queries.append(MetricDataQuery(
+        Id="highest",
+        Expression="MAX([{}])".format(
+            ", ".join(metric.lower() for metric in metrics)),
+        Label="Highest of {}".format(
+            ", ".join(metric_name.format(metric) for metric in metrics)),
+        ReturnData=True,
+    ))
+    return {'Metrics': queries}
@@ -0,0 +1,190 @@
+"""Size-optimizing serialization for rendered templates.
+
+CloudFormation has no template-level variables (and rejects YAML anchors
+and aliases), so repeated expressions cannot be hoisted across resources.
+Within one expression they can: an ``Fn::Join`` is rewritten into an
+``Fn::Sub`` whose variable map defines each distinct sub-expression once,
+with references and attributes inlined as ``${...}``. The rewrite is only
+kept where it is smaller. Templates are then written as compact JSON or
+short-form YAML, and their size checked against CloudFormation's limits.
+"""
+
+import json
+from collections import Counter
+
+
+# CloudFormation template body limits.
+INLINE_LIMIT = 51200
+S3_LIMIT = 1024 * 1024
+
+COMPACT_SEPARATORS = (',', ':')
+
+
+def _size(node):
+    return len(json.dumps(node, separators=COMPACT_SEPARATORS,
+                          sort_keys=True))
+
+
+def _intrinsic(node):
+    """Return ``(name, args)`` if the node is an intrinsic function."""
+    if isinstance(node, dict) and len(node) == 1:
+        name = next(iter(node))
+        if name == 'Ref' or name.startswith('Fn::'):
+            return name, node[name]
+    return None, None
+
+
+def _escape(text):
+    return text.replace('${', '${!')
+
+
+class _SubBuilder(object):
+    """Accumulates the text and variable map of an Fn::Sub."""
+
+    def __init__(self, reserved):
+        self.reserved = reserved
+        self.parts = []
+        self.variables = {}
+        self.names = {}
+
+    def add(self, part):
+        name, args = _intrinsic(part)
+        if isinstance(part, str):
+            self.parts.append(_escape(part))
+        elif name == 'Ref' and isinstance(args, str):
+            self.parts.append("${%s}" % args)
+        elif (name == 'Fn::GetAtt' and isinstance(args, list) and
+              len(args) == 2 and all(isinstance(a, str) for a in args) and
+              '.' not in args[1]):
+            self.parts.append("${%s.%s}" % tuple(args))
+        else:
+            self.parts.append("${%s}" % self.variable(part))
+
+    def variable(self, expression):
+        key = json.dumps(expression, sort_keys=True)
+        if key not in self.names:
+            n = len(self.names)
+            while "V{}".format(n) in self.reserved:
+                n += 1
+            name = "V{}".format(n)
+            self.names[key] = name
+            self.variables[name] = expression
+        return self.names[key]
+
+    def build(self):
+        text = ''.join(self.parts)
+        if self.variables:
+            return {'Fn::Sub': [text, self.variables]}
+        return {'Fn::Sub': text}
+
+
+def _join_to_sub(args, reserved):
+    """Rewrite Fn::Join arguments as an Fn::Sub, or None if not possible."""
+    if not (isinstance(args, list) and len(args) == 2 and
+            isinstance(args[0], str) and isinstance(args[1], list)):
+        return None
+    delimiter, parts = args
+    builder = _SubBuilder(reserved)
+    for index, part in enumerate(parts):
+        if index:
+            builder.parts.append(_escape(delimiter))
+        name, _ = _intrinsic(part)
+        if not isinstance(part, str) and name is None:
+            return None
+        builder.add(part)
+    return builder.build()
+
+
+def hoist(node, reserved=frozenset()):
+    """Return a copy of a template (or part of one) with Fn::Join
+    expressions rewritten as Fn::Sub wherever that is smaller.
+
+    ``reserved`` holds names Fn::Sub variables must not shadow, i.e. the
+    template's parameters and resources.
+    """
+    if isinstance(node, list):
+        return [hoist(item, reserved) for item in node]
+    if not isinstance(node, dict):
+        return node
+
+    node = {key: hoist(value, reserved) for key, value in node.items()}
+    name, args = _intrinsic(node)
+    if name == 'Fn::Join':
+        sub = _join_to_sub(args, reserved)
+        if sub is not None and _size(sub) < _size(node):
+            return sub
+    return node
+
+
+def hoist_template(template):
+    reserved = set(template.get('Parameters', {})) | set(
+        template.get('Resources', {}))
+    return hoist(template, frozenset(reserved))
+
+
+def repeated_expressions(template, minimum=2):
+    """Count intrinsic expressions that appear more than once.
+
+    Returns ``(count, size, expression_json)`` tuples, largest total size
+    first, for expressions used at least ``minimum`` times. Only the
+    outermost repeat is reported, not the sub-expressions inside it.
+    """
+    counts = Counter()
+
+    def walk(node):
+        name, _ = _intrinsic(node)
+        if name is not None and name != 'Ref':
+            counts[json.dumps(node, sort_keys=True,
+                              separators=COMPACT_SEPARATORS)] += 1
+        if isinstance(node, dict):
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(template)
+    repeats = [(count, len(key), key) for key, count in counts.items()
+               if count >= minimum]
+    # Drop expressions only repeated because an enclosing one is.
+    outer = [r for r in repeats
+             if not any(r[2] in other[2] and other[0] == r[0] and
+                        other[2] != r[2] for other in repeats)]
+    return sorted(outer, key=lambda r: r[0] * r[1], reverse=True)
+
+
+def serialize(body, fmt='json', compact=False, hoist_expressions=False):
+    """Re-serialize a rendered template JSON string.
+
+    ``fmt`` is 'json' or 'yaml' (short-form intrinsics, needs cfn_flip).
+    ``compact`` drops JSON indentation, and ``hoist_expressions`` applies
+    ``hoist_template``.
+    """
+    template = json.loads(body)
+    if hoist_expressions:
+        template = hoist_template(template)
+
+    if fmt == 'yaml':
+        import cfn_flip
+        return cfn_flip.to_yaml(
+            json.dumps(template, sort_keys=True), clean_up=False)
+    if compact:
+        return json.dumps(template, sort_keys=True,
+                          separators=COMPACT_SEPARATORS)
+    return json.dumps(template, sort_keys=True, indent=1,
+                      separators=(',', ': '))
+
+
+def size_report(body):
+    """Describe a template body's size against CloudFormation's limits.
+
+    Returns ``(size, status)`` where status is 'inline' when the body can be
+    passed directly, 's3' when it must be uploaded to S3 first and 'too
+    large' when it exceeds even the S3 limit.
+    """
+    size = len(body.encode('utf-8'))
+    if size <= INLINE_LIMIT:
+        return size, 'inline'
+    if size <= S3_LIMIT:
+        return size, 's3'
+    return size, 'too large'
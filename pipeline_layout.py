@@ -0,0 +1,105 @@
+"""Lay out pipeline actions from their artifact dependencies.
+
+Actions in the same stage that share a RunOrder run in parallel. Each
+stage's actions are given the earliest RunOrder their input artifacts
+allow: 1 when everything they consume comes from an earlier stage, or one
+after the latest action in the same stage that produces one of their
+inputs. Independent builds therefore run side by side, and the stage takes
+as long as its slowest chain of actions rather than the sum of them.
+
+Deploy stages can also be skipped when a build action reports that their
+stack has not changed (see cfgen/deploy_gate.py). Stage conditions need a
+V2 pipeline.
+"""
+
+from troposphere import If, Ref
+
+from troposphere.codepipeline import (
+    BeforeEntryConditions,
+    Condition,
+    RuleDeclaration,
+    RuleTypeId,
+    Stages
+)
+
+
+# Namespace of the build action exporting the deploy gate's variables.
+GATE_NAMESPACE = "BuildVariables"
+
+
+def _artifacts(action, key):
+    return [artifact.Name for artifact in action.properties.get(key, [])]
+
+
+def skip_unless_changed(variable):
+    """BeforeEntry conditions skipping a stage unless the deploy gate
+    exported ``<variable>_CHANGED=true``."""
+    return BeforeEntryConditions(
+        Conditions=[
+            Condition(
+                Result="SKIP",
+                Rules=[
+                    RuleDeclaration(
+                        Name="{}Changed".format(variable.capitalize()),
+                        RuleTypeId=RuleTypeId(
+                            Category="Rule",
+                            Owner="AWS",
+                            Provider="VariableCheck",
+                            Version="1"
+                        ),
+                        Configuration={
+                            "Variable": "#{{{}.{}_CHANGED}}".format(
+                                GATE_NAMESPACE, variable),
+                            "Value": "true",
+                            "Operator": "EQ"
+                        },
+                    )
+                ]
+            )
+        ]
+    )
+
+
+def layout_stages(stages):
+    """Build the pipeline's Stages from ``(name, actions)`` pairs, or
+    ``(name, actions, properties)`` to set further Stages properties. A
+    ``Condition`` property names a template condition the stage is only
+    included under.
+
+    Sets the RunOrder of every action, and raises ValueError if an action
+    consumes an artifact that no earlier action produces.
+    """
+    produced = set()
+    result = []
+    for stage in stages:
+        name, actions = stage[:2]
+        properties = dict(stage[2]) if len(stage) > 2 else {}
+        condition = properties.pop('Condition', None)
+        orders = {}
+        pending = list(actions)
+        while pending:
+            ready = [
+                action for action in pending
+                if all(artifact in produced or artifact in orders
+                       for artifact in _artifacts(action, 'InputArtifacts'))
+            ]
+            if not ready:
+                raise ValueError(
+                    "Stage {} has actions whose inputs are never produced: "
+                    "{}".format(name, ", ".join(
+                        action.Name for action in pending)))
+            for action in ready:
+                action.RunOrder = 1 + max(
+                    [orders.get(artifact, 0)
+                     for artifact in _artifacts(action, 'InputArtifacts')] +
+                    [0])
+                pending.remove(action)
+            for action in ready:
+                for artifact in _artifacts(action, 'OutputArtifacts'):
+                    orders[artifact] = action.RunOrder
+        produced.update(orders)
+        layout = Stages(Name=name, Actions=list(actions), **properties)
+        if condition:
+            layout = If(condition, layout, Ref("AWS::NoValue"))
+        result.append(layout)
+    return result
@@ -0,0 +1,110 @@
+"""Start pipelines from CodeCommit events instead of polling.
+
+A polling CodeCommit source action checks the repository about once a
+minute, so a push can wait that long before the pipeline notices it, and
+every pipeline spends API calls doing so. Instead the source action is set
+not to poll, and an EventBridge rule starts the pipeline as soon as the
+configured branch is created or updated.
+"""
+
+from awacs.aws import (
+    Allow,
+    Policy,
+    Principal,
+    Statement
+)
+
+from awacs.sts import AssumeRole
+
+from troposphere import (
+    GetAtt,
+    Parameter,
+    Ref,
+    Sub
+)
+
+from troposphere.events import Rule, Target
+
+from troposphere.iam import Policy as IAMPolicy
+
+from troposphere.iam import Role
+
+
+def add_branch_parameter(t, default="master"):
+    """Add the BranchName parameter the source action and trigger watch."""
+    t.add_parameter(Parameter(
+        "BranchName",
+        Type="String",
+        Default=default,
+        Description="Branch of the CodeCommit repository that triggers the "
+                    "pipeline"
+    ))
+
+
+def source_configuration(repository):
+    """CodeCommit source action Configuration for the watched branch."""
+    return {
+        "BranchName": Ref("BranchName"),
+        "RepositoryName": repository,
+        "PollForSourceChanges": "false",
+    }
+
+
+def add_source_trigger(t, pipeline, repository):
+    """Add an EventBridge rule, and the role it uses, that starts
+    ``pipeline`` when the BranchName branch of ``repository`` changes."""
+    pipelineArn = Sub(
+        "arn:${AWS::Partition}:codepipeline:${AWS::Region}:"
+        "${AWS::AccountId}:${Pipeline}",
+        Pipeline=Ref(pipeline))
+
+    t.add_resource(Role(
+        "{}TriggerRole".format(pipeline),
+        AssumeRolePolicyDocument=Policy(
+            Statement=[
+                Statement(
+                    Effect=Allow,
+                    Action=[AssumeRole],
+                    Principal=Principal("Service", ["events.amazonaws.com"])
+                )
+            ]
+        ),
+        Path="/",
+        Policies=[
+            IAMPolicy(
+                PolicyName="StartPipelineExecution",
+                PolicyDocument={
+                    "Statement": [
+                        {"Effect": "Allow",
+                         "Action": "codepipeline:StartPipelineExecution",
+                         "Resource": pipelineArn},
+                    ],
+                }
+            ),
+        ]
+    ))
+
+    t.add_resource(Rule(
+        "{}Trigger".format(pipeline),
+        Description="Start the pipeline on changes to the source branch",
+        EventPattern={
+            "source": ["aws.codecommit"],
+            "detail-type": ["CodeCommit Repository State Change"],
+            "resources": [Sub(
+                "arn:${AWS::Partition}:codecommit:${AWS::Region}:"
+                "${AWS::AccountId}:${Repository}",
+                Repository=repository)],
+            "detail": {
+                "event": ["referenceCreated", "referenceUpdated"],
+                "referenceType": ["branch"],
+                "referenceName": [Ref("BranchName")],
+            },
+        },
+        Targets=[
+            Target(
+                Id="Pipeline",
+                Arn=pipelineArn,
+                RoleArn=GetAtt("{}TriggerRole".format(pipeline), "Arn"),
+            )
+        ],
+    ))
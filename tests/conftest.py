@@ -0,0 +1,10 @@
+"""Make the repository's packages importable when pytest runs from
+elsewhere; the generator directories are loaded by path."""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -0,0 +1,191 @@
+"""The render caches in cfgen.cache, on disk and against a stub S3 client."""
+
+import datetime
+import io
+import os
+import shutil
+
+import pytest
+
+from cfgen import cache
+from cfgen.__main__ import render_cached
+from cfgen.generators import ROOT, render
+
+
+class Clock(object):
+    """Stands in for time.time from June 2024, one second later on every
+    call."""
+
+    def __init__(self, start=1717200000.0):
+        self.now = start
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    return clock
+
+
+def test_cache_key_follows_inputs(tmp_path):
+    source = tmp_path / 'template.py'
+    source.write_text('print(1)\n')
+    key = cache.cache_key('t', [str(source)], versions='v')
+    assert key == cache.cache_key('t', [str(source)], versions='v')
+    assert key != cache.cache_key('t', [str(source)], {'Env': 'stag'}, 'v')
+    assert key != cache.cache_key('t', [str(source)], versions='w')
+    source.write_text('print(2)\n')
+    assert key != cache.cache_key('t', [str(source)], versions='v')
+
+
+def test_local_cache_round_trip(tmp_path):
+    local = cache.LocalCache(str(tmp_path / 'cache'))
+    assert local.get('a') is None
+    local.put('a', '{"a": 1}')
+    assert local.get('a') == '{"a": 1}'
+
+
+def test_local_cache_evicts_least_recently_used(tmp_path):
+    directory = tmp_path / 'cache'
+    local = cache.LocalCache(str(directory), max_bytes=30)
+    for name, used in (('a', 1000), ('b', 2000), ('c', 3000)):
+        local.put(name, 'x' * 10)
+        path = str(directory / '{}.template'.format(name))
+        os.utime(path, (used, used))
+    # A hit makes a the most recently used, so b is the oldest
+    assert local.get('a') == 'x' * 10
+    local.put('d', 'x' * 10)
+    assert sorted(os.listdir(str(directory))) == [
+        'a.template', 'c.template', 'd.template']
+
+
+class NoSuchKey(Exception):
+
+    response = {'Error': {'Code': 'NoSuchKey'}}
+
+
+class StubS3(object):
+    """Keeps objects in a dict and lists them a page at a time."""
+
+    def __init__(self, page_size=2):
+        self.objects = {}
+        self.page_size = page_size
+        self.calls = []
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise NoSuchKey(Key)
+        return {'Body': io.BytesIO(self.objects[Key]['Body'])}
+
+    def put_object(self, Bucket, Key, Body, ContentType, Tagging):
+        name, _, value = Tagging.partition('=')
+        self.objects[Key] = {
+            'Body': Body,
+            'ContentType': ContentType,
+            'LastModified': datetime.datetime(
+                2024, 1, 1, tzinfo=datetime.timezone.utc),
+            'Tags': {name: value},
+        }
+
+    def put_object_tagging(self, Bucket, Key, Tagging):
+        self.calls.append(('put_object_tagging', Key))
+        self.objects[Key]['Tags'] = dict(
+            (tag['Key'], tag['Value']) for tag in Tagging['TagSet'])
+
+    def get_object_tagging(self, Bucket, Key):
+        self.calls.append(('get_object_tagging', Key))
+        return {'TagSet': [{'Key': k, 'Value': v}
+                           for k, v in self.objects[Key]['Tags'].items()]}
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):
+        keys = sorted(k for k in self.objects if k.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        response = {'Contents': [
+            {'Key': k, 'Size': len(self.objects[k]['Body']),
+             'LastModified': self.objects[k]['LastModified']}
+            for k in keys[start:start + self.page_size]]}
+        if start + self.page_size < len(keys):
+            response['IsTruncated'] = True
+            response['NextContinuationToken'] = str(start + self.page_size)
+        return response
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete['Objects']:
+            del self.objects[item['Key']]
+
+
+def test_s3_cache_round_trip(clock):
+    client = StubS3()
+    s3 = cache.S3Cache('bucket', '/render-cache/', client=client)
+    assert s3.get('a') is None
+    s3.put('a', '{"a": 1}')
+    assert s3.get('a') == '{"a": 1}'
+    stored = client.objects['render-cache/a.template']
+    # A hit tags the entry and leaves the object as it was written
+    assert stored['ContentType'] == 'application/json'
+    assert stored['Tags'] == {cache.LAST_USED_TAG: repr(clock.now)}
+
+
+def test_s3_cache_under_cap_reads_no_tags(clock):
+    client = StubS3()
+    s3 = cache.S3Cache('bucket', 'render-cache', max_bytes=100, client=client)
+    for name in 'abc':
+        s3.put(name, 'x' * 10)
+    assert not [call for call in client.calls
+                if call[0] == 'get_object_tagging']
+
+
+def test_s3_cache_evicts_least_recently_used(clock):
+    client = StubS3()
+    s3 = cache.S3Cache('bucket', 'render-cache', max_bytes=30, client=client)
+    for name in 'abc':
+        s3.put(name, 'x' * 10)
+    # Hits on a and then b leave c the least recently used
+    s3.get('a')
+    s3.get('b')
+    s3.put('d', 'x' * 10)
+    assert sorted(client.objects) == [
+        'render-cache/a.template', 'render-cache/b.template',
+        'render-cache/d.template']
+    # Then a, the oldest hit
+    s3.put('e', 'x' * 10)
+    assert sorted(client.objects) == [
+        'render-cache/b.template', 'render-cache/d.template',
+        'render-cache/e.template']
+
+
+def test_s3_cache_untagged_entries_go_by_last_modified(clock):
+    client = StubS3()
+    s3 = cache.S3Cache('bucket', max_bytes=20, client=client)
+    s3.put('a', 'x' * 10)
+    s3.put('b', 'x' * 10)
+    # Written before the cache tagged its entries, so older than any tag
+    client.objects['b.template']['Tags'] = {}
+    s3.put('c', 'x' * 10)
+    assert sorted(client.objects) == ['a.template', 'c.template']
+
+
+def test_open_cache_directory(tmp_path):
+    local = cache.open_cache(str(tmp_path / 'cache'), max_bytes=10)
+    assert isinstance(local, cache.LocalCache)
+    assert local.max_bytes == 10
+
+
+def test_render_cached_from_a_checkout(tmp_path):
+    # The service repository as CodeBuild checks it out
+    checkout = str(tmp_path / 'app')
+    shutil.copytree(os.path.join(ROOT, 'AppTemplates-Autoscaling'), checkout,
+                    ignore=shutil.ignore_patterns('__pycache__'))
+    local = cache.LocalCache(str(tmp_path / 'cache'))
+    [(name, files, hit)] = render_cached(
+        ['ecs-service'], 1, local, source_dir=checkout)
+    assert not hit
+    assert files == render('ecs-service')[1]
+    [(name, files, hit)] = render_cached(
+        ['ecs-service'], 1, local, source_dir=checkout)
+    assert hit
+    assert files[0][0] == 'ecs-service-cf.template'
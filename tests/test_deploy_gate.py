@@ -0,0 +1,144 @@
+"""The pipelines' deploy gate in cfgen.deploy_gate, against a stub
+CloudFormation client."""
+
+import json
+import subprocess
+
+import pytest
+
+from cfgen import deploy_gate as gate_module
+
+
+TEMPLATE = b'{"Resources": {"ECSCluster": {"Type": "AWS::ECS::Cluster"}}}'
+
+
+@pytest.fixture
+def deploy_gate():
+    return gate_module
+
+
+class StubCloudFormation(object):
+    """Answers DescribeStacks from a dict of stack name to stack."""
+
+    def __init__(self, stacks):
+        self.stacks = stacks
+
+    def describe_stacks(self, StackName):
+        if StackName not in self.stacks:
+            return {'Stacks': []}
+        return {'Stacks': [self.stacks[StackName]]}
+
+
+def deployed(deploy_gate, parameters, status='UPDATE_COMPLETE'):
+    return {
+        'StackStatus': status,
+        'Tags': [
+            {'Key': 'Owner', 'Value': 'platform'},
+            {'Key': deploy_gate.FINGERPRINT_TAG,
+             'Value': deploy_gate.fingerprint(TEMPLATE, parameters)},
+        ],
+    }
+
+
+def test_fingerprint_covers_template_and_parameters(deploy_gate):
+    base = deploy_gate.fingerprint(TEMPLATE, {'Tag': 'a', 'KeyPair': 'k'})
+    assert base == deploy_gate.fingerprint(
+        TEMPLATE, {'KeyPair': 'k', 'Tag': 'a'})
+    assert base != deploy_gate.fingerprint(
+        TEMPLATE, {'Tag': 'b', 'KeyPair': 'k'})
+    assert base != deploy_gate.fingerprint(
+        TEMPLATE + b' ', {'Tag': 'a', 'KeyPair': 'k'})
+
+
+def test_unchanged_stack_is_skipped(deploy_gate, tmp_path):
+    parameters = {'Tag': 'abc'}
+    client = StubCloudFormation(
+        {'stag-app': deployed(deploy_gate, parameters)})
+    changed = deploy_gate.gate(
+        client, TEMPLATE, [('STAG', 'stag-app', parameters)], str(tmp_path))
+    assert changed == {'STAG': False}
+
+
+def test_changed_and_new_stacks_are_deployed(deploy_gate, tmp_path):
+    client = StubCloudFormation(
+        {'stag-app': deployed(deploy_gate, {'Tag': 'old'})})
+    changed = deploy_gate.gate(client, TEMPLATE, [
+        ('STAG', 'stag-app', {'Tag': 'new'}),
+        ('PROD', 'prod-app', {'Tag': 'new'}),
+    ], str(tmp_path))
+    assert changed == {'STAG': True, 'PROD': True}
+
+
+@pytest.mark.parametrize('status', [
+    'CREATE_FAILED', 'ROLLBACK_COMPLETE', 'UPDATE_IN_PROGRESS'])
+def test_unsettled_stack_is_deployed(deploy_gate, tmp_path, status):
+    parameters = {'Tag': 'abc'}
+    client = StubCloudFormation(
+        {'stag-app': deployed(deploy_gate, parameters, status)})
+    changed = deploy_gate.gate(
+        client, TEMPLATE, [('STAG', 'stag-app', parameters)], str(tmp_path))
+    assert changed == {'STAG': True}
+
+
+def test_stack_without_tag_is_deployed(deploy_gate, tmp_path):
+    client = StubCloudFormation(
+        {'stag-app': {'StackStatus': 'CREATE_COMPLETE', 'Tags': []}})
+    changed = deploy_gate.gate(
+        client, TEMPLATE, [('STAG', 'stag-app', {})], str(tmp_path))
+    assert changed == {'STAG': True}
+
+
+def test_gate_writes_template_configuration(deploy_gate, tmp_path):
+    parameters = {'Tag': 'abc'}
+    deploy_gate.gate(StubCloudFormation({}), TEMPLATE,
+                     [('PROD', 'prod-app', parameters)], str(tmp_path))
+    with open(str(tmp_path / 'prod-configuration.json')) as f:
+        assert json.load(f) == {'Tags': {
+            deploy_gate.FINGERPRINT_TAG:
+                deploy_gate.fingerprint(TEMPLATE, parameters)}}
+
+
+def test_main_exports_changed_variables(deploy_gate, tmp_path, capsys):
+    template = tmp_path / 'template.json'
+    template.write_bytes(TEMPLATE)
+    tag = tmp_path / 'tag.json'
+    tag.write_text('{"Tag": "abc"}')
+    key_pair = tmp_path / 'key-pair.json'
+    key_pair.write_text('{"KeyPair": "ops"}')
+    # Stag was deployed with the same merged parameters, prod with others
+    client = StubCloudFormation({
+        'stag-app': deployed(deploy_gate, {'Tag': 'abc', 'KeyPair': 'ops'}),
+        'prod-app': deployed(deploy_gate, {'Tag': 'old', 'KeyPair': 'ops'}),
+    })
+    deploy_gate.main([
+        str(template), '--output-dir', str(tmp_path),
+        '--stack', 'STAG', 'stag-app', str(tag), str(key_pair),
+        '--stack', 'PROD', 'prod-app', str(tag), str(key_pair),
+    ], client)
+    assert capsys.readouterr().out.splitlines() == [
+        "export STAG_CHANGED=false",
+        "export PROD_CHANGED=true",
+    ]
+
+
+def test_stack_needs_a_name(deploy_gate):
+    with pytest.raises(SystemExit):
+        deploy_gate.parse_args(['template.json', '--stack', 'STAG'])
+
+
+def test_cli_client_reports_missing_stack(deploy_gate, monkeypatch):
+    def missing(*args, **kwargs):
+        raise subprocess.CalledProcessError(
+            255, args[0], stderr=b'Stack with id stag-app does not exist')
+    monkeypatch.setattr(subprocess, 'check_output', missing)
+    assert deploy_gate.CLIClient().describe_stacks(
+        StackName='stag-app') == {'Stacks': []}
+
+
+def test_cli_client_raises_other_errors(deploy_gate, monkeypatch):
+    def denied(*args, **kwargs):
+        raise subprocess.CalledProcessError(
+            255, args[0], stderr=b'AccessDenied')
+    monkeypatch.setattr(subprocess, 'check_output', denied)
+    with pytest.raises(subprocess.CalledProcessError):
+        deploy_gate.CLIClient().describe_stacks(StackName='stag-app')
@@ -0,0 +1,121 @@
+"""capacity.feasibility on small clusters of t3.medium instances."""
+
+import numpy as np
+import pytest
+
+from capacity import feasibility
+
+
+# A t3.medium offers 2048 CPU units and 3850 MiB to tasks
+CLUSTER = {
+    'instanceSize': 't3.medium',
+    'minCapacity': 1,
+    'maxCapacity': 2,
+    'ScaleUpLevel': 75,
+    'ScalingMetric': 'CPU',
+}
+
+
+def service(name, cpu, memory, tasks):
+    return feasibility.Service(name, {
+        'TaskCPU': str(cpu),
+        'TaskMemory': str(memory),
+        'MaxTaskCapacity': str(tasks),
+    })
+
+
+def statuses(result):
+    return dict((row['service'], row['status']) for row in result['services'])
+
+
+def test_pack_first_fit_per_instance_type():
+    cpu = np.array([1024, 1024, 512])
+    memory = np.array([512, 512, 512])
+    freeCpu, freeMemory, used, placed = feasibility.pack(
+        cpu, memory, np.array([2048, 1024]), np.array([3850, 3850]), 2)
+    # Two tasks fill the first large instance, the third starts the second
+    assert freeCpu[0].tolist() == [0, 1536]
+    assert freeMemory[0].tolist() == [2826, 3338]
+    assert placed[0].all()
+    # Small instances take one large task each and have no room left
+    assert freeCpu[1].tolist() == [0, 0]
+    assert placed[1].tolist() == [True, True, False]
+    assert used.all()
+
+
+def test_one_stack_of_each_service_per_cluster(tmp_path):
+    path = tmp_path / 'service_config.yaml'
+    path.write_text("TaskCPU: '256'\nTaskMemory: '512'\n"
+                    "MaxTaskCapacity: '6'\n")
+    services = feasibility.load_services(
+        ['web={}'.format(path)], services_path=None)
+    # Stag and prod run on clusters of their own, so one stack's worth
+    assert [(s.name, s.tasks) for s in services] == [('web', 6)]
+
+
+def test_fitting_services_are_ok():
+    result = feasibility.check_cluster(
+        [service('web', 512, 512, 6)], CLUSTER)
+    assert statuses(result) == {'web': 'ok'}
+    assert result['problems'] == []
+    assert (result['needed'], result['unplaced']) == (2, 0)
+
+
+def test_too_large_service_is_not_reported_blocked():
+    result = feasibility.check_cluster(
+        [service('big', 4096, 512, 1), service('web', 512, 512, 2)],
+        CLUSTER)
+    assert statuses(result) == {'big': 'too large', 'web': 'ok'}
+    assert len(result['problems']) == 1
+    assert 'does not fit on a t3.medium' in result['problems'][0]
+
+
+def test_capped_service():
+    result = feasibility.check_cluster(
+        [service('web', 1024, 512, 10)], CLUSTER)
+    # Two instances hold four of the ten tasks
+    assert statuses(result) == {'web': 'capped'}
+    assert result['services'][0]['unplaced'] == 6
+    assert '6 of 10 tasks' in result['problems'][0]
+
+
+def test_memory_bound_service_blocks_cpu_scaling():
+    # One 2048 MiB task fills an instance's memory but reserves 12.5% CPU
+    result = feasibility.check_cluster(
+        [service('cache', 256, 2048, 2)], CLUSTER)
+    row = result['services'][0]
+    assert row['status'] == 'blocked'
+    assert row['packed'] == pytest.approx(12.5)
+    assert 'ScaleUpLevel 75' in result['problems'][0]
+
+
+def test_mixed_services_put_scaling_at_risk():
+    # CPU-heavy tasks fill instances on their own, but next to
+    # memory-heavy tasks they can leave the CPU alarm below its level
+    result = feasibility.check_cluster(
+        [service('api', 1024, 256, 2), service('cache', 256, 1900, 2)],
+        CLUSTER)
+    assert statuses(result) == {'api': 'at risk', 'cache': 'blocked'}
+
+
+def test_capacity_provider_skips_the_reservation_checks():
+    cluster = dict(CLUSTER, CapacityProvider={'TargetCapacity': 100})
+    result = feasibility.check_cluster(
+        [service('cache', 256, 2048, 2)], cluster)
+    assert statuses(result) == {'cache': 'ok'}
+
+
+def test_compare_instance_types_cheapest_feasible_first():
+    services = [service('cache', 256, 2048, 4)]
+    types = ['t3.medium', 'c5.large', 'r5.large', 't3.large']
+    result = feasibility.compare_instance_types(services, CLUSTER, types)
+    # Only r5.large holds enough of these tasks to pass 75% CPU
+    assert [r['instance_type'] for r in result] == ['r5.large']
+    assert result[0]['instances'] == 1
+
+    cluster = dict(CLUSTER, ScalingMetric='Memory')
+    result = feasibility.compare_instance_types(services, cluster, types)
+    # Three tasks to a t3.large reserve 80% memory too, but two of them
+    # cost more than one r5.large
+    assert [(r['instance_type'], r['instances']) for r in result] == [
+        ('r5.large', 1), ('t3.large', 2)]
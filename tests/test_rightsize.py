@@ -0,0 +1,107 @@
+"""capacity.rightsize against the exports in fixtures/rightsize."""
+
+import os
+
+import pytest
+
+from capacity import rightsize
+from capacity.configs import load_yaml
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'rightsize')
+CONFIG = os.path.join(FIXTURES, 'service_config.yaml')
+METRICS = [os.path.join(FIXTURES, name)
+           for name in ('metrics.csv', 'cpu.jsonl', 'memory.json')]
+
+
+@pytest.fixture
+def histograms():
+    return rightsize.read_metrics(METRICS)
+
+
+def test_read_metrics_counts_every_format(histograms):
+    # CPU from the CSV and JSON Lines rows (the null skipped), memory from
+    # the CSV and the MemoryUtilization result (RequestCount ignored)
+    assert histograms['cpu'].total == 20
+    assert histograms['memory'].total == 20
+    assert histograms['cpu'].maximum == pytest.approx(70.05)
+    assert histograms['memory'].maximum == pytest.approx(90.05)
+
+
+def test_read_metrics_rejects_unknown_files(tmp_path):
+    path = tmp_path / 'metrics.txt'
+    path.write_text('cpu\n1\n')
+    with pytest.raises(ValueError):
+        rightsize.read_metrics([str(path)])
+
+
+def test_percentile_is_upper_bin_edge(histograms):
+    # The 19th of 20 values, 60.05, lies in the bin ending at 60.1
+    assert histograms['cpu'].percentile(95) == pytest.approx(60.1)
+    assert histograms['cpu'].percentile(100) == pytest.approx(70.05)
+
+
+def test_recommend(histograms):
+    values, usage = rightsize.recommend(load_yaml(CONFIG), histograms)
+
+    # p95 CPU is 60.1% of 256 units, reserved at the 80% ScaleUpLevel
+    assert usage['cpu'] == pytest.approx(0.601 * 256)
+    assert values['TaskCPU'] == 224
+    # p95 memory is 80.1% of 512 MiB, reserved at the default 80% target
+    assert usage['memory'] == pytest.approx(0.801 * 512)
+    assert values['TaskMemoryReservation'] == 520
+    # The 90.05% peak plus 25% headroom
+    assert usage['memory_peak'] == pytest.approx(0.9005 * 512)
+    assert values['TaskMemory'] == 584
+
+
+def test_recommend_keeps_hard_limit_over_reservation(histograms):
+    values, usage = rightsize.recommend(
+        load_yaml(CONFIG), histograms, headroom=0)
+    assert values['TaskMemory'] == (
+        values['TaskMemoryReservation'] + rightsize.MEMORY_STEP)
+
+
+def test_update_config_keeps_comments():
+    with open(CONFIG) as f:
+        text = f.read()
+    updated = rightsize.update_config(text, {
+        'TaskCPU': 224,
+        'TaskMemory': 584,
+        'TaskMemoryReservation': 520,
+    })
+    lines = updated.splitlines()
+    assert lines[:3] == [
+        "TaskCPU: '224'",
+        "TaskMemory: '584'   # hard limit",
+        "TaskMemoryReservation: '520'",
+    ]
+    assert lines[3:] == text.splitlines()[2:]
+
+
+def test_fargate_size_rounds_up_to_a_task_size():
+    config = dict(load_yaml(CONFIG), LaunchType='FARGATE')
+    assert rightsize.fargate_size(
+        config, {'TaskCPU': 224, 'TaskMemory': 584}) == {
+            'TaskCPU': 256, 'TaskMemory': 1024}
+    # Too much memory for 256 CPU units moves up a CPU size
+    assert rightsize.fargate_size(
+        config, {'TaskCPU': 224, 'TaskMemory': 3000}) == {
+            'TaskCPU': 512, 'TaskMemory': 3072}
+
+
+def test_fargate_size_rejects_oversized_tasks():
+    config = dict(load_yaml(CONFIG), LaunchType='FARGATE')
+    with pytest.raises(ValueError):
+        rightsize.fargate_size(config, {'TaskCPU': 32768, 'TaskMemory': 512})
+
+
+def test_main_writes_updated_config(tmp_path, capsys):
+    output = tmp_path / 'service_config.yaml'
+    assert rightsize.main(
+        [CONFIG] + METRICS + ['--output', str(output)]) == 0
+    config = load_yaml(str(output))
+    assert config['TaskCPU'] == '224'
+    assert config['TaskMemory'] == '584'
+    assert config['TaskMemoryReservation'] == '520'
+    assert "TaskCPU 256 -> 224" in capsys.readouterr().err
@@ -0,0 +1,143 @@
+"""Listener rule priority allocation in ELBPipeline/rule_priorities.py."""
+
+import copy
+import os
+
+import pytest
+
+from capacity.configs import load_module
+
+
+rule_priorities = load_module(
+    'rule_priorities', os.path.join('ELBPipeline', 'rule_priorities.py'))
+alb_template = load_module(
+    'alb_route53_template',
+    os.path.join('ELBPipeline', 'alb-route53-cf-template.py'))
+
+
+def unlimited(sizes, nested):
+    return True
+
+
+def allocate(services, state=None, fits=unlimited, max_rules=100,
+             max_nested=0):
+    return rule_priorities.allocate(
+        services, state or {'shards': []}, fits, max_rules, max_nested)
+
+
+def rules(state):
+    return dict((s, (shard['id'], shard['stack'], priority))
+                for shard in state['shards']
+                for s, priority in shard['rules'].items())
+
+
+def test_free_list_fills_gaps_first():
+    free = rule_priorities.FreeList([1, 2, 4])
+    assert [free.take() for _ in range(3)] == [3, 5, 6]
+    assert rule_priorities.FreeList([]).take() == 1
+
+
+def test_new_services_take_priorities_in_order():
+    state = allocate(['a', 'b', 'c'])
+    assert state == {'shards': [
+        {'id': 0, 'stack': 0, 'rules': {'a': 1, 'b': 2, 'c': 3}}]}
+
+
+def test_removed_service_frees_its_priority():
+    state = allocate(['a', 'b', 'c'])
+    state = allocate(['a', 'c'], state)
+    assert rules(state) == {'a': (0, 0, 1), 'c': (0, 0, 3)}
+    # The next new service reuses it, and the others stay put
+    state = allocate(['a', 'c', 'd'], state)
+    assert rules(state) == {
+        'a': (0, 0, 1), 'c': (0, 0, 3), 'd': (0, 0, 2)}
+
+
+def test_existing_rules_never_move():
+    state = allocate(['a', 'b', 'c', 'd'], max_rules=2)
+    before = rules(state)
+    # Reordering the list, adding services and removing others leaves the
+    # remaining services' rules where they were
+    after = rules(allocate(['e', 'd', 'b', 'f'], state, max_rules=2))
+    for s in ('b', 'd'):
+        assert after[s] == before[s]
+    # The new services fill the slots a and c freed on each shard
+    assert after['e'] == before['a']
+    assert after['f'] == before['c']
+
+
+def test_allocate_leaves_the_state_untouched():
+    state = allocate(['a', 'b'])
+    saved = copy.deepcopy(state)
+    allocate(['b', 'c'], state)
+    assert state == saved
+
+
+def test_full_listener_opens_a_new_shard():
+    state = allocate(['a', 'b', 'c'], max_rules=2)
+    assert rules(state) == {
+        'a': (0, 0, 1), 'b': (0, 0, 2), 'c': (1, 0, 1)}
+
+
+def test_main_stack_keeps_room_for_nested_stacks():
+    # A stack holds three resources, counting a shard and a nested stack
+    # resource as one each
+    def fits(sizes, nested):
+        return len(sizes) + nested <= 3
+
+    # Without a reservation the main stack takes three shards
+    state = allocate(['a', 'b', 'c'], fits=fits, max_rules=1)
+    assert set(shard['stack'] for shard in state['shards']) == {0}
+    # Keeping room for two nested stacks leaves it one shard
+    state = allocate(['a', 'b', 'c'], fits=fits, max_rules=1, max_nested=2)
+    assert [(shard['id'], shard['stack']) for shard in state['shards']] == [
+        (0, 0), (1, 1), (2, 1)]
+
+
+def test_budget_too_small_for_one_service():
+    with pytest.raises(ValueError):
+        allocate(['a'], fits=lambda sizes, nested: False)
+
+
+def test_no_room_for_another_nested_stack():
+    # The main stack is full and cannot hold a nested stack resource
+    def fits(sizes, nested):
+        return len(sizes) <= 1 and nested == 0
+
+    with pytest.raises(ValueError):
+        allocate(['a', 'b'], fits=fits, max_rules=1)
+
+
+def test_unassigned():
+    state = allocate(['a', 'b'])
+    assert rule_priorities.unassigned(['b', 'c', 'a', 'd'], state) == [
+        'c', 'd']
+
+
+def config(services, state):
+    return {'example.com': services, 'RulePriorities': state}
+
+
+def test_check_rules_fails_on_a_missing_service():
+    state = allocate(['a'])
+    alb_template.check_rules(config(['a'], state))
+    with pytest.raises(ValueError) as error:
+        alb_template.check_rules(config(['a', {'b': {'TargetType': 'ip'}}],
+                                        state))
+    assert '--update-state' in str(error.value)
+    with pytest.raises(ValueError):
+        alb_template.build_alb_route53_stacks(config(['a', 'b'], state))
+
+
+def test_render_uses_the_saved_priorities():
+    state = allocate(['a', 'b', 'c'])
+    state = allocate(['a', 'c'], state)
+    template = alb_template.build_alb_route53_template(
+        config(['c', 'a'], state)).to_dict()
+    priorities = dict(
+        (name, resource['Properties']['Priority'])
+        for name, resource in template['Resources'].items()
+        if resource['Type'] == 'AWS::ElasticLoadBalancingV2::ListenerRule')
+    assert priorities == {
+        'stagaListenerRule': 1, 'stagcListenerRule': 3,
+        'prodaListenerRule': 1, 'prodcListenerRule': 3}
@@ -0,0 +1,107 @@
+"""Scaling ladders in cfgen.scaling_steps."""
+
+import pytest
+
+from cfgen import scaling_steps
+
+
+@pytest.mark.parametrize('value, expected', [
+    (3, ('ChangeInCapacity', 3)),
+    ('-1', ('ChangeInCapacity', -1)),
+    ('50%', ('PercentChangeInCapacity', 50)),
+    (' -25% ', ('PercentChangeInCapacity', -25)),
+])
+def test_parse_adjustment(value, expected):
+    assert scaling_steps.parse_adjustment(value) == expected
+
+
+def test_default_ladders_take_one_step():
+    assert scaling_steps.expand_ladder(None, 1) == [{
+        'offset': 0,
+        'adjustmentType': 'ChangeInCapacity',
+        'steps': [{'ScalingAdjustment': '1', 'MetricIntervalLowerBound': 0}],
+    }]
+    assert scaling_steps.expand_ladder([], -1) == [{
+        'offset': 0,
+        'adjustmentType': 'ChangeInCapacity',
+        'steps': [{'ScalingAdjustment': '-1', 'MetricIntervalUpperBound': 0}],
+    }]
+
+
+def test_mixed_ladder_splits_into_runs():
+    runs = scaling_steps.expand_ladder([
+        {'From': 25, 'Adjustment': '50%'},
+        {'From': 0, 'Adjustment': 1},
+        {'From': 10, 'Adjustment': 3},
+    ], 1)
+    assert [(run['offset'], run['adjustmentType']) for run in runs] == [
+        (0, 'ChangeInCapacity'), (25, 'PercentChangeInCapacity')]
+    # The absolute run hands over to the percentage run with a zero step
+    assert runs[0]['steps'] == [
+        {'ScalingAdjustment': '1',
+         'MetricIntervalLowerBound': 0, 'MetricIntervalUpperBound': 10},
+        {'ScalingAdjustment': '3',
+         'MetricIntervalLowerBound': 10, 'MetricIntervalUpperBound': 25},
+        {'ScalingAdjustment': '0', 'MetricIntervalLowerBound': 25},
+    ]
+    # Whose bounds are relative to its own alarm, 25 points further up
+    assert runs[1]['steps'] == [
+        {'ScalingAdjustment': '50', 'MetricIntervalLowerBound': 0}]
+    assert scaling_steps.run_threshold('60', runs[1], 1) == '85'
+
+
+def test_scale_down_ladder_counts_points_under():
+    runs = scaling_steps.expand_ladder([
+        {'From': 0, 'Adjustment': -1},
+        {'From': 20, 'Adjustment': '-50%'},
+    ], -1)
+    assert runs[0]['steps'] == [
+        {'ScalingAdjustment': '-1',
+         'MetricIntervalLowerBound': -20, 'MetricIntervalUpperBound': 0},
+        {'ScalingAdjustment': '0', 'MetricIntervalUpperBound': -20},
+    ]
+    assert runs[1]['steps'] == [
+        {'ScalingAdjustment': '-50', 'MetricIntervalUpperBound': 0}]
+    assert scaling_steps.run_threshold('30', runs[1], -1) == '10'
+    assert scaling_steps.run_threshold('30', runs[0], -1) == '30'
+
+
+def test_runs_alternating_back_and_forth():
+    runs = scaling_steps.expand_ladder([
+        {'From': 0, 'Adjustment': '10%'},
+        {'From': 5, 'Adjustment': 2},
+        {'From': 15, 'Adjustment': '100%'},
+    ], 1)
+    assert [run['offset'] for run in runs] == [0, 5, 15]
+    # Every run but the last ends in a zero step where the next one starts
+    assert runs[0]['steps'][-1] == {
+        'ScalingAdjustment': '0', 'MetricIntervalLowerBound': 5}
+    assert runs[1]['steps'] == [
+        {'ScalingAdjustment': '2',
+         'MetricIntervalLowerBound': 0, 'MetricIntervalUpperBound': 10},
+        {'ScalingAdjustment': '0', 'MetricIntervalLowerBound': 10}]
+    assert runs[2]['steps'] == [
+        {'ScalingAdjustment': '100', 'MetricIntervalLowerBound': 0}]
+    assert [scaling_steps.run_suffix(i) for i in range(3)] == [
+        '', 'Step2', 'Step3']
+
+
+@pytest.mark.parametrize('steps, direction', [
+    ([{'From': 5, 'Adjustment': 1}], 1),
+    ([{'From': 0, 'Adjustment': 1}, {'From': 0, 'Adjustment': 2}], 1),
+    ([{'From': 0, 'Adjustment': -1}], 1),
+    ([{'From': 0, 'Adjustment': '10%'}], -1),
+])
+def test_invalid_ladders(steps, direction):
+    with pytest.raises(ValueError):
+        scaling_steps.expand_ladder(steps, direction)
+
+
+def test_alarm_evaluation():
+    assert scaling_steps.alarm_evaluation({}) == {'EvaluationPeriods': '1'}
+    assert scaling_steps.alarm_evaluation(
+        {'EvaluationPeriods': 3, 'DatapointsToAlarm': 2}) == {
+            'EvaluationPeriods': '3', 'DatapointsToAlarm': '2'}
+    with pytest.raises(ValueError):
+        scaling_steps.alarm_evaluation(
+            {'EvaluationPeriods': 2, 'DatapointsToAlarm': 3})
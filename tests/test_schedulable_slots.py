@@ -0,0 +1,259 @@
+"""ECSPipeline/schedulable_slots.py against stub ECS and CloudWatch clients."""
+
+import hashlib
+import os
+
+import pytest
+
+from capacity.configs import load_module
+
+
+schedulable_slots = load_module(
+    'schedulable_slots', os.path.join('ECSPipeline', 'schedulable_slots.py'))
+
+
+def _page(items, key, page_size, nextToken=None):
+    start = int(nextToken or 0)
+    response = {key: items[start:start + page_size]}
+    if start + page_size < len(items):
+        response['nextToken'] = str(start + page_size)
+    return response
+
+
+class StubECS(object):
+    """Serves services, task definitions and container instances a few at
+    a time, as the ECS API pages them."""
+
+    def __init__(self, services, task_definitions, instances, page_size=2):
+        self.services = services
+        self.task_definitions = task_definitions
+        self.instances = instances
+        self.page_size = page_size
+        self.calls = []
+
+    def list_services(self, cluster, nextToken=None):
+        self.calls.append(('list_services', nextToken))
+        return _page([s['serviceArn'] for s in self.services],
+                     'serviceArns', self.page_size, nextToken)
+
+    def describe_services(self, cluster, services):
+        return {'services': [s for s in self.services
+                             if s['serviceArn'] in services]}
+
+    def describe_task_definition(self, taskDefinition):
+        return {'taskDefinition': self.task_definitions[taskDefinition]}
+
+    def list_container_instances(self, cluster, status, nextToken=None):
+        self.calls.append(('list_container_instances', nextToken))
+        return _page([i['containerInstanceArn'] for i in self.instances],
+                     'containerInstanceArns', self.page_size, nextToken)
+
+    def describe_container_instances(self, cluster, containerInstances):
+        return {'containerInstances': [
+            i for i in self.instances
+            if i['containerInstanceArn'] in containerInstances]}
+
+
+class StubCloudWatch(object):
+
+    def __init__(self):
+        self.published = []
+
+    def put_metric_data(self, **kwargs):
+        self.published.append(kwargs)
+
+
+def instance(name, cpu, memory, ports=(), status='ACTIVE', connected=True):
+    return {
+        'containerInstanceArn': name,
+        'status': status,
+        'agentConnected': connected,
+        'remainingResources': [
+            {'name': 'CPU', 'integerValue': cpu},
+            {'name': 'MEMORY', 'integerValue': memory},
+            {'name': 'PORTS', 'stringSetValue': list(ports)},
+        ],
+    }
+
+
+def service(name, task_definition, **kwargs):
+    return dict(serviceArn=name, taskDefinition=task_definition, **kwargs)
+
+
+TASK_DEFINITIONS = {
+    'web:1': {
+        'cpu': '256',
+        'memory': '512',
+        'containerDefinitions': [{'portMappings': [
+            {'containerPort': 3000, 'hostPort': 0}]}],
+    },
+    'worker:1': {
+        'containerDefinitions': [
+            {'cpu': 512, 'memory': 1024, 'memoryReservation': 256},
+            {'cpu': 128, 'memory': 128},
+        ],
+    },
+    'fargate:1': {
+        'networkMode': 'awsvpc',
+        'cpu': '4096',
+        'memory': '8192',
+        'containerDefinitions': [],
+    },
+}
+
+
+def stub_cluster(instances):
+    return StubECS(
+        [
+            service('web', 'web:1'),
+            service('worker', 'worker:1'),
+            service('api', 'fargate:1', launchType='FARGATE'),
+            service('batch', 'fargate:1', capacityProviderStrategy=[
+                {'capacityProvider': 'FARGATE_SPOT', 'weight': 1}]),
+        ],
+        TASK_DEFINITIONS,
+        instances,
+    )
+
+
+def test_pages_follow_next_token():
+    ecs = StubECS([service(str(n), 'web:1') for n in range(5)], {}, [])
+    assert list(schedulable_slots._pages(
+        ecs.list_services, 'serviceArns', cluster='c')) == [
+            '0', '1', '2', '3', '4']
+    assert ecs.calls == [
+        ('list_services', None),
+        ('list_services', '2'),
+        ('list_services', '4'),
+    ]
+
+
+def test_task_requirements():
+    web = schedulable_slots.task_requirements(TASK_DEFINITIONS['web:1'])
+    # Task-level sizes win, and dynamic host ports are not fixed
+    assert web == {'cpu': 256, 'memory': 512, 'ports': set()}
+    worker = schedulable_slots.task_requirements(TASK_DEFINITIONS['worker:1'])
+    # Containers reserve their soft limit where they have one
+    assert worker == {'cpu': 640, 'memory': 384, 'ports': set()}
+
+
+def test_task_requirements_fixed_ports():
+    bridge = schedulable_slots.task_requirements({'containerDefinitions': [
+        {'memory': 64, 'portMappings': [{'containerPort': 80,
+                                         'hostPort': 8080}]}]})
+    assert bridge['ports'] == {'8080'}
+    host = schedulable_slots.task_requirements({
+        'networkMode': 'host',
+        'containerDefinitions': [
+            {'memory': 64, 'portMappings': [{'containerPort': 80}]}]})
+    assert host['ports'] == {'80'}
+
+
+def test_largest_task_skips_fargate_services():
+    ecs = stub_cluster([])
+    # The largest CPU and memory of web and worker, not the Fargate task's
+    assert schedulable_slots.largest_task(ecs, 'c') == {
+        'cpu': 640, 'memory': 512, 'ports': set()}
+
+
+def test_largest_task_without_ec2_services():
+    ecs = StubECS([service('api', 'fargate:1', launchType='FARGATE')],
+                  TASK_DEFINITIONS, [])
+    assert schedulable_slots.largest_task(ecs, 'c') is None
+
+
+@pytest.mark.parametrize('remaining, expected', [
+    # Limited by memory, then by CPU
+    (instance('i', 2048, 1024), 2),
+    (instance('i', 600, 4096), 2),
+    (instance('i', 100, 4096), 0),
+    # Instances that cannot take tasks hold no slots
+    (instance('i', 2048, 4096, status='DRAINING'), 0),
+    (instance('i', 2048, 4096, connected=False), 0),
+])
+def test_instance_slots(remaining, expected):
+    task = {'cpu': 256, 'memory': 512, 'ports': set()}
+    assert schedulable_slots.instance_slots(remaining, task) == expected
+
+
+def test_instance_slots_fixed_port():
+    task = {'cpu': 256, 'memory': 512, 'ports': {'8080'}}
+    # A fixed host port fits one copy, and none once it is taken
+    free = instance('i', 2048, 4096, ports=['22', '51678'])
+    taken = instance('i', 2048, 4096, ports=['22', '8080'])
+    assert schedulable_slots.instance_slots(free, task) == 1
+    assert schedulable_slots.instance_slots(taken, task) == 0
+
+
+def test_schedulable_slots_counts_every_page():
+    ecs = stub_cluster([
+        instance('a', 2048, 2048),
+        instance('b', 1280, 4096),
+        instance('c', 2048, 4096, connected=False),
+        instance('d', 640, 512),
+    ])
+    slots, task, instances = schedulable_slots.schedulable_slots(ecs, 'c')
+    # 640 CPU, 512 MiB copies: 3 + 2 + 0 + 1
+    assert (slots, instances) == (6, 4)
+    assert ('list_container_instances', '2') in ecs.calls
+
+
+def test_main_publishes_the_count():
+    ecs = stub_cluster([instance('a', 2048, 2048)])
+    cloudwatch = StubCloudWatch()
+    assert schedulable_slots.main(
+        ['--cluster', 'stag-cluster'], ecs, cloudwatch) == 3
+    assert cloudwatch.published == [{
+        'Namespace': 'ECS/Headroom',
+        'MetricData': [{
+            'MetricName': 'SchedulableSlots',
+            'Dimensions': [{'Name': 'ClusterName', 'Value': 'stag-cluster'}],
+            'Value': 3,
+            'Unit': 'Count',
+        }],
+    }]
+
+
+def test_main_dry_run_does_not_publish():
+    cloudwatch = StubCloudWatch()
+    schedulable_slots.main(
+        ['--cluster', 'c', '--dry-run'],
+        stub_cluster([instance('a', 2048, 2048)]), cloudwatch)
+    assert cloudwatch.published == []
+
+
+def test_main_without_ec2_services_does_not_publish():
+    ecs = StubECS([service('api', 'fargate:1', launchType='FARGATE')],
+                  TASK_DEFINITIONS, [instance('a', 2048, 2048)])
+    cloudwatch = StubCloudWatch()
+    assert schedulable_slots.main(['--cluster', 'c'], ecs, cloudwatch) == 0
+    assert cloudwatch.published == []
+
+
+def test_cluster_defaults_to_the_environment(monkeypatch):
+    monkeypatch.setenv('ECS_CLUSTER', 'prod-cluster')
+    assert schedulable_slots.parse_args([]).cluster == 'prod-cluster'
+
+
+def test_cluster_template_loads_the_agent_from_s3():
+    cluster_template = load_module(
+        'ecs_cluster_template',
+        os.path.join('ECSPipeline', 'ecs-cluster-cf-template.py'))
+    config = {
+        'instanceSize': 't3.medium',
+        'desiredCapacity': '1',
+        'minCapacity': '1',
+        'maxCapacity': '4',
+        'SchedulableSlots': {'ScaleUpBelow': 1},
+    }
+    template = cluster_template.build_cluster_template(config).to_dict()
+    agent = template['Resources']['SlotsAgent']['Properties']
+    # The agent is too long for inline code
+    assert 'ZipFile' not in agent['Code']
+    assert agent['Code'] == {'S3Bucket': {'Ref': 'SlotsAgentBucket'},
+                             'S3Key': {'Ref': 'SlotsAgentKey'}}
+    assert agent['Handler'] == 'schedulable_slots.handler'
+    # A change to the agent still changes the template
+    with open(schedulable_slots.__file__, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    assert agent['Tags'] == [{'Key': 'SourceSha256', 'Value': digest}]
@@ -0,0 +1,173 @@
+"""capacity.simulate on a step in demand."""
+
+import csv
+
+import numpy as np
+import pytest
+import yaml
+
+from capacity import simulate
+
+
+SERVICE = {
+    'TaskCPU': '256',
+    'TaskMemory': '512',
+    'DesiredTaskCapacity': '2',
+    'MinTaskCapacity': '2',
+    'MaxTaskCapacity': '10',
+    'ScalingMetric': 'CPU',
+    'ScaleUpLevel': '60',
+    'ScaleDownLevel': '20',
+}
+
+# Seven of the service's tasks fit on a t3.medium
+CLUSTER = {
+    'instanceSize': 't3.medium',
+    'desiredCapacity': '1',
+    'minCapacity': '1',
+    'maxCapacity': '4',
+    'ScalingMetric': 'CPU',
+    'ScaleUpLevel': '75',
+    'ScaleDownLevel': '30',
+}
+
+# 10 requests a minute, then 200, at 20 requests per task
+STEP = [0.5] * 3 + [10.0] * 12
+
+
+def run(demand, service=SERVICE, cluster=CLUSTER, **kwargs):
+    params = simulate.stack_parameters(
+        [simulate.variant_parameters(service, cluster, 3)])
+    result = simulate.simulate(np.array(demand), params, timeline=True,
+                               **kwargs)
+    timeline = dict((key, values[0].tolist())
+                    for key, values in result['timeline'].items())
+    return result, timeline
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('50:90:10', [50, 60, 70, 80, 90]),
+    ('0.5:1.5:0.5', [0.5, 1, 1.5]),
+    ('1,2,3', [1, 2, 3]),
+    ('t3.small,t3.medium', ['t3.small', 't3.medium']),
+])
+def test_sweep_values(text, expected):
+    assert simulate.sweep_values(text) == expected
+
+
+def test_sweep_step_must_be_positive():
+    with pytest.raises(ValueError):
+        simulate.sweep_values('90:50:0')
+
+
+def test_alarm_history_needs_datapoints_within_periods():
+    # Two of three minutes for the first alarm, every minute for the second
+    alarm = simulate.AlarmHistory(np.array([3, 1]), np.array([2, 1]))
+    states = [alarm.update(np.array([breaching, breaching])).tolist()
+              for breaching in (True, False, True, False, False, True)]
+    assert states == [
+        [False, True],
+        [False, False],
+        [True, True],
+        [False, False],
+        [False, False],
+        [False, True],
+    ]
+
+
+def test_ladder_change_mixes_absolute_and_percentage_bands():
+    params = simulate.stack_parameters([
+        {'up_ladder': [(0.0, 1, False), (10.0, 30, True)]},
+        {'up_ladder': [(0.0, 50, True)]},
+    ])
+    change = simulate.ladder_change
+
+    # Below the second band, one task; past it, 30% of the capacity
+    assert change(params, 'up_ladder', np.array([5.0, 5.0]),
+                  np.array([10, 10])).tolist() == [1, 5]
+    assert change(params, 'up_ladder', np.array([15.0, 15.0]),
+                  np.array([10, 3])).tolist() == [3, 1]
+    # The padded band of the shorter ladder is never reached
+    assert change(params, 'up_ladder', np.array([1000.0, 1000.0]),
+                  np.array([4, 4])).tolist() == [1, 2]
+
+
+def test_ladder_change_scales_in_by_at_least_one():
+    params = simulate.stack_parameters([
+        {'down_ladder': [(0.0, -50, True)]}])
+    assert simulate.ladder_change(
+        params, 'down_ladder', np.array([5.0]), np.array([3])).tolist() == [-1]
+
+
+def test_step_in_demand():
+    result, timeline = run(STEP)
+    # The two tasks serve the first step minute, one more each minute after
+    assert timeline['serving'][2:7] == [2, 2, 3, 4, 5]
+    assert timeline['desired'][3:6] == [3, 4, 5]
+    # The eighth task waits for a second instance to boot
+    assert max(timeline['pending']) > 0
+    assert timeline['saturated'].index(True) == 3
+    assert result['saturated_minutes'][0] == sum(timeline['saturated'])
+    assert result['peak_shortfall'][0] == pytest.approx(8)
+
+
+def test_saturation_windows_use_the_serving_tasks():
+    _, timeline = run(STEP)
+    windows = simulate.saturation_windows(
+        timeline['saturated'], STEP, timeline['serving'])
+    assert len(windows) == 1
+    start, end, shortfall = windows[0]
+    assert start == 3
+    assert end - start == sum(timeline['saturated'])
+    assert shortfall == pytest.approx(8)
+
+
+def test_saturation_level_lowers_capacity():
+    result, _ = run([1.5] * 5, saturation_level=50)
+    # Two tasks serve one task's worth of demand at 50%
+    assert result['saturated_minutes'][0] > 0
+    result, _ = run([1.5] * 5)
+    assert result['saturated_minutes'][0] == 0
+
+
+def test_sweep_simulates_every_variant():
+    sweeps = [('service.ScaleUpLevel', [40, 60]),
+              ('cluster.maxCapacity', [1, 4])]
+    settings, params = [], []
+    for values, service, cluster in simulate.variants(
+            SERVICE, CLUSTER, sweeps):
+        settings.append(values)
+        params.append(simulate.variant_parameters(service, cluster, 3))
+    result = simulate.simulate(np.array(STEP),
+                               simulate.stack_parameters(params))
+    assert len(settings) == 4
+    capped = [index for index, values in enumerate(settings)
+              if values['cluster.maxCapacity'] == 1]
+    # One instance holds seven tasks, so those variants stay saturated
+    for index in capped:
+        assert result['max_tasks'][index] == 7
+        assert result['max_instances'][index] == 1
+        assert result['saturated_minutes'][index] == len(STEP) - 3
+    assert result['saturated_minutes'].max() == len(STEP) - 3
+    assert result['saturated_minutes'].min() < len(STEP) - 3
+
+
+def test_main_reports_the_shortfall(tmp_path, capsys):
+    trace = tmp_path / 'trace.csv'
+    trace.write_text('requests\n' + ''.join(
+        '{:g}\n'.format(load * 20) for load in STEP))
+    service = tmp_path / 'service_config.yaml'
+    service.write_text(yaml.safe_dump(SERVICE))
+    cluster = tmp_path / 'cluster_config.yaml'
+    cluster.write_text(yaml.safe_dump(CLUSTER))
+    output = tmp_path / 'simulation.csv'
+
+    assert simulate.main([
+        str(trace), '--requests-per-task', '20',
+        '--service-config', str(service), '--cluster-config', str(cluster),
+        '--output', str(output)]) == 0
+    assert "short by 8.0 tasks" in capsys.readouterr().out
+    with open(str(output), newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == len(STEP)
+    assert rows[3]['serving'] == '2'